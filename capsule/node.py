@@ -83,7 +83,7 @@ def getCapsuleDocumentVersionResource(document):
 #
 
 # XXX AT: cannot get an integer revision number for VersionHistoryResource =>
-# cannot be used with IOBTree graphs
+# can only be used with IOBTree graphs interning identifiers
 
 @zope.component.adapter(IDocument)
 @zope.interface.implementer(IVersionHistoryResource)
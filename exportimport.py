@@ -18,6 +18,11 @@
 """CPSRelation XML Adapters.
 """
 
+import posixpath
+from StringIO import StringIO
+
+from Acquisition import aq_inner, aq_parent
+
 from zope.app import zapi
 from zope.component import adapts
 from zope.interface import implements
@@ -39,6 +44,10 @@ from Products.CPSUtil.PropertiesPostProcessor import \
 from Products.CPSRelation.interfaces import IRelationTool
 from Products.CPSRelation.interfaces import IGraph
 from Products.CPSRelation.iobtree.interfaces import IIOBTreeRelation
+from Products.CPSRelation.iobtree.iobtreerelation import SavepointCounter
+from Products.CPSRelation.iobtree.iobtreerelation import iter_batches
+from Products.CPSRelation.iobtree.iobtreerelation import merge_sorted
+from Products.CPSRelation.node import PrefixedResource
 
 from Products.CPSRelation.interfaces import IObjectSerializerTool
 from Products.CPSRelation.interfaces import IObjectSerializer
@@ -49,6 +58,12 @@ REL_NAME = 'relations'
 SER_TOOL = 'portal_serializer'
 SER_NAME = 'serializers'
 
+# maximum number of edges written in a relation edges data file
+EDGES_CHUNK_SIZE = 100000
+
+# number of keys updated between two savepoints when importing edges
+EDGES_SAVEPOINT = 10000
+
 # relations
 
 def exportRelationTool(context):
@@ -92,6 +107,101 @@ def _purge_graph(graph, logger=None):
 
     return removed_all
 
+
+def iter_edges_chunks(relation, size=EDGES_CHUNK_SIZE):
+    """Iterate over the contents of the edges data files of an IOBTree
+    relation
+
+    Each chunk holds at most size edges, sorted by subject and object. An
+    edge is a line with the subject and object identifiers separated by a
+    tab: integer ids, or identifiers for interned ids.
+    """
+    get_identifier = relation._getStringIdentifier
+    for edges in iter_batches(relation.iterEdges(), size):
+        yield ''.join(['%s\t%s\n' % (get_identifier(int_subject),
+                                      get_identifier(int_object))
+                       for int_subject, int_object in edges])
+
+
+def _get_edge_id(relation, identifier, prefix):
+    """Get the integer id of an identifier read in an edges data file
+
+    Identifiers that are not positive integers are interned by the graph.
+    """
+    try:
+        int_id = int(identifier)
+    except ValueError:
+        int_id = -1
+    if int_id < 0:
+        resource = PrefixedResource(prefix, identifier)
+        int_id = relation._getIntegerIdentifier(resource, prefix,
+                                                create=True)
+    return int_id
+
+
+def iter_edges_lines(text):
+    """Iterate over the (subject, object) identifiers of an edges data file
+
+    The file is read line by line, without splitting the whole text.
+    """
+    for line in StringIO(text):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        try:
+            subject, object = line.split('\t')
+        except ValueError:
+            raise ValueError("Invalid edge %r" % (line,))
+        yield subject, object
+
+
+def iter_edges(relation, text):
+    """Iterate over the (int_subject, int_object) tuples of an edges data
+    file, parsing it line by line
+    """
+    try:
+        for subject, object in iter_edges_lines(text):
+            yield (_get_edge_id(relation, subject, relation.subject_prefix),
+                   _get_edge_id(relation, object, relation.object_prefix))
+    except ValueError, err:
+        raise ValueError("%s for relation %s" % (err, relation.getId()))
+
+
+def is_sorted_edges(text):
+    """Tell if an edges data file only holds integer ids in sorted order
+
+    This is the case of files exported from relations without interned
+    identifiers. The file is read line by line.
+    """
+    last = None
+    try:
+        for subject, object in iter_edges_lines(text):
+            edge = (int(subject), int(object))
+            if edge[0] < 0 or edge[1] < 0:
+                return False
+            if last is not None and edge < last:
+                return False
+            last = edge
+    except ValueError:
+        return False
+    return True
+
+
+def iter_sorted_edges(relation, text):
+    """Iterate over the sorted (int_subject, int_object) tuples of an edges
+    data file
+
+    Sorted files of integer ids, as written by exports, are parsed line by
+    line while they are iterated. Other files (interned identifiers, files
+    written by hand) are parsed and sorted as a whole.
+    """
+    if is_sorted_edges(text):
+        return iter_edges(relation, text)
+    tuples = list(iter_edges(relation, text))
+    tuples.sort()
+    return iter(tuples)
+
+
 class RelationToolXMLAdapter(XMLAdapterBase, ObjectManagerHelpers):
     """XML importer and exporter for Relation tool.
     """
@@ -206,6 +316,8 @@ class RelationXMLAdapter(XMLAdapterBase, PropertyManagerHelpers):
         name = self.context.getId()
         node.setAttribute('name', name)
         node.appendChild(self._extractProperties())
+        if self._getGraph().export_edges:
+            node.appendChild(self._extractEdges())
         self._logger.info("%s relation exported." % self.context.getId())
         return node
 
@@ -215,8 +327,82 @@ class RelationXMLAdapter(XMLAdapterBase, PropertyManagerHelpers):
         if self.environ.shouldPurge():
             self._purgeProperties()
         self._initProperties(node)
+        self._initEdges(node)
         self._logger.info("%s relation imported." % self.context.getId())
 
+    def _getGraph(self):
+        return aq_parent(aq_inner(self.context))
+
+    def _extractEdges(self):
+        """Write the relation edges in data files, and return the edges nodes
+        referencing them
+
+        Files are written by chunks of EDGES_CHUNK_SIZE edges, streaming from
+        the relation trees.
+        """
+        relation = self.context
+        subdir = '%s/%s' % (REL_NAME, self._getGraph().getId())
+        fragment = self._doc.createDocumentFragment()
+        for i, text in enumerate(iter_edges_chunks(relation)):
+            filename = '%s-%s.txt' % (relation.getId(), i + 1)
+            self.environ.writeDataFile(filename, text, 'text/plain', subdir)
+            child = self._doc.createElement('edges')
+            child.setAttribute('file', '%s/%s' % (subdir, filename))
+            fragment.appendChild(child)
+        return fragment
+
+    def _iterEdgesFiles(self, node):
+        """Iterate over (path, text) tuples for the data files referenced by
+        edges nodes
+
+        text is None if the file is not found.
+        """
+        for child in node.childNodes:
+            if child.nodeName != 'edges':
+                continue
+            path = str(child.getAttribute('file'))
+            subdir, filename = posixpath.split(path)
+            text = self.environ.readDataFile(filename, subdir or None)
+            if text is None:
+                self._logger.warning("Edges file %s of relation %s not found"
+                                     % (path, self.context.getId()))
+            yield path, text
+
+    def _initEdges(self, node):
+        """Import the edges of the data files referenced by edges nodes
+
+        When purging, the relation is synced with the files: edges that are
+        not in the files are removed, and only the differences are written.
+        This depends on the imported data only, not on the export_edges
+        property of the target graph. Files are merged lazily, see
+        iter_sorted_edges. Otherwise edges are added file by file through
+        the bulk API, parsing files line by line. Nothing is done without
+        edges nodes.
+        """
+        relation = self.context
+        files = list(self._iterEdgesFiles(node))
+        if not files:
+            return
+        if self.environ.shouldPurge():
+            # do not remove the edges of a missing file
+            missing = [path for path, text in files if text is None]
+            if not missing:
+                tuples = merge_sorted([iter_sorted_edges(relation, text)
+                                       for path, text in files])
+                res = relation.syncIds(tuples, EDGES_SAVEPOINT)
+                self._logger.info("Edges of relation %s synced: %s added, "
+                                  "%s removed, %s unchanged"
+                                  % (relation.getId(), res['added'],
+                                     res['removed'], res['unchanged']))
+                return
+        counter = SavepointCounter(EDGES_SAVEPOINT)
+        for path, text in files:
+            if text is None:
+                continue
+            added = relation.addIds(iter_edges(relation, text), counter)
+            self._logger.info("%s edges of relation %s imported from %s"
+                              % (added, relation.getId(), path))
+
     node = property(_exportNode, _importNode)
 
     def _exportBody(self):
@@ -25,6 +25,8 @@
 
 import zope.interface
 
+from Products.CPSRelation.pathfinder import MAX_VISITED
+
 
 class IGraph(zope.interface.Interface):
     """Interface for graphs/models dealing with relations
@@ -61,6 +63,49 @@ class IGraph(zope.interface.Interface):
         statement can use None nodes as wild cards.
         """
 
+    def iterStatements(statement=None):
+        """Iterate over IStatement objects matching the pattern
+
+        If statement is None, iterate over all statements.
+        statement can use None nodes as wild cards.
+        """
+
+    def getStatementsPage(statement=None, limit=20, cursor=None):
+        """Get a page of IStatement objects matching the pattern
+
+        If statement is None, all statements are paginated.
+        statement can use None nodes as wild cards. cursor is an opaque
+        string given by the previous page, None for the first page.
+
+        Return a tuple (statements, next_cursor), next_cursor being None on
+        the last page.
+        """
+
+    def getSubjectsForMany(predicate, objects):
+        """Get a mapping from given objects to the items matching the
+        IStatement(None, predicate, object)
+        """
+
+    def getObjectsForMany(subjects, predicate):
+        """Get a mapping from given subjects to the items matching the
+        IStatement(subject, predicate, None)
+        """
+
+    def countStatements(statement=None):
+        """Count statements matching the pattern
+
+        If statement is None, count all statements.
+        statement can use None nodes as wild cards.
+        """
+
+    def countSubjects(predicate, object):
+        """Count items matching the IStatement(None, predicate, object)
+        """
+
+    def countObjects(subject, predicate):
+        """Count items matching the IStatement(subject, predicate, None)
+        """
+
     def getSubjects(predicate, object):
         """Get items matching the IStatement(None, predicate, object)
         """
@@ -73,6 +118,18 @@ class IGraph(zope.interface.Interface):
         """Get items matching the IStatement(subject, predicate, None)
         """
 
+    def findPath(source, target, predicates=None, max_depth=None,
+                 max_visited=MAX_VISITED):
+        """Find a shortest chain of statements leading from source to target
+
+        predicates is a list of resources to follow, all predicates are
+        followed if None.
+
+        Return the list of statements, or None if no path of at most
+        max_depth statements was found while visiting at most max_visited
+        nodes.
+        """
+
     def hasStatement(statement):
         """Return True if given IStatement is in the graph
 
@@ -91,10 +148,12 @@ class IGraph(zope.interface.Interface):
         """Clear the graph, removing all statements in it
         """
 
-    def query(query_string, language, base_uri=None):
+    def query(query_string, language, base_uri=None, limit=None,
+              offset=None):
         """Query the graph, return an IQueryResult
 
         language is the query language (sparql, rdql...)
+        If given, limit and offset restrict the results to a page.
         """
 
     # I/O
@@ -33,3 +33,7 @@ class IQueryResult(zope.interface.Interface):
     variable_names = zope.interface.Attribute("Keys of the binding results")
     count = zope.interface.Attribute("Results count")
     results = zope.interface.Attribute("Results")
+
+    def __iter__():
+        """Iterate over the results
+        """
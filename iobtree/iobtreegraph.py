@@ -23,23 +23,84 @@
 """Graph using IOBtree objects to store relations between integers
 """
 
+import logging
+
 from Globals import InitializeClass, DTMLFile
 from AccessControl import ClassSecurityInfo
 
+from itertools import islice
+
 from zope.interface import implements
 
+from BTrees.IIBTree import difference as ii_difference
+from BTrees.IIBTree import intersection as ii_intersection
+from BTrees.IIBTree import multiunion as ii_multiunion
+from BTrees.IOBTree import IOBTree
+from BTrees.Length import Length
+from BTrees.OIBTree import OIBTree
+from BTrees.OOBTree import OOTreeSet
+from BTrees.OOBTree import intersection as oo_intersection
+
 from Products.CMFCore.permissions import ManagePortal, View
 from Products.CMFCore.utils import UniqueObject
 from Products.CMFCore.PortalFolder import PortalFolder
 
 from Products.CPSRelation.interfaces import IGraph
+from Products.CPSRelation.interfaces import IResource
 from Products.CPSRelation.interfaces import IPrefixedResource
 from Products.CPSRelation.statement import Statement
 from Products.CPSRelation.iobtree.iobtreerelation import IOBTreeRelation
+from Products.CPSRelation.iobtree.iobtreerelation import iter_batches
+from Products.CPSRelation.iobtree.iobtreerelation import \
+     get_savepoint_counter
+from Products.CPSRelation.iobtree.iobtreerelation import \
+     get_integer_identifier
+from Products.CPSRelation.iobtree.iobtreerelation import get_identifier
+from Products.CPSRelation.iobtree.iobtreerelation import UNKNOWN_ID
+from Products.CPSRelation.iobtree.iobtreerelation import get_tree_flavour
+from Products.CPSRelation.iobtree.iobtreerelation import MAX_REPORTED
+from Products.CPSRelation.iobtree.iobtreerelation import make_cursor
+from Products.CPSRelation.iobtree.iobtreerelation import parse_cursor
+from Products.CPSRelation.pathfinder import MAX_VISITED
+from Products.CPSRelation.pathfinder import find_path
 from Products.CPSRelation.graphregistry import GraphRegistry
 from Products.CPSRelation.graphdrawer import GraphDrawer
 from Products.CPSRelation.commithooks import get_relation_manager
 
+logger = logging.getLogger("CPSRelation.IOBTreeGraph")
+
+
+def combine_ids(all_of=(), any_of=(), none_of=(), flavour=None):
+    """Combine integer sets: keep ids present in all sets of all_of and in at
+    least one set of any_of, then remove ids present in a set of none_of
+
+    Sets are combined with the BTrees C primitives of given TreeFlavour
+    (32 bits sets by default), intersections starting with the smallest set.
+    The result must not be modified.
+    """
+    if flavour is None:
+        multiunion = ii_multiunion
+        intersection = ii_intersection
+        difference = ii_difference
+    else:
+        multiunion = flavour.multiunion
+        intersection = flavour.intersection
+        difference = flavour.difference
+    positive = list(all_of)
+    if any_of:
+        positive.append(multiunion(list(any_of)))
+    if not positive:
+        raise ValueError("At least one set to intersect is needed")
+    positive.sort(key=len)
+    res = positive[0]
+    for ids in positive[1:]:
+        if not res:
+            break
+        res = intersection(res, ids)
+    if res and none_of:
+        res = difference(res, multiunion(list(none_of)))
+    return res
+
 
 class IOBTreeGraph(UniqueObject, PortalFolder):
     """Graph using IOBtree objects to store relations between integers
@@ -55,15 +116,69 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
         {'id': 'synchronous', 'type': 'boolean', 'mode': 'w',
          'label': "Synchronous",
          },
+        # index of relations where each id appears, speeds up lookups with
+        # a None predicate
+        {'id': 'predicate_index', 'type': 'boolean', 'mode': 'w',
+         'label': "Predicate index",
+         },
+        # map non integer identifiers to integer ids
+        {'id': 'intern_identifiers', 'type': 'boolean', 'mode': 'w',
+         'label': "Intern identifiers",
+         },
+        # write relations edges in data files when exporting profiles
+        {'id': 'export_edges', 'type': 'boolean', 'mode': 'w',
+         'label': "Export edges",
+         },
         )
     # default values
     synchronous = True
-
-    def __init__(self, id, synchronous=True):
+    predicate_index = False
+    intern_identifiers = False
+    export_edges = False
+    # intern table: identifier -> negative id, and negative id -> identifier,
+    # None until identifiers are interned
+    _intern_ids = None
+    _intern_strings = None
+    # predicate index trees: id -> OOTreeSet of relation ids
+    _subject_predicates = None
+    _object_predicates = None
+    # resource index: id -> number of relations trees holding it as a key,
+    # None for graphs created by older versions
+    _resources = None
+    _resources_length = None
+    # key type of the indexes and set operations, None for graphs created by
+    # older versions
+    _key_type = None
+    # (relation id, finished) tuple of the last relation reached by a
+    # repair, None if no repair is in progress
+    _repair_checkpoint = None
+
+    def __init__(self, id, synchronous=True, predicate_index=False,
+                 intern_identifiers=False):
         """Initialization
         """
         self.id = id
         self.synchronous = synchronous
+        self.predicate_index = predicate_index
+        self.intern_identifiers = intern_identifiers
+        self._key_type = 'I'
+        self.rebuildPredicateIndex()
+        self.rebuildResourceIndex()
+        if intern_identifiers:
+            self._initInternTable()
+
+    def _updateProperty(self, id, value):
+        """Update property, maintaining the predicate index if needed
+        """
+        PortalFolder._updateProperty(self, id, value)
+        if id == 'predicate_index':
+            if bool(self.predicate_index) != self._hasPredicateIndex():
+                self.rebuildPredicateIndex()
+        elif id == 'intern_identifiers':
+            # existing interned identifiers are kept, they may still be used
+            # by relations
+            if self.intern_identifiers and self._intern_ids is None:
+                self._initInternTable()
 
     security.declarePrivate('_isSynchronous')
     def _isSynchronous(self):
@@ -116,8 +231,12 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
             return 0
 
     security.declareProtected(ManagePortal, 'addRelation')
-    def addRelation(self, id, prefix='', subject_prefix='', object_prefix=''):
+    def addRelation(self, id, prefix='', subject_prefix='', object_prefix='',
+                    key_type='I'):
         """Add a relation to the relations tool
+
+        key_type is 'I' for relations between 32 bits uids, 'L' for 64 bits
+        uids.
         """
         if self.hasRelation(id):
             raise ValueError("The id '%s' is invalid - it is already in use"%id)
@@ -125,10 +244,12 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
             relation = IOBTreeRelation(id=id,
                                        prefix=prefix,
                                        subject_prefix=subject_prefix,
-                                       object_prefix=object_prefix)
+                                       object_prefix=object_prefix,
+                                       key_type=key_type)
             # FIXME: there's a 'title' attribute in the acquisition path
             # preventing to add a relation with a 'title' id...
             id = self._setObject(id, relation)
+            self._updateIndexesFlavour()
             return self._getOb(id)
 
 
@@ -137,7 +258,434 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
         """Delete a relation from the relations tool
         """
         if self.hasRelation(id):
+            self._unindexRelation(self._getRelation(id))
             self._delObject(id)
+            self._updateIndexesFlavour()
+
+
+    security.declareProtected(ManagePortal, 'updateLength')
+    def updateLength(self):
+        """Recompute the statements counters of all relations
+
+        Return the number of statements in the graph.
+        """
+        length = 0
+        for relation in self._getRelations():
+            length += relation.updateLength()
+        return length
+
+
+    security.declareProtected(ManagePortal, 'upgradeStorage')
+    def upgradeStorage(self):
+        """Upgrade the storage of all relations held by the graph
+
+        Return the number of converted entries.
+        """
+        count = 0
+        for relation in self._getRelations():
+            converted = relation.upgradeStorage()
+            if converted:
+                logger.info("Converted %s entries of relation %s in graph %s"
+                            % (converted, relation.getId(), self.getId()))
+            count += converted
+        if self._key_type is None:
+            self._key_type = self._computeKeyType()
+        if self._resources is None:
+            self.rebuildResourceIndex()
+        return count
+
+
+    security.declareProtected(ManagePortal, 'check')
+    def check(self, max_reported=MAX_REPORTED):
+        """Check that the trees of all relations held by the graph match
+
+        Return a dictionary with relation ids as keys and check reports as
+        values, see IOBTreeRelation.check.
+        """
+        res = {}
+        for relation in self._getRelations():
+            res[relation.getId()] = relation.check(max_reported)
+        return res
+
+
+    security.declareProtected(ManagePortal, 'repair')
+    def repair(self, max_keys=None):
+        """Repair the inverse trees of all relations held by the graph
+
+        Relations are repaired one after the other in id order, see
+        IOBTreeRelation._repair: if max_keys is given, the repair stops after
+        about max_keys keys. A checkpoint holding the id of the last relation
+        reached, and whether it is finished, is stored on the graph: calling
+        repair again skips finished relations and resumes the current one
+        from its own checkpoint. Indexes are rebuilt once all relations are
+        repaired.
+
+        Return a dictionary with the following keys:
+        - 'relations': a dictionary with relation ids as keys and repair
+          reports of this call as values,
+        - 'keys': the number of keys walked by this call,
+        - 'done': True if all relations are repaired.
+        """
+        res = {'relations': {},
+               'keys': 0,
+               'done': False,
+               }
+        ids = list(self.listRelationIds())
+        ids.sort()
+        checkpoint = self._repair_checkpoint
+        for id in ids:
+            if checkpoint is not None:
+                last_id, finished = checkpoint
+                if id < last_id or (id == last_id and finished):
+                    continue
+            if max_keys is None:
+                remaining = None
+            else:
+                remaining = max_keys - res['keys']
+                if remaining <= 0:
+                    return res
+            report = self._getRelation(id)._repair(remaining)
+            res['relations'][id] = report
+            res['keys'] += report['keys']
+            self._repair_checkpoint = (id, report['done'])
+            if not report['done']:
+                return res
+        self._repair_checkpoint = None
+        self.rebuildResourceIndex()
+        self.rebuildPredicateIndex()
+        logger.info("Repaired graph %s" % (self.getId(),))
+        res['done'] = True
+        return res
+
+    #
+    # Key types
+    #
+
+    security.declarePrivate('_computeKeyType')
+    def _computeKeyType(self):
+        """Compute the key type of the graph from its relations
+
+        64 bits trees are used as soon as a relation uses them.
+        """
+        for relation in self._getRelations():
+            if relation.key_type == 'L':
+                return 'L'
+        return 'I'
+
+
+    security.declarePrivate('_getFlavour')
+    def _getFlavour(self):
+        """Get the TreeFlavour used by the graph indexes and set operations
+
+        The key type is kept on the graph and updated when relations are
+        added, deleted or converted, it is only computed from the relations
+        for graphs created by older versions.
+        """
+        key_type = self._key_type
+        if key_type is None:
+            key_type = self._computeKeyType()
+        return get_tree_flavour(key_type)
+
+
+    security.declarePrivate('_updateIndexesFlavour')
+    def _updateIndexesFlavour(self):
+        """Update the graph key type, and rebuild the indexes if they do not
+        use it
+
+        Called when a relation is added, deleted or its key type changes.
+        """
+        key_type = self._computeKeyType()
+        if key_type != self._key_type:
+            self._key_type = key_type
+        flavour = get_tree_flavour(key_type)
+        if (self._resources is not None
+            and not isinstance(self._resources, flavour.IntegerTree)):
+            self.rebuildResourceIndex()
+        if (self._hasPredicateIndex()
+            and not isinstance(self._subject_predicates, flavour.Tree)):
+            self.rebuildPredicateIndex()
+
+
+    security.declarePrivate('_getFlavourIds')
+    def _getFlavourIds(self, ids, flavour):
+        """Get given set of ids as a set of the flavour
+        """
+        if not isinstance(ids, flavour.TreeSet):
+            ids = flavour.TreeSet(ids)
+        return ids
+
+    #
+    # Predicate index
+    #
+
+    security.declarePrivate('_hasPredicateIndex')
+    def _hasPredicateIndex(self):
+        """Return True if the predicate index is maintained
+        """
+        return self._subject_predicates is not None
+
+
+    security.declarePrivate('_indexIds')
+    def _indexIds(self, index, ids, relation_id):
+        """Record that given ids appear in relation with given id
+        """
+        for id in ids:
+            relation_ids = index.get(id)
+            if relation_ids is None:
+                index[id] = OOTreeSet((relation_id,))
+            else:
+                # no write if relation id is already there
+                relation_ids.insert(relation_id)
+
+
+    security.declarePrivate('_unindexIds')
+    def _unindexIds(self, index, ids, relation_id):
+        """Record that given ids do not appear in relation with given id
+        """
+        for id in ids:
+            relation_ids = index.get(id)
+            if relation_ids is None or not relation_ids.has_key(relation_id):
+                continue
+            relation_ids.remove(relation_id)
+            if not relation_ids:
+                del index[id]
+
+
+    security.declarePrivate('_getTuplesKeys')
+    def _getTuplesKeys(self, relation, tuples, present):
+        """Get sorted distinct subjects and objects of given tuples
+
+        Only keep the ones that are (if present is True) or are not (if
+        present is False) keys of the relation trees.
+        """
+        subjects = [x for x in set([x[0] for x in tuples])
+                    if relation.hasSubjectId(x) == present]
+        subjects.sort()
+        objects = [x for x in set([x[1] for x in tuples])
+                   if relation.hasObjectId(x) == present]
+        objects.sort()
+        return subjects, objects
+
+
+    security.declarePrivate('_indexKeys')
+    def _indexKeys(self, relation, subjects, objects):
+        """Update indexes after given subjects and objects have been added as
+        keys of the relation trees
+        """
+        if self._hasPredicateIndex():
+            relation_id = relation.getId()
+            self._indexIds(self._subject_predicates, subjects, relation_id)
+            self._indexIds(self._object_predicates, objects, relation_id)
+        self._refResources(subjects, 1)
+        self._refResources(objects, 1)
+
+
+    security.declarePrivate('_unindexKeys')
+    def _unindexKeys(self, relation, subjects, objects):
+        """Update indexes after given subjects and objects have been removed
+        from the keys of the relation trees
+        """
+        if self._hasPredicateIndex():
+            relation_id = relation.getId()
+            self._unindexIds(self._subject_predicates, subjects, relation_id)
+            self._unindexIds(self._object_predicates, objects, relation_id)
+        self._refResources(subjects, -1)
+        self._refResources(objects, -1)
+
+
+    security.declarePrivate('_unindexRelation')
+    def _unindexRelation(self, relation):
+        """Remove relation from the indexes
+        """
+        self._unindexKeys(relation, relation.getAllSubjectIds(),
+                          relation.getAllObjectIds())
+
+
+    security.declarePrivate('_getCandidateRelations')
+    def _getCandidateRelations(self, subject, object):
+        """Get relations that may hold statements with given subject and
+        object, None values being wild cards
+
+        Nodes that cannot be converted to integers do not match any relation.
+        """
+        if not self._hasPredicateIndex() or (subject is None
+                                            and object is None):
+            return self._getRelations()
+        relation_ids = None
+        for node, index in ((subject, self._subject_predicates),
+                            (object, self._object_predicates)):
+            if node is None:
+                continue
+            try:
+                ids = index.get(self._getIntegerIdentifier(node))
+            except ValueError:
+                ids = None
+            if ids is None:
+                return []
+            if relation_ids is None:
+                relation_ids = ids
+            else:
+                relation_ids = oo_intersection(relation_ids, ids)
+        res = []
+        for relation_id in relation_ids:
+            relation = self._getOb(relation_id, None)
+            if relation is not None:
+                res.append(relation)
+        return res
+
+
+    security.declareProtected(ManagePortal, 'rebuildPredicateIndex')
+    def rebuildPredicateIndex(self):
+        """Rebuild the predicate index from the relations
+
+        The index is removed if the predicate_index property is not set.
+        """
+        if not self.predicate_index:
+            self._subject_predicates = None
+            self._object_predicates = None
+            return
+        flavour = self._getFlavour()
+        self._subject_predicates = flavour.Tree()
+        self._object_predicates = flavour.Tree()
+        for relation in self._getRelations():
+            relation_id = relation.getId()
+            self._indexIds(self._subject_predicates,
+                           relation.getAllSubjectIds(), relation_id)
+            self._indexIds(self._object_predicates,
+                           relation.getAllObjectIds(), relation_id)
+
+    #
+    # Resource index
+    #
+
+    security.declarePrivate('_refResources')
+    def _refResources(self, ids, delta):
+        """Change the reference count of given ids in the resource index
+        """
+        resources = self._resources
+        if resources is None:
+            return
+        for id in ids:
+            old = resources.get(id, 0)
+            new = old + delta
+            if new > 0:
+                resources[id] = new
+            elif old:
+                del resources[id]
+            if not old and new > 0:
+                self._resources_length.change(1)
+            elif old and new <= 0:
+                self._resources_length.change(-1)
+
+
+    security.declareProtected(ManagePortal, 'rebuildResourceIndex')
+    def rebuildResourceIndex(self):
+        """Rebuild the index of ids appearing in the graph
+        """
+        self._resources = self._getFlavour().IntegerTree()
+        self._resources_length = Length()
+        for relation in self._getRelations():
+            self._refResources(relation.getAllSubjectIds(), 1)
+            self._refResources(relation.getAllObjectIds(), 1)
+
+
+    security.declareProtected(View, 'listResourceIds')
+    def listResourceIds(self):
+        """Get the sorted ids appearing as subject or object in the graph
+        """
+        if self._resources is None:
+            # graph created by an older version
+            self.rebuildResourceIndex()
+        return self._resources.keys()
+
+
+    security.declareProtected(View, 'countResources')
+    def countResources(self):
+        """Get the number of ids appearing as subject or object in the graph
+        """
+        if self._resources is None:
+            # graph created by an older version
+            self.rebuildResourceIndex()
+        return self._resources_length()
+
+    #
+    # Intern table
+    #
+
+    security.declarePrivate('_initInternTable')
+    def _initInternTable(self):
+        """Initialize an empty intern table
+        """
+        self._intern_ids = OIBTree()
+        self._intern_strings = IOBTree()
+
+
+    security.declarePrivate('_internIdentifier')
+    def _internIdentifier(self, identifier):
+        """Get the id of an identifier, allocating a new negative id if it is
+        not interned yet
+        """
+        int_id = self._intern_ids.get(identifier)
+        if int_id is None:
+            if self._intern_strings:
+                int_id = self._intern_strings.minKey() - 1
+            else:
+                int_id = -1
+            if int_id <= UNKNOWN_ID:
+                raise OverflowError("No more ids to intern identifiers")
+            self._intern_ids[identifier] = int_id
+            self._intern_strings[int_id] = identifier
+        return int_id
+
+
+    security.declarePrivate('_getIntegerIdentifier')
+    def _getIntegerIdentifier(self, node, create=False):
+        """Get an integer identifier from an INode
+
+        Resources with an integer identifier use it. If the graph interns
+        identifiers, other resources use their interned id: it is created if
+        create is True, and unknown identifiers otherwise give an id that is
+        never found in relations. Negative integer identifiers are reserved
+        for interned ids.
+        """
+        if self._intern_ids is None:
+            return get_integer_identifier(node)
+        try:
+            int_id = get_integer_identifier(node)
+        except ValueError:
+            if not IResource.providedBy(node):
+                raise
+            int_id = None
+        if int_id is None or int_id < 0:
+            if node is None:
+                return None
+            identifier = get_identifier(node)
+            if create and self.intern_identifiers:
+                int_id = self._internIdentifier(identifier)
+            else:
+                int_id = self._intern_ids.get(identifier)
+                if int_id is None:
+                    if create:
+                        raise ValueError("Identifier interning is disabled, "
+                                         "cannot use resource %s" % (node,))
+                    int_id = UNKNOWN_ID
+        return int_id
+
+
+    security.declarePrivate('_getInternedIdentifier')
+    def _getInternedIdentifier(self, int_id):
+        """Get the identifier for an interned id
+        """
+        return self._intern_strings[int_id]
+
+
+    security.declareProtected(ManagePortal, 'countInternedIdentifiers')
+    def countInternedIdentifiers(self):
+        """Get the number of interned identifiers
+        """
+        if self._intern_ids is None:
+            return 0
+        return len(self._intern_ids)
 
     #
     # relation instances
@@ -178,14 +726,77 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
         return res
 
 
+    security.declarePrivate('_iterIOBTreeStatementsStructures')
+    def _iterIOBTreeStatementsStructures(self, statements):
+        """Iterate over IOBtree statement structures for batches of statements
+
+        statements can be any iterable, it is consumed by batches so that
+        big imports do not need to hold all the statements in memory.
+        """
+        for batch in iter_batches(statements):
+            yield self._getIOBTreeStatementsStructure(batch)
+
+
+    security.declarePrivate('_addIds')
+    def _addIds(self, relation, tuples, savepoint=0):
+        """Add given list of (int_subject, int_object) tuples to a relation of
+        the graph, updating the graph indexes
+
+        Return the number of added statements.
+        """
+        subjects, objects = self._getTuplesKeys(relation, tuples, False)
+        count = relation._addIds(tuples, savepoint)
+        self._indexKeys(relation, subjects, objects)
+        return count
+
+
+    security.declarePrivate('_removeIds')
+    def _removeIds(self, relation, tuples, savepoint=0):
+        """Remove given list of (int_subject, int_object) tuples from a
+        relation of the graph, updating the graph indexes
+
+        Return the number of removed statements.
+        """
+        subjects, objects = self._getTuplesKeys(relation, tuples, True)
+        count = relation._removeIds(tuples, savepoint)
+        # keep the ones that are not keys anymore
+        subjects = [x for x in subjects if not relation.hasSubjectId(x)]
+        objects = [x for x in objects if not relation.hasObjectId(x)]
+        self._unindexKeys(relation, subjects, objects)
+        return count
+
+
+    security.declarePrivate('_syncIds')
+    def _syncIds(self, relation, tuples, savepoint=0):
+        """Make a relation of the graph hold exactly given sorted
+        (int_subject, int_object) tuples, updating the graph indexes
+
+        See IOBTreeRelation.syncIds.
+        """
+        added, removed, unchanged = relation.diffIds(tuples)
+        counter = get_savepoint_counter(savepoint)
+        self._removeIds(relation, removed, counter)
+        self._addIds(relation, added, counter)
+        return {'added': len(added),
+                'removed': len(removed),
+                'unchanged': unchanged,
+                }
+
+
     security.declarePrivate('_add')
-    def _add(self, statements):
+    def _add(self, statements, savepoint=0):
         """Add given list of IStatement objects to the graph
+
+        statements can be any iterable. If savepoint is not 0, a transaction
+        savepoint is made every savepoint keys updated in the relations.
         """
+        counter = get_savepoint_counter(savepoint)
         # sort statements by predicate
-        structure = self._getIOBTreeStatementsStructure(statements)
-        for iobtreerelation, tuples in structure.items():
-            iobtreerelation.add(tuples)
+        for structure in self._iterIOBTreeStatementsStructures(statements):
+            for iobtreerelation, tuples in structure.items():
+                tuples = list(iobtreerelation._iterIntegerTuples(tuples,
+                                                                 True))
+                self._addIds(iobtreerelation, tuples, counter)
 
 
     security.declareProtected(View, 'add')
@@ -199,13 +810,17 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
 
 
     security.declarePrivate('_remove')
-    def _remove(self, statements):
+    def _remove(self, statements, savepoint=0):
         """Remove given list of IStatement objects from the graph
+
+        statements can be any iterable, see _add.
         """
+        counter = get_savepoint_counter(savepoint)
         # sort statements by predicate
-        structure = self._getIOBTreeStatementsStructure(statements)
-        for iobtreerelation, tuples in structure.items():
-            iobtreerelation.remove(tuples)
+        for structure in self._iterIOBTreeStatementsStructures(statements):
+            for iobtreerelation, tuples in structure.items():
+                tuples = list(iobtreerelation._iterIntegerTuples(tuples))
+                self._removeIds(iobtreerelation, tuples, counter)
 
 
     security.declareProtected(View, 'remove')
@@ -225,20 +840,91 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
         If statement is None, return all statements.
         statement can use None nodes as wild cards.
         """
-        res = []
+        return list(self.iterStatements(statement))
+
+
+    security.declareProtected(View, 'iterStatements')
+    def iterStatements(self, statement=None):
+        """Iterate over IStatement objects matching the pattern
+
+        If statement is None, iterate over all statements.
+        statement can use None nodes as wild cards.
+        """
         if statement is None:
             statement = Statement(None, None, None)
+        for relation in self._getMatchingRelations(statement):
+            for item in relation.iterStatements(statement.subject,
+                                                statement.object):
+                yield item
+
+
+    security.declarePrivate('_getMatchingRelations')
+    def _getMatchingRelations(self, statement):
+        """Get relations that may hold statements matching the pattern
+        """
         if statement.predicate is None:
-            for relation in self._getRelations():
-                statements = relation.getStatements(statement.subject,
+            relations = self._getCandidateRelations(statement.subject,
                                                     statement.object)
-                res.extend(statements)
         else:
             relation = self._getIOBTreeRelation(statement.predicate)
-            if relation is not None:
-                res = relation.getStatements(statement.subject,
-                                             statement.object)
-        return res
+            if relation is None:
+                relations = []
+            else:
+                relations = [relation]
+        return relations
+
+
+    security.declarePrivate('_iterMatchingEdges')
+    def _iterMatchingEdges(self, statement, cursor=None):
+        """Iterate over (relation, int_subject, int_object) tuples matching
+        the pattern, starting after the position encoded in cursor
+        """
+        relation_id = None
+        after = None
+        if cursor:
+            relation_id, relation_cursor = cursor.split(':', 1)
+            after = parse_cursor(relation_cursor)
+        for relation in self._getMatchingRelations(statement):
+            if relation_id is not None:
+                # skip relations before the cursor one
+                if relation.getId() != relation_id:
+                    continue
+                relation_id = None
+            edges = relation._iterMatchingEdges(statement.subject,
+                                                statement.object, after)
+            after = None
+            for int_subject, int_object in edges:
+                yield relation, int_subject, int_object
+
+
+    security.declareProtected(View, 'getStatementsPage')
+    def getStatementsPage(self, statement=None, limit=20, cursor=None):
+        """Get a page of IStatement objects matching the pattern
+
+        If statement is None, all statements are paginated.
+        statement can use None nodes as wild cards. The page starts after
+        the position encoded in cursor (or at the beginning if cursor is
+        None), each page only costs its size. limit has to be positive.
+
+        Return a tuple (statements, next_cursor), next_cursor being None on
+        the last page.
+        """
+        if limit <= 0:
+            raise ValueError("Invalid page limit %r" % (limit,))
+        if statement is None:
+            statement = Statement(None, None, None)
+        edges = list(islice(self._iterMatchingEdges(statement, cursor),
+                            limit + 1))
+        next_cursor = None
+        if len(edges) > limit:
+            edges = edges[:limit]
+            relation, int_subject, int_object = edges[-1]
+            next_cursor = "%s:%s" % (relation.getId(),
+                                     make_cursor(int_subject, int_object))
+        res = [relation._getStatement(int_subject, int_object,
+                                      statement.subject, statement.object)
+               for relation, int_subject, int_object in edges]
+        return res, next_cursor
 
 
     security.declareProtected(View, 'getSubjects')
@@ -257,7 +943,7 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
         """Get items matching the IStatement(subject, None, object)
         """
         res = []
-        for relation in self._getRelations():
+        for relation in self._getCandidateRelations(subject, object):
             if relation.hasTuple(subject, object):
                 res.append(relation._getCPSRelation())
         return res
@@ -274,6 +960,413 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
         return res
 
 
+    security.declareProtected(View, 'getSubjectsForMany')
+    def getSubjectsForMany(self, predicate, objects):
+        """Get a mapping from given objects to the items matching the
+        IStatement(None, predicate, object)
+        """
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is None:
+            return dict([(object, []) for object in objects])
+        return relation.getSubjectsForMany(objects)
+
+
+    security.declareProtected(View, 'getObjectsForMany')
+    def getObjectsForMany(self, subjects, predicate):
+        """Get a mapping from given subjects to the items matching the
+        IStatement(subject, predicate, None)
+        """
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is None:
+            return dict([(subject, []) for subject in subjects])
+        return relation.getObjectsForMany(subjects)
+
+
+    security.declareProtected(View, 'countStatements')
+    def countStatements(self, statement=None):
+        """Count statements matching the pattern
+
+        If statement is None, count all statements.
+        statement can use None nodes as wild cards.
+        """
+        if not statement:
+            return len(self)
+        res = 0
+        for relation in self._getMatchingRelations(statement):
+            res += relation.countTuples(statement.subject, statement.object)
+        return res
+
+
+    security.declareProtected(View, 'countSubjects')
+    def countSubjects(self, predicate, object):
+        """Count items matching the IStatement(None, predicate, object)
+        """
+        res = 0
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is not None:
+            res = relation.countTuples(object=object)
+        return res
+
+
+    security.declareProtected(View, 'countObjects')
+    def countObjects(self, subject, predicate):
+        """Count items matching the IStatement(subject, predicate, None)
+        """
+        res = 0
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is not None:
+            res = relation.countTuples(subject=subject)
+        return res
+
+
+    # integer API: no node is built
+
+    security.declareProtected(View, 'getSubjectIds')
+    def getSubjectIds(self, predicate, object_id):
+        """Get ids of subjects matching (None, predicate, object_id)
+
+        Return a copy of the set held by the relation, using the key type of
+        the graph.
+        """
+        flavour = self._getFlavour()
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is None:
+            return flavour.TreeSet()
+        return flavour.TreeSet(relation.getSubjectIds(object_id))
+
+
+    security.declareProtected(View, 'getObjectIds')
+    def getObjectIds(self, subject_id, predicate):
+        """Get ids of objects matching (subject_id, predicate, None)
+
+        Return a copy of the set held by the relation, using the key type of
+        the graph.
+        """
+        flavour = self._getFlavour()
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is None:
+            return flavour.TreeSet()
+        return flavour.TreeSet(relation.getObjectIds(subject_id))
+
+
+    security.declareProtected(View, 'hasEdge')
+    def hasEdge(self, subject_id, predicate, object_id):
+        """Return True if (subject_id, predicate, object_id) is in the graph
+        """
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is None:
+            return False
+        return relation.hasEdge(subject_id, object_id)
+
+
+    security.declareProtected(View, 'iterEdges')
+    def iterEdges(self, predicate):
+        """Iterate over all (subject_id, object_id) tuples for predicate
+        """
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is None:
+            return iter(())
+        return relation.iterEdges()
+
+
+    # set algebra: criteria are combined as integer sets, only the result is
+    # turned into nodes
+
+    security.declarePrivate('_getSubjectIdsFor')
+    def _getSubjectIdsFor(self, predicate, object, flavour):
+        """Get ids of subjects matching (None, predicate, object), as a set of
+        given TreeFlavour
+
+        object can be None to get all subjects of the predicate.
+        """
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is None:
+            return flavour.TreeSet()
+        if object is None:
+            return flavour.TreeSet(relation.getAllSubjectIds())
+        try:
+            int_object = self._getIntegerIdentifier(object)
+        except ValueError:
+            return flavour.TreeSet()
+        return self._getFlavourIds(relation.getSubjectIds(int_object),
+                                   flavour)
+
+
+    security.declarePrivate('_getObjectIdsFor')
+    def _getObjectIdsFor(self, subject, predicate, flavour):
+        """Get ids of objects matching (subject, predicate, None), as a set of
+        given TreeFlavour
+
+        subject can be None to get all objects of the predicate.
+        """
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is None:
+            return flavour.TreeSet()
+        if subject is None:
+            return flavour.TreeSet(relation.getAllObjectIds())
+        try:
+            int_subject = self._getIntegerIdentifier(subject)
+        except ValueError:
+            return flavour.TreeSet()
+        return self._getFlavourIds(relation.getObjectIds(int_subject),
+                                   flavour)
+
+
+    security.declarePrivate('_getQueryNodes')
+    def _getQueryNodes(self, ids, predicate, prefix_attr, start=0,
+                       limit=None):
+        """Turn a slice of ids into nodes, built by the relation of predicate
+        """
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is None:
+            return []
+        prefix = getattr(relation, prefix_attr)
+        if limit is None:
+            stop = None
+        else:
+            stop = start + limit
+        return [relation._getCPSNode(x, prefix)
+                for x in islice(ids, start, stop)]
+
+
+    security.declarePrivate('_querySubjectIds')
+    def _querySubjectIds(self, all_of=(), any_of=(), none_of=()):
+        """Get ids of subjects matching the criteria, see querySubjectIds
+
+        Return a set that may be held by a relation and must not be modified.
+        """
+        flavour = self._getFlavour()
+        return combine_ids(
+            [self._getSubjectIdsFor(p, o, flavour) for p, o in all_of],
+            [self._getSubjectIdsFor(p, o, flavour) for p, o in any_of],
+            [self._getSubjectIdsFor(p, o, flavour) for p, o in none_of],
+            flavour)
+
+
+    security.declarePrivate('_queryObjectIds')
+    def _queryObjectIds(self, all_of=(), any_of=(), none_of=()):
+        """Get ids of objects matching the criteria, see queryObjectIds
+
+        Return a set that may be held by a relation and must not be modified.
+        """
+        flavour = self._getFlavour()
+        return combine_ids(
+            [self._getObjectIdsFor(s, p, flavour) for s, p in all_of],
+            [self._getObjectIdsFor(s, p, flavour) for s, p in any_of],
+            [self._getObjectIdsFor(s, p, flavour) for s, p in none_of],
+            flavour)
+
+
+    security.declareProtected(View, 'querySubjectIds')
+    def querySubjectIds(self, all_of=(), any_of=(), none_of=()):
+        """Get ids of subjects matching the criteria
+
+        Criteria are (predicate, object) tuples, object being None to match
+        any object. Return the ids of subjects matching all the all_of
+        criteria and at least one of the any_of criteria, but none of the
+        none_of criteria. At least one all_of or any_of criterion is needed.
+        The result is a new set.
+        """
+        return self._getFlavour().TreeSet(
+            self._querySubjectIds(all_of, any_of, none_of))
+
+
+    security.declareProtected(View, 'queryObjectIds')
+    def queryObjectIds(self, all_of=(), any_of=(), none_of=()):
+        """Get ids of objects matching the criteria
+
+        Criteria are (subject, predicate) tuples, subject being None to match
+        any subject, and are combined as in querySubjectIds. The result is a
+        new set.
+        """
+        return self._getFlavour().TreeSet(
+            self._queryObjectIds(all_of, any_of, none_of))
+
+
+    security.declareProtected(View, 'querySubjects')
+    def querySubjects(self, all_of=(), any_of=(), none_of=(), start=0,
+                      limit=None):
+        """Get subjects matching the criteria, see querySubjectIds
+
+        Only the limit subjects starting at position start are built, sorted
+        by id, using the relation of the first positive criterion.
+        """
+        ids = self._querySubjectIds(all_of, any_of, none_of)
+        predicate = (list(all_of) + list(any_of))[0][0]
+        return self._getQueryNodes(ids, predicate, 'subject_prefix',
+                                   start, limit)
+
+
+    security.declareProtected(View, 'queryObjects')
+    def queryObjects(self, all_of=(), any_of=(), none_of=(), start=0,
+                     limit=None):
+        """Get objects matching the criteria, see queryObjectIds
+
+        Only the limit objects starting at position start are built, sorted
+        by id, using the relation of the first positive criterion.
+        """
+        ids = self._queryObjectIds(all_of, any_of, none_of)
+        predicate = (list(all_of) + list(any_of))[0][1]
+        return self._getQueryNodes(ids, predicate, 'object_prefix',
+                                   start, limit)
+
+
+    # traversal: breadth-first search on integer sets
+
+    security.declarePrivate('_getTraversalTrees')
+    def _getTraversalTrees(self, predicates, direction='forward'):
+        """Get the relation trees to follow for given predicates
+
+        direction is 'forward' (from subjects to objects), 'backward' (from
+        objects to subjects) or 'both'.
+        """
+        if direction == 'forward':
+            inverses = [False]
+        elif direction == 'backward':
+            inverses = [True]
+        elif direction == 'both':
+            inverses = [False, True]
+        else:
+            raise ValueError("Invalid direction %r" % (direction,))
+        if IResource.providedBy(predicates):
+            predicates = [predicates]
+        trees = []
+        for predicate in predicates:
+            relation = self._getIOBTreeRelation(predicate)
+            if relation is not None:
+                for inverse in inverses:
+                    trees.append(relation._getTree(inverse))
+        return trees
+
+
+    security.declarePrivate('_iterBreadthFirst')
+    def _iterBreadthFirst(self, start_id, trees, max_depth=None):
+        """Iterate over (id, depth, parent id) tuples for ids reachable from
+        start_id through given trees, in breadth-first order
+
+        Each id is only reached once, so cycles stop the search.
+        """
+        visited = self._getFlavour().TreeSet((start_id,))
+        frontier = [start_id]
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            depth += 1
+            next_frontier = []
+            for int_id in frontier:
+                for tree in trees:
+                    related = tree.get(int_id)
+                    if related is None:
+                        continue
+                    for int_related in related:
+                        if visited.insert(int_related):
+                            next_frontier.append(int_related)
+                            yield int_related, depth, int_id
+            frontier = next_frontier
+
+
+    security.declareProtected(View, 'traverse')
+    def traverse(self, start, predicates, direction='forward', max_depth=None,
+                 limit=None, result='ids'):
+        """Get ids reachable from the start resource through predicates
+
+        predicates is a resource or a list of resources, direction is
+        'forward', 'backward' or 'both'. The search stops at max_depth hops
+        or after limit reached ids if given. The start id is not part of the
+        result.
+
+        result is:
+        - 'ids': an IITreeSet (LLTreeSet if a relation uses 64 bits uids) of
+          reached ids,
+        - 'depths': an IIBTree (LLBTree) mapping reached ids to their depth,
+        - 'paths': a dictionnary mapping reached ids to the tuple of ids
+          leading to them, from the start id.
+        """
+        if result not in ('ids', 'depths', 'paths'):
+            raise ValueError("Invalid result %r" % (result,))
+        start_id = self._getIntegerIdentifier(start)
+        trees = self._getTraversalTrees(predicates, direction)
+        reached = self._iterBreadthFirst(start_id, trees, max_depth)
+        if limit is not None:
+            reached = islice(reached, limit)
+        flavour = self._getFlavour()
+        if result == 'ids':
+            res = flavour.TreeSet()
+            for int_id, depth, parent_id in reached:
+                res.insert(int_id)
+        elif result == 'depths':
+            res = flavour.IntegerTree()
+            for int_id, depth, parent_id in reached:
+                res[int_id] = depth
+        else:
+            res = {}
+            for int_id, depth, parent_id in reached:
+                if parent_id == start_id:
+                    res[int_id] = (start_id, int_id)
+                else:
+                    res[int_id] = res[parent_id] + (int_id,)
+        return res
+
+
+    security.declareProtected(View, 'closure')
+    def closure(self, start, predicate, direction='forward'):
+        """Get resources reachable from the start resource through predicate,
+        sorted by id
+
+        For instance, the closure of a 'hasPart' relation gives all the
+        descendants of the start resource.
+        """
+        relation = self._getIOBTreeRelation(predicate)
+        if relation is None:
+            return []
+        if direction == 'backward':
+            prefix = relation.subject_prefix
+        else:
+            prefix = relation.object_prefix
+        ids = self.traverse(start, predicate, direction)
+        return [relation._getCPSNode(x, prefix) for x in ids]
+
+
+    security.declareProtected(View, 'findPath')
+    def findPath(self, source, target, predicates=None, max_depth=None,
+                 max_visited=MAX_VISITED):
+        """Find a shortest chain of statements leading from source to target
+
+        predicates is a list of resources to follow, all relations are
+        followed if None. The search is a bidirectional breadth-first search
+        on the relations trees and their inverse trees.
+
+        Return the list of statements, or None if no path of at most
+        max_depth statements was found while visiting at most max_visited
+        resources.
+        """
+        source_id = self._getIntegerIdentifier(source)
+        target_id = self._getIntegerIdentifier(target)
+        if predicates is None:
+            relations = self._getRelations()
+        else:
+            if IResource.providedBy(predicates):
+                predicates = [predicates]
+            relations = []
+            for predicate in predicates:
+                relation = self._getIOBTreeRelation(predicate)
+                if relation is not None:
+                    relations.append(relation)
+
+        def expand(int_id, inverse):
+            for relation in relations:
+                related = relation._getTree(inverse).get(int_id)
+                if related is not None:
+                    for int_related in related:
+                        yield int_related, relation
+
+        path = find_path(source_id, target_id, expand, max_depth,
+                         max_visited)
+        if path is None:
+            return None
+        return [relation._getStatement(int_subject, int_object)
+                for int_subject, relation, int_object in path]
+
+
     security.declareProtected(View, 'hasStatement')
     def hasStatement(self, statement):
         """Return True if given IStatement is in the graph
@@ -282,7 +1375,8 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
         """
         res = False
         if statement.predicate is None:
-            for relation in self._getRelations():
+            for relation in self._getCandidateRelations(statement.subject,
+                                                        statement.object):
                 if relation.hasTuple(statement.subject, statement.object):
                     res = True
                     break
@@ -297,7 +1391,24 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
     def hasResource(self, node):
         """Return True if given node appears in any statement of the graph.
         """
-        # XXX no direct API to do that...
+        if self._resources is not None:
+            if IResource.providedBy(node):
+                relation = self._getIOBTreeRelation(node)
+                if relation is not None and len(relation):
+                    return True
+            try:
+                id = self._getIntegerIdentifier(node)
+            except ValueError:
+                # not a resource or not an integer
+                return False
+            if id is None:
+                return False
+            try:
+                return bool(self._resources.has_key(id))
+            except (TypeError, OverflowError):
+                # id not fitting the keys of the index
+                return False
+        # graph created by an older version, see rebuildResourceIndex
         try:
             if self.hasStatement(Statement(node, None, None)):
                 return True
@@ -316,7 +1427,9 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
         """Clear the graph, removing all statements in it
         """
         for relation in self._getRelations():
-            relation.clear()
+            relation._clear()
+        self.rebuildPredicateIndex()
+        self.rebuildResourceIndex()
 
 
     security.declareProtected(View, '__len__')
@@ -334,7 +1447,8 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
 
 
     security.declareProtected(ManagePortal, 'read')
-    def query(self, query_string, language, base_uri=None):
+    def query(self, query_string, language, base_uri=None, limit=None,
+              offset=None):
         """Query the graph, return an IQueryResult
 
         language is the query language (sparql, rdql...)
@@ -405,9 +1519,10 @@ class IOBTreeGraph(UniqueObject, PortalFolder):
 
     security.declareProtected(ManagePortal, 'manage_addRelation')
     def manage_addRelation(self, id, prefix='', subject_prefix='',
-                           object_prefix='', REQUEST=None):
+                           object_prefix='', key_type='I', REQUEST=None):
         """Add a relation TTW."""
-        relation = self.addRelation(id, prefix, subject_prefix, object_prefix)
+        relation = self.addRelation(id, prefix, subject_prefix, object_prefix,
+                                    key_type)
         if REQUEST:
             REQUEST.RESPONSE.redirect(
                 self.absolute_url()+'/manage_editRelations'
@@ -22,16 +22,33 @@
 #-------------------------------------------------------------------------------
 """Relation that holds relations between objects
 
-A relation holds a IOBTree with object uids as keys and tuples of related
-object uids as values. It also stores the id of its inverse relation.
+A relation holds a IOBTree with object uids as keys and sets of related
+object uids as values. It also stores the inverse IOBTree.
 """
 
+import logging
+import heapq
+from itertools import islice
+
+import transaction
+
 from Globals import InitializeClass, DTMLFile
 from AccessControl import ClassSecurityInfo
+from Acquisition import aq_base, aq_inner, aq_parent
 
 from zope.interface import implements
 
-from BTrees.IOBTree import IOBTree
+from BTrees import IIBTree
+from BTrees import IOBTree
+from BTrees.IIBTree import IITreeSet
+from BTrees.Length import Length
+try:
+    from BTrees import LLBTree
+    from BTrees import LOBTree
+except ImportError:
+    # 64 bits BTrees are only available with ZODB >= 3.8
+    LLBTree = None
+    LOBTree = None
 
 from Products.CMFCore.utils import SimpleItemWithProperties
 from Products.CMFCore.permissions import ManagePortal, View
@@ -44,12 +61,278 @@ from Products.CPSRelation.node import Resource
 from Products.CPSRelation.node import PrefixedResource
 from Products.CPSRelation.resourceregistry import ResourceRegistry
 
+logger = logging.getLogger("CPSRelation.IOBTreeRelation")
+
+# number of tuples processed together by bulk operations
+BULK_BATCH_SIZE = 10000
+
+# number of keys checked or repaired between two progress logs and
+# checkpoints
+REPAIR_BATCH_SIZE = 1000
+
+# maximum number of differences listed by check reports
+MAX_REPORTED = 100
+
+# id standing for interned identifiers that are not known by the graph: it is
+# never allocated, so it is never found in the trees
+UNKNOWN_ID = -2147483648
+
+
+class TreeFlavour:
+    """BTrees classes and set operations used for a key type
+
+    'I' trees use 32 bits integer keys, 'L' trees use 64 bits integer keys.
+    """
+
+    def __init__(self, key_type, object_module, integer_module):
+        self.key_type = key_type
+        # id -> object
+        self.Tree = getattr(object_module, '%sOBTree' % key_type)
+        # id -> id
+        self.IntegerTree = getattr(integer_module,
+                                   '%s%sBTree' % (key_type, key_type))
+        # set of ids
+        self.TreeSet = getattr(integer_module,
+                               '%s%sTreeSet' % (key_type, key_type))
+        self.union = integer_module.union
+        self.multiunion = integer_module.multiunion
+        self.intersection = integer_module.intersection
+        self.difference = integer_module.difference
+
+
+TREE_FLAVOURS = {
+    'I': TreeFlavour('I', IOBTree, IIBTree),
+    }
+if LOBTree is not None:
+    TREE_FLAVOURS['L'] = TreeFlavour('L', LOBTree, LLBTree)
+
+
+def get_tree_flavour(key_type):
+    """Get the TreeFlavour for given key type
+    """
+    try:
+        return TREE_FLAVOURS[key_type]
+    except KeyError:
+        raise ValueError("Unsupported key type %r" % (key_type,))
+
+
+def get_identifier(resource):
+    """Get the string identifier of an IResource
+
+    This is the localname of IPrefixedResource objects, and the URI of other
+    resources.
+    """
+    if IPrefixedResource.providedBy(resource):
+        identifier = resource.localname
+    else:
+        identifier = resource.uri
+    return identifier
+
+
+def get_integer_identifier(resource):
+    """Get an integer identifier from an INode
+
+    Only IResource objects with an integer URI or IPrefixedResource objects
+    with an integer localname are supported by IOBTree graphs, unless the
+    graph interns identifiers.
+    """
+    if resource is None:
+        integer = None
+    elif not IResource.providedBy(resource):
+        raise ValueError("%s is not a resource"%(resource,))
+    else:
+        identifier = get_identifier(resource)
+        try:
+            integer = int(identifier)
+        except ValueError:
+            msg = "Non digital identifier for resource %s"%(resource,)
+            raise ValueError(msg)
+    return integer
+
+
+def iter_batches(iterable, size=BULK_BATCH_SIZE):
+    """Iterate over lists of at most size items taken from iterable
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class SavepointCounter:
+    """Count the keys updated by a bulk operation, making a transaction
+    savepoint every given number of keys
+
+    A counter is shared by the batches and relations of a bulk operation, so
+    that savepoints are made at the same pace whatever the batch sizes are.
+    """
+
+    def __init__(self, every=0):
+        # 0 disables savepoints
+        self.every = every
+        self.done = 0
+
+    def step(self):
+        """Count an updated key
+        """
+        self.done += 1
+        if self.every and not self.done % self.every:
+            transaction.savepoint(optimistic=True)
+
+
+def get_savepoint_counter(savepoint):
+    """Get a SavepointCounter from a savepoint argument
+
+    savepoint is either a number of keys, 0 disabling savepoints, or the
+    counter of the bulk operation in progress.
+    """
+    if isinstance(savepoint, SavepointCounter):
+        return savepoint
+    return SavepointCounter(savepoint)
+
+
+def group_tuples(tuples, inverse=False):
+    """Group (key, value) tuples by key
+
+    Return a list of (key, values) tuples sorted by key, values being sorted
+    too. If inverse is True, tuples are read as (value, key) tuples.
+    """
+    grouped = {}
+    for first, second in tuples:
+        if inverse:
+            first, second = second, first
+        if grouped.has_key(first):
+            grouped[first].append(second)
+        else:
+            grouped[first] = [second]
+    res = grouped.items()
+    res.sort()
+    for key, values in res:
+        values.sort()
+    return res
+
+
+def iter_greater(ids, min=None):
+    """Iterate over sorted ids strictly greater than min
+
+    All ids are iterated if min is None.
+    """
+    if isinstance(ids, list):
+        # storage from older versions
+        ids = IITreeSet(ids)
+    if min is None:
+        for id in ids:
+            yield id
+    else:
+        for id in ids.keys(min=min):
+            if id != min:
+                yield id
+
+
+# end of iteration marker
+_END = object()
+
+def _next(iterator):
+    """Get the next item of an iterator, or _END if it is exhausted
+    """
+    try:
+        return iterator.next()
+    except StopIteration:
+        return _END
+
+
+def diff_sorted(existing, incoming):
+    """Compare two sorted iterables with a sorted merge
+
+    Duplicate items of incoming are ignored, and ValueError is raised if it
+    is not sorted. Only the differences are kept in memory.
+
+    Return a tuple (items of incoming missing from existing, items of
+    existing missing from incoming, number of common items).
+    """
+    added = []
+    removed = []
+    unchanged = 0
+    existing = iter(existing)
+    incoming = iter(incoming)
+    old = _next(existing)
+    new = _next(incoming)
+    previous = _END
+    while old is not _END or new is not _END:
+        if new is not _END and previous is not _END and new <= previous:
+            if new < previous:
+                raise ValueError("Items are not sorted: %r follows %r"
+                                 % (new, previous))
+            new = _next(incoming)
+        elif new is _END or (old is not _END and old < new):
+            removed.append(old)
+            old = _next(existing)
+        elif old is _END or new < old:
+            added.append(new)
+            previous = new
+            new = _next(incoming)
+        else:
+            unchanged += 1
+            previous = new
+            old = _next(existing)
+            new = _next(incoming)
+    return added, removed, unchanged
+
+
+def merge_sorted(iterables):
+    """Lazily merge sorted iterables into a single sorted iterator
+
+    Only the current item of each iterable is kept in memory.
+    """
+    heap = []
+    for index, iterable in enumerate(iterables):
+        iterator = iter(iterable)
+        item = _next(iterator)
+        if item is not _END:
+            # the index keeps equal items from comparing iterators
+            heap.append((item, index, iterator))
+    heapq.heapify(heap)
+    while heap:
+        item, index, iterator = heap[0]
+        yield item
+        item = _next(iterator)
+        if item is _END:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (item, index, iterator))
+
+
+def make_cursor(int_subject, int_object):
+    """Make a pagination cursor from the last seen tuple
+    """
+    return "%s:%s" % (int_subject, int_object)
+
+
+def parse_cursor(cursor):
+    """Get the last seen (int_subject, int_object) tuple from a cursor
+
+    Return None if cursor is empty.
+    """
+    if not cursor:
+        return None
+    try:
+        int_subject, int_object = cursor.split(':')
+        return (int(int_subject), int(int_object))
+    except ValueError:
+        raise ValueError("Invalid cursor %r" % (cursor,))
+
 
 class IOBTreeRelation(SimpleItemWithProperties):
     """Relation
 
-    A relation holds an IOBTree with object uids as keys and tuples of related
-    object uids as values. It also stores the inverse IOBTree.
+    A relation holds an IOBTree with object uids as keys and IITreeSet
+    objects of related object uids as values. It also stores the inverse
+    IOBTree. LOBTree and LLTreeSet objects are used instead if the key type
+    is 'L', to store 64 bits uids.
     """
 
     meta_type = 'IOBTree Relation'
@@ -65,17 +348,43 @@ class IOBTreeRelation(SimpleItemWithProperties):
          'label': 'Resource prefix used for subjects'},
         {'id': 'object_prefix', 'type': 'string', 'mode': 'w',
          'label': 'Resource prefix used for objects'},
+        {'id': 'key_type', 'type': 'selection', 'mode': 'w',
+         'select_variable': 'key_types',
+         'label': 'Key type: I for 32 bits uids, L for 64 bits uids'},
         )
+    # 'L' is only offered when 64 bits BTrees are available
+    key_types = tuple(sorted(TREE_FLAVOURS))
+    # relations created by older versions use IOBTree objects
+    key_type = 'I'
+    # statements counter, None for relations created by older versions
+    _length = None
+    # (phase, last repaired key) tuple of an interrupted repair
+    _repair_checkpoint = None
 
-    def __init__(self, id, prefix='', subject_prefix='', object_prefix=''):
+    def __init__(self, id, prefix='', subject_prefix='', object_prefix='',
+                 key_type='I'):
         """Initialization
         """
         self.id = id
         self.prefix = prefix
         self.subject_prefix = subject_prefix
         self.object_prefix = object_prefix
-        self.relations = IOBTree()
-        self.inverse_relations = IOBTree()
+        self.key_type = key_type
+        flavour = get_tree_flavour(key_type)
+        self.relations = flavour.Tree()
+        self.inverse_relations = flavour.Tree()
+        self._length = Length()
+
+
+    def _updateProperty(self, id, value):
+        """Update property, converting the trees if the key type changes
+        """
+        if id == 'key_type':
+            # purging imports set an empty value: keep the current key type
+            if value and value != self.key_type:
+                self.convertKeyType(value)
+        else:
+            SimpleItemWithProperties._updateProperty(self, id, value)
 
 
     def __cmp__(self, other):
@@ -92,28 +401,40 @@ class IOBTreeRelation(SimpleItemWithProperties):
     # Private API
     #
 
+    security.declarePrivate('_getInternGraph')
+    def _getInternGraph(self):
+        """Get the graph holding the relation if it interns identifiers
+        """
+        graph = aq_parent(aq_inner(self))
+        if getattr(aq_base(graph), '_intern_ids', None) is None:
+            graph = None
+        return graph
+
+
     security.declarePrivate('_getIntegerIdentifier')
-    def _getIntegerIdentifier(self, resource, prefix=''):
+    def _getIntegerIdentifier(self, resource, prefix='', create=False):
         """Get an integer identifier from an INode
 
         Only IResource objects with an integer URI or IPrefixedResource objects
-        with an integer localname are supported by IOBTree graphs.
+        with an integer localname are supported by IOBTree graphs, unless the
+        graph interns identifiers: other identifiers are then interned if
+        create is True.
         """
-        if resource is None:
-            integer = None
-        elif not IResource.providedBy(resource):
-            raise ValueError("%s is not a resource"%(resource,))
-        else:
-            if IPrefixedResource.providedBy(resource):
-                identifier = resource.localname
-            else:
-                identifier = resource.uri
-            try:
-                integer = int(identifier)
-            except ValueError:
-                msg = "Non digital identifier for resource %s"%(resource,)
-                raise ValueError(msg)
-        return integer
+        graph = self._getInternGraph()
+        if graph is None:
+            return get_integer_identifier(resource)
+        return graph._getIntegerIdentifier(resource, create)
+
+
+    security.declarePrivate('_getStringIdentifier')
+    def _getStringIdentifier(self, identifier):
+        """Get the string identifier for an integer identifier
+        """
+        if isinstance(identifier, (int, long)) and identifier < 0:
+            graph = self._getInternGraph()
+            if graph is not None:
+                return graph._getInternedIdentifier(identifier)
+        return str(identifier)
 
 
     security.declarePrivate('_getCPSNode')
@@ -126,7 +447,7 @@ class IOBTreeRelation(SimpleItemWithProperties):
             node = None
         else:
             temp_node = None
-            identifier = str(identifier)
+            identifier = self._getStringIdentifier(identifier)
             if prefix:
                 # use the prefix to make the resource
                 try:
@@ -151,81 +472,332 @@ class IOBTreeRelation(SimpleItemWithProperties):
         return self._getCPSNode(self.getId(), self.prefix)
 
 
+    security.declarePrivate('_getFlavour')
+    def _getFlavour(self):
+        """Get the TreeFlavour used by the relation
+        """
+        return get_tree_flavour(self.key_type)
+
+
+    security.declarePrivate('_getTree')
+    def _getTree(self, inverse=False):
+        """Get the relations tree, or the inverse relations tree
+        """
+        if inverse is False:
+            tree = self.relations
+        else:
+            tree = self.inverse_relations
+        return tree
+
+
+    security.declarePrivate('_getRelatedSet')
+    def _getRelatedSet(self, tree, key, create=False):
+        """Get the set of ids related to key in given tree, for modification
+
+        Return None if key is not in the tree, unless create is True. Lists
+        stored by older versions are converted on the fly.
+        """
+        related = tree.get(key)
+        if related is None:
+            if create:
+                related = self._getFlavour().TreeSet()
+                tree[key] = related
+        elif isinstance(related, list):
+            related = IITreeSet(related)
+            tree[key] = related
+        return related
+
+
+    security.declarePrivate('_getRelatedIds')
+    def _getRelatedIds(self, tree, key):
+        """Get the set of ids related to key in given tree, for reading
+        """
+        related = tree.get(key)
+        if related is None:
+            related = self._getFlavour().TreeSet()
+        elif isinstance(related, list):
+            related = IITreeSet(related)
+        return related
+
+
     security.declarePrivate('_add')
     def _add(self, int_subject, int_object, inverse=False):
         """Add given tuple to the relations tree
 
-        int_subject and int_object have to be integers
+        int_subject and int_object have to be integers. Return True if the
+        tuple was added, False if it was already in the tree. Only one tree
+        is written and the graph indexes are not updated, see addIds.
         """
         # only check the object, the tree will check the subject
-        if not isinstance(int_object, int):
+        if not isinstance(int_object, (int, long)):
             raise ValueError("Object %s is not an integer"%(int_object,))
-        if inverse is False:
-            tree = self.relations
-        else:
-            tree = self.inverse_relations
-        related = tree.get(int_subject, [])
-        related.append(int_object)
-        if tree.has_key(int_subject):
-            del tree[int_subject]
-        tree.insert(int_subject, related)
+        tree = self._getTree(inverse)
+        added = bool(self._bulkAdd(tree, [(int_subject, [int_object])]))
+        if added and inverse is False:
+            self._changeLength(1)
+        return added
 
 
     security.declarePrivate('_remove')
     def _remove(self, int_subject, int_object, inverse=False):
         """Remove given tuple from the relations tree
 
-        int_subject and int_object have to be integers
+        int_subject and int_object have to be integers. Return True if the
+        tuple was removed, False if it was not in the tree. Only one tree is
+        written and the graph indexes are not updated, see removeIds.
         """
-        if inverse is False:
-            tree = self.relations
+        tree = self._getTree(inverse)
+        removed = bool(self._bulkRemove(tree, [(int_subject, [int_object])]))
+        if removed and inverse is False:
+            self._changeLength(-1)
+        return removed
+
+
+    security.declarePrivate('_countStatements')
+    def _countStatements(self):
+        """Count statements walking the whole relations tree
+        """
+        length = 0
+        for related in self.relations.values():
+            length += len(related)
+        return length
+
+
+    security.declarePrivate('_changeLength')
+    def _changeLength(self, delta):
+        """Change the statements counter by given delta
+        """
+        if self._length is None:
+            # relation created by an older version: trees are already up to
+            # date, count them
+            self.updateLength()
         else:
-            tree = self.inverse_relations
-        related = tree.get(int_subject, [])
-        if int_object in related:
-            related.remove(int_object)
-        if tree.has_key(int_subject):
-            del tree[int_subject]
-        if related:
-            tree.insert(int_subject, related)
+            self._length.change(delta)
+
+
+    #
+    # API
+    #
+
+    security.declarePrivate('_iterIntegerTuples')
+    def _iterIntegerTuples(self, tuples, create=False):
+        """Iterate over (int_subject, int_object) tuples for given resources
+        tuples
+
+        If create is True, identifiers are interned if needed.
+        """
+        for subject, object in tuples:
+            int_subject = self._getIntegerIdentifier(subject,
+                                                     self.subject_prefix,
+                                                     create)
+            int_object = self._getIntegerIdentifier(object,
+                                                    self.object_prefix,
+                                                    create)
+            yield (int_subject, int_object)
+
+
+    security.declarePrivate('_bulkAdd')
+    def _bulkAdd(self, tree, grouped, savepoint=0):
+        """Add grouped (key, values) tuples to given tree
+
+        Updated keys are counted for savepoints, see _addIds.
+        Return the number of added values.
+        """
+        counter = get_savepoint_counter(savepoint)
+        count = 0
+        for key, values in grouped:
+            related = self._getRelatedSet(tree, key, create=True)
+            count += related.update(values)
+            counter.step()
+        return count
+
+
+    security.declarePrivate('_bulkRemove')
+    def _bulkRemove(self, tree, grouped, savepoint=0):
+        """Remove grouped (key, values) tuples from given tree
+
+        Updated keys are counted for savepoints, see _addIds.
+        Return the number of removed values.
+        """
+        counter = get_savepoint_counter(savepoint)
+        count = 0
+        for key, values in grouped:
+            related = self._getRelatedSet(tree, key)
+            if related is None:
+                continue
+            for value in values:
+                if related.has_key(value):
+                    related.remove(value)
+                    count += 1
+            if not related:
+                del tree[key]
+            counter.step()
+        return count
 
 
     #
     # API
     #
 
+    security.declarePrivate('_getIndexingGraph')
+    def _getIndexingGraph(self):
+        """Get the graph holding the relation if it maintains indexes on its
+        relations
+        """
+        graph = aq_parent(aq_inner(self))
+        if getattr(aq_base(graph), '_addIds', None) is None:
+            graph = None
+        return graph
+
+
+    security.declarePrivate('_addIds')
+    def _addIds(self, tuples, savepoint=0):
+        """Add given (int_subject, int_object) tuples to the relation trees,
+        without updating the indexes of the graph
+
+        tuples can be any iterable, it is consumed by batches of
+        BULK_BATCH_SIZE tuples: tuples of a batch are grouped and sorted by
+        subject for the relations tree, and by object for the inverse tree,
+        so that every touched set is updated once.
+        If savepoint is not 0, a transaction savepoint is made every savepoint
+        updated keys, so that big imports are done in bounded memory.
+        savepoint may also be the SavepointCounter of a bulk operation
+        spanning several calls.
+
+        Return the number of added statements.
+        """
+        counter = get_savepoint_counter(savepoint)
+        count = 0
+        for batch in iter_batches(tuples):
+            added = self._bulkAdd(self.relations, group_tuples(batch),
+                                  counter)
+            self._bulkAdd(self.inverse_relations,
+                          group_tuples(batch, inverse=True), counter)
+            if added:
+                self._changeLength(added)
+            count += added
+        return count
+
+
+    security.declarePrivate('_removeIds')
+    def _removeIds(self, tuples, savepoint=0):
+        """Remove given (int_subject, int_object) tuples from the relation
+        trees, without updating the indexes of the graph
+
+        Tuples are processed like in _addIds.
+
+        Return the number of removed statements.
+        """
+        counter = get_savepoint_counter(savepoint)
+        count = 0
+        for batch in iter_batches(tuples):
+            removed = self._bulkRemove(self.relations, group_tuples(batch),
+                                       counter)
+            self._bulkRemove(self.inverse_relations,
+                             group_tuples(batch, inverse=True), counter)
+            if removed:
+                self._changeLength(-removed)
+            count += removed
+        return count
+
+
+    security.declarePrivate('diffIds')
+    def diffIds(self, tuples):
+        """Compare the relation with given sorted (int_subject, int_object)
+        tuples
+
+        The relations tree and tuples are walked together in sorted order.
+        Return a tuple (tuples to add, tuples to remove, number of unchanged
+        tuples), see diff_sorted.
+        """
+        return diff_sorted(self.iterEdges(), tuples)
+
+
+    security.declarePrivate('addIds')
+    def addIds(self, tuples, savepoint=0):
+        """Add given (int_subject, int_object) tuples to the relation
+
+        tuples and savepoint are used like in _addIds. When the relation is
+        held by an IOBTree graph, the graph indexes are updated too.
+
+        Return the number of added statements.
+        """
+        graph = self._getIndexingGraph()
+        if graph is None:
+            return self._addIds(tuples, savepoint)
+        counter = get_savepoint_counter(savepoint)
+        count = 0
+        for batch in iter_batches(tuples):
+            count += graph._addIds(self, batch, counter)
+        return count
+
+
+    security.declarePrivate('removeIds')
+    def removeIds(self, tuples, savepoint=0):
+        """Remove given (int_subject, int_object) tuples from the relation
+
+        tuples and savepoint are used like in _addIds. When the relation is
+        held by an IOBTree graph, the graph indexes are updated too.
+
+        Return the number of removed statements.
+        """
+        graph = self._getIndexingGraph()
+        if graph is None:
+            return self._removeIds(tuples, savepoint)
+        counter = get_savepoint_counter(savepoint)
+        count = 0
+        for batch in iter_batches(tuples):
+            count += graph._removeIds(self, batch, counter)
+        return count
+
+
+    security.declarePrivate('syncIds')
+    def syncIds(self, tuples, savepoint=0):
+        """Make the relation hold exactly given sorted (int_subject,
+        int_object) tuples
+
+        Only missing tuples are added and extra tuples removed, so that
+        modifications are proportional to the differences. savepoint is used
+        like in addIds. When the relation is held by an IOBTree graph, the
+        graph indexes are updated too.
+
+        Return a dictionary with the numbers of 'added', 'removed' and
+        'unchanged' tuples.
+        """
+        graph = self._getIndexingGraph()
+        if graph is not None:
+            return graph._syncIds(self, tuples, savepoint)
+        added, removed, unchanged = self.diffIds(tuples)
+        counter = get_savepoint_counter(savepoint)
+        self._removeIds(removed, counter)
+        self._addIds(added, counter)
+        return {'added': len(added),
+                'removed': len(removed),
+                'unchanged': unchanged,
+                }
+
+
     security.declarePrivate('add')
-    def add(self, tuples):
+    def add(self, tuples, savepoint=0):
         """Add given statements to the relation graphs
 
         A tuple has to be an (IPrefixedPesource, IPrefixedPesource) tuple, and
         resources have to have integer local names.
+        tuples can be any iterable, see addIds.
         """
-        # not optimized...
-        for subject, object in tuples:
-            int_subject = self._getIntegerIdentifier(subject,
-                                                     self.subject_prefix)
-            int_object = self._getIntegerIdentifier(object,
-                                                    self.object_prefix)
-            self._add(int_subject, int_object)
-            self._add(int_object, int_subject, inverse=True)
+        return self.addIds(self._iterIntegerTuples(tuples, create=True),
+                           savepoint)
 
 
     security.declarePrivate('remove')
-    def remove(self, tuples):
+    def remove(self, tuples, savepoint=0):
         """Remove given tuples from the relation graphs
 
         A tuple has to be an (IPrefixedPesource, IPrefixedPesource) tuple, and
         resources have to have integer local names.
+        tuples can be any iterable, see removeIds.
         """
-        # not optimized...
-        for subject, object in tuples:
-            int_subject = self._getIntegerIdentifier(subject,
-                                                     self.subject_prefix)
-            int_object = self._getIntegerIdentifier(object,
-                                                    self.object_prefix)
-            self._remove(int_subject, int_object)
-            self._remove(int_object, int_subject, inverse=True)
+        return self.removeIds(self._iterIntegerTuples(tuples), savepoint)
 
 
     security.declarePrivate('getStatements')
@@ -234,29 +806,70 @@ class IOBTreeRelation(SimpleItemWithProperties):
 
         None values can be used as wild cards
         """
-        res = []
+        return list(self.iterStatements(subject, object))
+
+
+    security.declarePrivate('iterStatements')
+    def iterStatements(self, subject=None, object=None):
+        """Iterate over statements for this IOBTreeRelation
+
+        None values can be used as wild cards. Statements are built one at a
+        time while walking the trees.
+        """
         predicate = self._getCPSRelation()
         if subject is None and object is None:
-            # return all statements
+            # all statements
             for int_subject, int_objects in self.relations.items():
                 subject = self._getCPSNode(int_subject, self.subject_prefix)
-                objects = [self._getCPSNode(int_object, self.object_prefix)
-                           for int_object in int_objects]
-                res.extend([Statement(subject, predicate, object)
-                            for object in objects])
+                for int_object in int_objects:
+                    yield Statement(subject, predicate,
+                                    self._getCPSNode(int_object,
+                                                     self.object_prefix))
         elif subject is not None and object is not None:
-            # return given tuple if it's in the graph
+            # given tuple if it's in the graph
             if self.hasTuple(subject, object):
-                res = [Statement(subject, predicate, object)]
+                yield Statement(subject, predicate, object)
         elif subject is None:
             # object is not None
-            res = [Statement(x, predicate, object)
-                   for x in self.getSubjects(object)]
+            int_object = self._getIntegerIdentifier(object, self.object_prefix)
+            for int_subject in self.getSubjectIds(int_object):
+                yield Statement(self._getCPSNode(int_subject,
+                                                 self.subject_prefix),
+                                predicate, object)
         else:
             # object is None and subject is not None
-            res = [Statement(subject, predicate, x)
-                   for x in self.getObjects(subject)]
-        return res
+            int_subject = self._getIntegerIdentifier(subject,
+                                                     self.subject_prefix)
+            for int_object in self.getObjectIds(int_subject):
+                yield Statement(subject, predicate,
+                                self._getCPSNode(int_object,
+                                                 self.object_prefix))
+
+
+    security.declareProtected(ManagePortal, 'getStatementsPage')
+    def getStatementsPage(self, subject=None, object=None, limit=20,
+                          cursor=None):
+        """Get a page of statements for this IOBTreeRelation
+
+        None values can be used as wild cards. Statements are sorted by
+        subject and object ids, the page starts after the tuple encoded in
+        cursor (or at the beginning if cursor is None). limit has to be
+        positive.
+
+        Return a tuple (statements, next_cursor), next_cursor being None on
+        the last page.
+        """
+        if limit <= 0:
+            raise ValueError("Invalid page limit %r" % (limit,))
+        edges = self._iterMatchingEdges(subject, object, parse_cursor(cursor))
+        edges = list(islice(edges, limit + 1))
+        next_cursor = None
+        if len(edges) > limit:
+            edges = edges[:limit]
+            next_cursor = make_cursor(*edges[-1])
+        res = [self._getStatement(int_subject, int_object, subject, object)
+               for int_subject, int_object in edges]
+        return res, next_cursor
 
 
     security.declarePrivate('getSubjects')
@@ -267,7 +880,7 @@ class IOBTreeRelation(SimpleItemWithProperties):
         """
         int_object = self._getIntegerIdentifier(object, self.object_prefix)
         res = [self._getCPSNode(x, self.subject_prefix)
-               for x in self.inverse_relations.get(int_object, [])]
+               for x in self.getSubjectIds(int_object)]
         return res
 
 
@@ -279,10 +892,200 @@ class IOBTreeRelation(SimpleItemWithProperties):
         """
         int_subject = self._getIntegerIdentifier(subject, self.subject_prefix)
         res = [self._getCPSNode(x, self.object_prefix)
-               for x in self.relations.get(int_subject, [])]
+               for x in self.getObjectIds(int_subject)]
+        return res
+
+
+    security.declarePrivate('_getRelatedForMany')
+    def _getRelatedForMany(self, tree, nodes, prefix=''):
+        """Get a mapping from given nodes to the list of related nodes in
+        given tree
+
+        Keys are looked up in sorted order, and related nodes are built once
+        even if they are shared by several keys.
+        """
+        keys = {}
+        for node in nodes:
+            keys[node] = self._getIntegerIdentifier(node)
+        items = [(key, node) for node, key in keys.items()]
+        items.sort()
+        built = {}
+        res = {}
+        for key, node in items:
+            related_nodes = []
+            related = tree.get(key)
+            if related is not None:
+                for int_related in related:
+                    related_node = built.get(int_related)
+                    if related_node is None:
+                        related_node = self._getCPSNode(int_related, prefix)
+                        built[int_related] = related_node
+                    related_nodes.append(related_node)
+            res[node] = related_nodes
         return res
 
 
+    security.declarePrivate('getSubjectsForMany')
+    def getSubjectsForMany(self, objects):
+        """Get a mapping from given objects to the list of their subjects
+        """
+        return self._getRelatedForMany(self.inverse_relations, objects,
+                                       self.subject_prefix)
+
+
+    security.declarePrivate('getObjectsForMany')
+    def getObjectsForMany(self, subjects):
+        """Get a mapping from given subjects to the list of their objects
+        """
+        return self._getRelatedForMany(self.relations, subjects,
+                                       self.object_prefix)
+
+
+    # integer API: no node is built
+
+    security.declarePrivate('getSubjectIds')
+    def getSubjectIds(self, int_object):
+        """Get ids of subjects for given object id
+
+        Return an IITreeSet (LLTreeSet if key type is 'L') that must not be
+        modified.
+        """
+        return self._getRelatedIds(self.inverse_relations, int_object)
+
+
+    security.declarePrivate('getObjectIds')
+    def getObjectIds(self, int_subject):
+        """Get ids of objects for given subject id
+
+        Return an IITreeSet (LLTreeSet if key type is 'L') that must not be
+        modified.
+        """
+        return self._getRelatedIds(self.relations, int_subject)
+
+
+    security.declarePrivate('countSubjectIds')
+    def countSubjectIds(self, int_object):
+        """Count subjects for given object id
+        """
+        related = self.inverse_relations.get(int_object)
+        if related is None:
+            return 0
+        return len(related)
+
+
+    security.declarePrivate('countObjectIds')
+    def countObjectIds(self, int_subject):
+        """Count objects for given subject id
+        """
+        related = self.relations.get(int_subject)
+        if related is None:
+            return 0
+        return len(related)
+
+
+    security.declarePrivate('hasSubjectId')
+    def hasSubjectId(self, int_subject):
+        """Return True if int_subject is the subject of a statement
+        """
+        # empty sets are removed from the trees
+        return bool(self.relations.has_key(int_subject))
+
+
+    security.declarePrivate('hasObjectId')
+    def hasObjectId(self, int_object):
+        """Return True if int_object is the object of a statement
+        """
+        return bool(self.inverse_relations.has_key(int_object))
+
+
+    security.declarePrivate('getAllSubjectIds')
+    def getAllSubjectIds(self):
+        """Get the sorted ids of all subjects of the relation
+        """
+        return self.relations.keys()
+
+
+    security.declarePrivate('getAllObjectIds')
+    def getAllObjectIds(self):
+        """Get the sorted ids of all objects of the relation
+        """
+        return self.inverse_relations.keys()
+
+
+    security.declarePrivate('hasEdge')
+    def hasEdge(self, int_subject, int_object):
+        """Return True if (int_subject, int_object) is in the relation
+        """
+        related = self.relations.get(int_subject)
+        return related is not None and int_object in related
+
+
+    security.declarePrivate('iterEdges')
+    def iterEdges(self, after=None):
+        """Iterate over all (int_subject, int_object) tuples of the relation,
+        sorted by subject and object
+
+        If after is given, start after this tuple.
+        """
+        if after is None:
+            items = self.relations.items()
+        else:
+            items = self.relations.items(min=after[0])
+        for int_subject, int_objects in items:
+            if after is not None and int_subject == after[0]:
+                int_objects = iter_greater(int_objects, after[1])
+            for int_object in int_objects:
+                yield (int_subject, int_object)
+
+
+    security.declarePrivate('_iterMatchingEdges')
+    def _iterMatchingEdges(self, subject=None, object=None, after=None):
+        """Iterate over sorted (int_subject, int_object) tuples matching given
+        nodes, None values being wild cards
+
+        If after is given, start after this tuple.
+        """
+        if subject is None and object is None:
+            return self.iterEdges(after)
+        elif subject is not None and object is not None:
+            if after is None and self.hasTuple(subject, object):
+                int_subject = self._getIntegerIdentifier(subject,
+                                                         self.subject_prefix)
+                int_object = self._getIntegerIdentifier(object,
+                                                        self.object_prefix)
+                return iter([(int_subject, int_object)])
+            return iter(())
+        elif subject is None:
+            int_object = self._getIntegerIdentifier(object, self.object_prefix)
+            min = None
+            if after is not None:
+                min = after[0]
+            return ((x, int_object) for x in
+                    iter_greater(self.getSubjectIds(int_object), min))
+        else:
+            int_subject = self._getIntegerIdentifier(subject,
+                                                     self.subject_prefix)
+            min = None
+            if after is not None:
+                min = after[1]
+            return ((int_subject, x) for x in
+                    iter_greater(self.getObjectIds(int_subject), min))
+
+
+    security.declarePrivate('_getStatement')
+    def _getStatement(self, int_subject, int_object, subject=None,
+                      object=None):
+        """Get the IStatement for given tuple
+
+        Given subject and object nodes are used instead of building new ones.
+        """
+        if subject is None:
+            subject = self._getCPSNode(int_subject, self.subject_prefix)
+        if object is None:
+            object = self._getCPSNode(int_object, self.object_prefix)
+        return Statement(subject, self._getCPSRelation(), object)
+
+
     security.declarePrivate('hasTuple')
     def hasTuple(self, subject=None, object=None):
         """Return if given tuple is in the relations
@@ -292,36 +1095,320 @@ class IOBTreeRelation(SimpleItemWithProperties):
             if len(self) > 0:
                 res = True
         elif subject is not None and object is not None:
-            related = self.getObjects(subject)
-            res = object in related
+            int_subject = self._getIntegerIdentifier(subject,
+                                                     self.subject_prefix)
+            try:
+                int_object = self._getIntegerIdentifier(object,
+                                                        self.object_prefix)
+            except ValueError:
+                # cannot be in the relation
+                int_object = None
+            if (int_object is not None
+                and self.hasEdge(int_subject, int_object)):
+                # object has to be the node built by the relation, only
+                # build this one
+                res = (object
+                       == self._getCPSNode(int_object, self.object_prefix))
         elif subject is None:
             # object is not None
-            if self.getSubjects(object):
-                res = True
+            int_object = self._getIntegerIdentifier(object,
+                                                    self.object_prefix)
+            res = self.hasObjectId(int_object)
         else:
             # object is None and subject is not None
-            if self.getObjects(subject):
-                res = True
+            int_subject = self._getIntegerIdentifier(subject,
+                                                     self.subject_prefix)
+            res = self.hasSubjectId(int_subject)
+        return res
+
+
+    security.declarePrivate('countTuples')
+    def countTuples(self, subject=None, object=None):
+        """Count tuples matching given nodes, None values being wild cards
+
+        Counts are read from the sets lengths, no node is built.
+        """
+        if subject is None and object is None:
+            res = len(self)
+        elif subject is not None and object is not None:
+            res = int(self.hasTuple(subject, object))
+        elif subject is None:
+            int_object = self._getIntegerIdentifier(object,
+                                                    self.object_prefix)
+            res = self.countSubjectIds(int_object)
+        else:
+            int_subject = self._getIntegerIdentifier(subject,
+                                                     self.subject_prefix)
+            res = self.countObjectIds(int_subject)
         return res
 
 
     security.declareProtected(View, 'clear')
     def clear(self):
         """Clear the relation, removing all items in its trees
+
+        When the relation is held by an IOBTree graph, its ids are removed
+        from the graph indexes too.
+        """
+        graph = self._getIndexingGraph()
+        if graph is not None:
+            graph._unindexRelation(self)
+        self._clear()
+
+
+    security.declarePrivate('_clear')
+    def _clear(self):
+        """Clear the relation trees, without updating the indexes of the
+        graph
+        """
+        flavour = self._getFlavour()
+        self.relations = flavour.Tree()
+        self.inverse_relations = flavour.Tree()
+        self._length = Length()
+
+
+    security.declareProtected(ManagePortal, 'updateLength')
+    def updateLength(self):
+        """Recompute the statements counter from the relations tree
+
+        Return the number of statements in the relation.
         """
-        self.relations = IOBTree()
-        self.inverse_relations = IOBTree()
+        length = self._countStatements()
+        if self._length is None:
+            self._length = Length(length)
+        elif self._length() != length:
+            self._length.set(length)
+        return length
+
+
+    security.declareProtected(ManagePortal, 'upgradeStorage')
+    def upgradeStorage(self):
+        """Convert lists of related ids stored by older versions into sets
+
+        Return the number of converted entries.
+        """
+        count = 0
+        for tree in (self.relations, self.inverse_relations):
+            # only values are replaced, so iterating over keys is safe
+            for key in tree.keys():
+                related = tree[key]
+                if isinstance(related, list):
+                    tree[key] = IITreeSet(related)
+                    count += 1
+        if self._length is None:
+            self.updateLength()
+        return count
+
+
+    security.declareProtected(ManagePortal, 'convertKeyType')
+    def convertKeyType(self, key_type, savepoint=0):
+        """Convert the relation trees to given key type ('I' or 'L')
+
+        Trees are copied into trees of the new type, and only replaced when
+        all entries have been copied: converting ids that do not fit in 32
+        bits to 'I' fails without modifying the relation. If savepoint is not
+        0, a transaction savepoint is made every savepoint copied keys.
+
+        Return the number of converted entries.
+        """
+        flavour = get_tree_flavour(key_type)
+        self.upgradeStorage()
+        count = 0
+        trees = []
+        for tree in (self.relations, self.inverse_relations):
+            new_tree = flavour.Tree()
+            for key, related in tree.items():
+                new_tree[key] = flavour.TreeSet(related)
+                count += 1
+                if savepoint and count % savepoint == 0:
+                    transaction.savepoint(optimistic=True)
+            trees.append(new_tree)
+        self.relations, self.inverse_relations = trees
+        self.key_type = key_type
+        graph = aq_parent(aq_inner(self))
+        if getattr(aq_base(graph), '_updateIndexesFlavour', None) is not None:
+            graph._updateIndexesFlavour()
+        return count
+
+
+    #
+    # Consistency
+    #
+
+    security.declarePrivate('_iterKeysBatches')
+    def _iterKeysBatches(self, tree, after=None, size=REPAIR_BATCH_SIZE):
+        """Iterate over lists of at most size sorted keys of given tree,
+        starting after given key
+
+        Keys of a batch are read when it is requested, so that the tree can be
+        modified between two batches.
+        """
+        while True:
+            keys = list(islice(iter_greater(tree, after), size))
+            if not keys:
+                break
+            yield keys
+            after = keys[-1]
+
+
+    security.declarePrivate('_iterMissingEdges')
+    def _iterMissingEdges(self, keys, inverse=False):
+        """Iterate over (key, value) tuples of given keys in the relations
+        tree that are missing from the inverse relations tree
+
+        If inverse is True, iterate over (int_object, int_subject) tuples of
+        the inverse relations tree that are missing from the relations tree.
+        """
+        tree = self._getTree(inverse)
+        other = self._getTree(not inverse)
+        for key in keys:
+            for value in self._getRelatedIds(tree, key):
+                related = other.get(value)
+                if related is None or key not in related:
+                    yield (key, value)
+
+
+    security.declareProtected(ManagePortal, 'check')
+    def check(self, max_reported=MAX_REPORTED):
+        """Check that the relations and inverse relations trees match
+
+        Both trees are walked in key order by batches of REPAIR_BATCH_SIZE
+        keys, and related ids of a batch are looked up in the other tree:
+        only one batch of keys is read at a time, so trees are never fully
+        loaded. Progress is logged after each batch.
+
+        Return a dictionary with the following keys:
+        - 'missing_inverse': (int_subject, int_object) tuples of the
+          relations tree missing from the inverse relations tree, at most
+          max_reported of them,
+        - 'missing_direct': (int_subject, int_object) tuples of the inverse
+          relations tree missing from the relations tree, at most
+          max_reported of them,
+        - 'missing_inverse_count', 'missing_direct_count': the number of
+          differences of each kind,
+        - 'statements': the number of statements of the relations tree,
+        - 'length': the statements counter,
+        - 'consistent': True if no difference was found.
+        """
+        res = {'statements': 0,
+               'length': len(self),
+               }
+        for inverse, name in ((False, 'missing_inverse'),
+                              (True, 'missing_direct')):
+            missing = []
+            count = 0
+            checked = 0
+            tree = self._getTree(inverse)
+            for keys in self._iterKeysBatches(tree):
+                for key, value in self._iterMissingEdges(keys, inverse):
+                    if len(missing) < max_reported:
+                        if inverse:
+                            missing.append((value, key))
+                        else:
+                            missing.append((key, value))
+                    count += 1
+                if not inverse:
+                    for key in keys:
+                        res['statements'] += len(self._getRelatedIds(tree,
+                                                                     key))
+                checked += len(keys)
+                logger.info("Checked %s keys of relation %s (%s), %s "
+                            "differences" % (checked, self.getId(), name,
+                                             count))
+            res[name] = missing
+            res[name + '_count'] = count
+        res['consistent'] = (not res['missing_inverse_count'] and
+                             not res['missing_direct_count'] and
+                             res['statements'] == res['length'])
+        return res
+
+
+    security.declareProtected(ManagePortal, 'repair')
+    def repair(self, max_keys=None):
+        """Rebuild the inverse relations tree from the relations tree
+
+        See _repair. When the relation is held by an IOBTree graph, the graph
+        indexes are rebuilt once the repair is finished.
+        """
+        res = self._repair(max_keys)
+        graph = self._getIndexingGraph()
+        if res['done'] and graph is not None:
+            graph.rebuildResourceIndex()
+            graph.rebuildPredicateIndex()
+        return res
+
+
+    security.declarePrivate('_repair')
+    def _repair(self, max_keys=None):
+        """Rebuild the inverse relations tree from the relations tree,
+        without updating the indexes of the graph
+
+        The relations tree is the reference: its tuples missing from the
+        inverse relations tree are added to it, then tuples of the inverse
+        relations tree missing from the relations tree are removed. The
+        statements counter is updated at the end.
+
+        Keys are repaired by batches of REPAIR_BATCH_SIZE keys. After each
+        batch, progress is logged, a checkpoint is stored on the relation and
+        a transaction savepoint is made. If max_keys is given, the repair
+        stops after about max_keys keys: committing the transaction and
+        calling repair again resumes it from the checkpoint, so that a big
+        relation can be repaired in several maintenance windows.
+
+        Return a dictionary with the numbers of 'added' and 'removed' inverse
+        tuples, of 'keys' walked, and 'done' set to True if the repair is
+        finished.
+        """
+        res = {'added': 0,
+               'removed': 0,
+               'keys': 0,
+               'done': False,
+               }
+        phases = ['add', 'remove']
+        checkpoint = self._repair_checkpoint
+        if checkpoint is None:
+            phase, after = 'add', None
+        else:
+            phase, after = checkpoint
+            logger.info("Resuming repair of relation %s at %s phase after "
+                        "key %s" % (self.getId(), phase, after))
+        for phase in phases[phases.index(phase):]:
+            inverse = (phase == 'remove')
+            tree = self._getTree(inverse)
+            for keys in self._iterKeysBatches(tree, after):
+                missing = list(self._iterMissingEdges(keys, inverse))
+                if inverse:
+                    grouped = group_tuples(missing)
+                    res['removed'] += self._bulkRemove(self.inverse_relations,
+                                                       grouped)
+                else:
+                    grouped = group_tuples(missing, inverse=True)
+                    res['added'] += self._bulkAdd(self.inverse_relations,
+                                                  grouped)
+                res['keys'] += len(keys)
+                self._repair_checkpoint = (phase, keys[-1])
+                transaction.savepoint(optimistic=True)
+                logger.info("Repaired %s keys of relation %s (%s phase), %s "
+                            "added, %s removed" % (res['keys'], self.getId(),
+                                                   phase, res['added'],
+                                                   res['removed']))
+                if max_keys is not None and res['keys'] >= max_keys:
+                    return res
+            after = None
+        self._repair_checkpoint = None
+        self.updateLength()
+        res['done'] = True
+        return res
 
 
     security.declareProtected(View, '__len__')
     def __len__(self):
         """Return the number of statements in the relation
         """
-        # may be optimized (?)
-        length = 0
-        for related in self.relations.values():
-            length += len(related)
-        return length
+        if self._length is None:
+            # relation created by an older version, see updateLength
+            return self._countStatements()
+        return self._length()
 
 
     #
@@ -0,0 +1,122 @@
+# Copyright (c) 2004-2005 Nuxeo SARL <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""
+Bounded cache dropping the least recently used items
+"""
+
+# indexes in the links of the recently used items list
+PREVIOUS = 0
+NEXT = 1
+KEY = 2
+VALUE = 3
+
+
+class LRUCache:
+    """Cache keeping at most size items
+
+    Items are kept in a circular doubly linked list, from the least recently
+    used to the most recently used one, so that lookups and updates are done
+    in constant time. Hits and misses of get are counted.
+    A size of 0 disables the cache.
+    """
+
+    def __init__(self, size):
+        """Initialization
+        """
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        """Remove all items and reset the counters
+        """
+        self.hits = 0
+        self.misses = 0
+        # key -> [previous link, next link, key, value]
+        self._links = {}
+        root = []
+        root[:] = [root, root, None, None]
+        self._root = root
+
+    def _unlink(self, link):
+        """Remove a link from the recently used items list
+        """
+        previous, next = link[PREVIOUS], link[NEXT]
+        previous[NEXT] = next
+        next[PREVIOUS] = previous
+
+    def _append(self, link):
+        """Add a link at the end of the recently used items list
+        """
+        root = self._root
+        last = root[PREVIOUS]
+        last[NEXT] = link
+        root[PREVIOUS] = link
+        link[PREVIOUS] = last
+        link[NEXT] = root
+
+    def get(self, key, default=None):
+        """Get the value cached for key, or default
+        """
+        link = self._links.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._unlink(link)
+        self._append(link)
+        return link[VALUE]
+
+    def set(self, key, value):
+        """Cache value for key, dropping the least recently used item if the
+        cache is full
+        """
+        if self.size <= 0:
+            return
+        link = self._links.get(key)
+        if link is not None:
+            link[VALUE] = value
+            self._unlink(link)
+        else:
+            if len(self._links) >= self.size:
+                oldest = self._root[NEXT]
+                self._unlink(oldest)
+                del self._links[oldest[KEY]]
+            link = [None, None, key, value]
+            self._links[key] = link
+        self._append(link)
+
+    def has_key(self, key):
+        """Return True if key is cached, without changing the counters
+        """
+        return self._links.has_key(key)
+
+    def keys(self):
+        """Get the cached keys, from the least to the most recently used
+        """
+        res = []
+        root = self._root
+        link = root[NEXT]
+        while link is not root:
+            res.append(link[KEY])
+            link = link[NEXT]
+        return res
+
+    def __len__(self):
+        return len(self._links)
@@ -0,0 +1,103 @@
+# Copyright (c) 2004-2005 Nuxeo SARL <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""
+Namespace bindings resolution, shared by graphs and serializers
+"""
+
+
+class NamespaceResolver:
+    """Resolver for namespace bindings
+
+    Bindings are lines following the format "prefix namespace". URIs are
+    split into (prefix, localname) tuples using the longest matching
+    namespace, walking a trie of namespaces characters: the cost only
+    depends on the URI length, not on the number of bindings.
+    """
+
+    def __init__(self, lines=()):
+        """Initialization
+
+        lines are kept to check if the resolver is up to date.
+        """
+        self.lines = lines
+        # prefix -> namespace
+        self._namespaces = {}
+        for line in lines:
+            if ' ' in line:
+                prefix, namespace = line.split(' ', 1)
+                self._namespaces[prefix] = namespace
+        # trie: character -> sub trie, the None key of a sub trie holding the
+        # prefix of the namespace ending there
+        self._trie = {}
+        for prefix, namespace in self._namespaces.items():
+            trie = self._trie
+            for char in namespace:
+                trie = trie.setdefault(char, {})
+            # the smallest prefix wins if several prefixes share a namespace
+            if trie.get(None) is None or prefix < trie[None]:
+                trie[None] = prefix
+
+    def getBindings(self):
+        """Get the bindings dictionnary, with prefixes as keys and namespaces
+        as values
+        """
+        return self._namespaces.copy()
+
+    def getNamespace(self, prefix, default=None):
+        """Get the namespace bound to given prefix
+        """
+        return self._namespaces.get(prefix, default)
+
+    def split(self, uri):
+        """Split an URI into a (prefix, localname) tuple using the longest
+        matching namespace
+
+        Return (None, None) if no namespace matches.
+        """
+        trie = self._trie
+        prefix = trie.get(None)
+        length = 0
+        index = 0
+        for char in uri:
+            trie = trie.get(char)
+            if trie is None:
+                break
+            index += 1
+            if trie.get(None) is not None:
+                prefix = trie[None]
+                length = index
+        if prefix is None:
+            return None, None
+        return prefix, uri[length:]
+
+
+def get_namespace_resolver(ob):
+    """Get a NamespaceResolver for the namespace_bindings property of an
+    object
+
+    The resolver is cached in a volatile attribute of the object, and rebuilt
+    when the property changes.
+    """
+    lines = ob.namespace_bindings
+    resolver = getattr(ob, '_v_namespace_resolver', None)
+    if resolver is None or resolver.lines is not lines:
+        resolver = NamespaceResolver(lines)
+        ob._v_namespace_resolver = resolver
+    return resolver
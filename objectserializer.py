@@ -47,6 +47,7 @@ from Products.CPSRelation.node import PrefixedResource
 from Products.CPSRelation.node import Literal
 from Products.CPSRelation.node import Blank
 from Products.CPSRelation.statement import Statement
+from Products.CPSRelation.namespaces import get_namespace_resolver
 
 
 class ObjectSerializer(PropertiesPostProcessor, SimpleItemWithProperties):
@@ -136,14 +137,7 @@ class ObjectSerializer(PropertiesPostProcessor, SimpleItemWithProperties):
     def getNamespaceBindings(self):
         """Get defined bindings dictionnary
         """
-        bindings_dict = {}
-        for binding in self.namespace_bindings:
-            sep_index = binding.find(' ')
-            if sep_index != -1:
-                key = binding[:sep_index]
-                value = binding[sep_index+1:]
-                bindings_dict[key] = value
-        return bindings_dict
+        return get_namespace_resolver(self).getBindings()
 
     #
     # ZMI
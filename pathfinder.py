@@ -0,0 +1,95 @@
+# Copyright (c) 2004-2005 Nuxeo SARL <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""
+Path finding between graph nodes, shared by graph implementations
+"""
+
+# default maximum number of visited nodes when looking for a path
+MAX_VISITED = 10000
+
+
+def _expand(frontier, expand, inverse, parents, others, max_visited):
+    """Expand one side of a bidirectional search by one level
+
+    Return a tuple (next frontier, meeting key). The next frontier is None
+    if the visited nodes budget is exhausted.
+    """
+    next_frontier = []
+    for key in frontier:
+        for related, edge in expand(key, inverse):
+            if related in parents:
+                continue
+            parents[related] = (key, edge)
+            if related in others:
+                return next_frontier, related
+            next_frontier.append(related)
+            if len(parents) + len(others) > max_visited:
+                return None, None
+    return next_frontier, None
+
+
+def find_path(source, target, expand, max_depth=None,
+              max_visited=MAX_VISITED):
+    """Find a shortest path from source to target with a bidirectional
+    breadth-first search
+
+    expand(key, inverse) iterates over (related key, edge) tuples for the
+    edges starting from key, or ending at key if inverse is True. Keys have
+    to be hashable, edges are opaque.
+
+    The search expands the smallest frontier first. Return the list of
+    (subject key, edge, object key) tuples leading from source to target, or
+    None if no path of at most max_depth edges was found while visiting at
+    most max_visited nodes.
+    """
+    if source == target:
+        return []
+    forward = {source: None}
+    backward = {target: None}
+    forward_frontier = [source]
+    backward_frontier = [target]
+    depth = 0
+    meeting = None
+    while meeting is None:
+        if not forward_frontier or not backward_frontier:
+            return None
+        if max_depth is not None and depth >= max_depth:
+            return None
+        depth += 1
+        if len(forward_frontier) <= len(backward_frontier):
+            forward_frontier, meeting = _expand(forward_frontier, expand,
+                                                False, forward, backward,
+                                                max_visited)
+        else:
+            backward_frontier, meeting = _expand(backward_frontier, expand,
+                                                 True, backward, forward,
+                                                 max_visited)
+    path = []
+    key = meeting
+    while forward[key] is not None:
+        parent, edge = forward[key]
+        path.insert(0, (parent, edge, key))
+        key = parent
+    key = meeting
+    while backward[key] is not None:
+        child, edge = backward[key]
+        path.append((key, edge, child))
+        key = child
+    return path
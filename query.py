@@ -22,6 +22,8 @@
 """Query related classes
 """
 
+from itertools import islice
+
 import zope.interface
 
 from Products.CPSRelation.interfaces import IQueryResult
@@ -41,3 +43,69 @@ class QueryResult:
         self.variable_names = variable_names
         self.results = results
         self.count = count
+
+    def __iter__(self):
+        """Iterate over the binding results
+        """
+        return iter(self.results)
+
+
+class StreamingQueryResult(object):
+    """Query result converting binding results while they are iterated
+
+    rows is an iterable over raw binding results, mappings from variable
+    names to raw values, and convert is the function converting raw values.
+    offset and limit are applied to rows when they could not be pushed into
+    the query.
+
+    Rows are read only once: iterating over the query result streams them,
+    while the results and count attributes read all the remaining rows and
+    keep them.
+    """
+
+    zope.interface.implements(IQueryResult)
+
+    def __init__(self, variable_names, rows, convert, offset=0, limit=None):
+        """Init for query result
+        """
+        self.variable_names = variable_names
+        self._rows = rows
+        self._convert = convert
+        self._offset = offset or 0
+        self._limit = limit
+        self._results = None
+        self._consumed = False
+
+    def _iterResults(self):
+        """Iterate over the converted binding results
+        """
+        if self._limit is None:
+            stop = None
+        else:
+            stop = self._offset + self._limit
+        convert = self._convert
+        for row in islice(self._rows, self._offset, stop):
+            yield dict([(variable, convert(value))
+                        for variable, value in row.items()])
+
+    def __iter__(self):
+        """Iterate over the binding results
+        """
+        if self._results is not None:
+            return iter(self._results)
+        if self._consumed:
+            raise ValueError("Query results have already been iterated")
+        self._consumed = True
+        return self._iterResults()
+
+    def _getResults(self):
+        if self._results is None:
+            self._results = list(iter(self))
+        return self._results
+
+    results = property(_getResults)
+
+    def _getCount(self):
+        return len(self._getResults())
+
+    count = property(_getCount)
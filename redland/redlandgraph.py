@@ -86,17 +86,31 @@ from Products.CPSRelation.node import Literal
 from Products.CPSRelation.node import Blank
 from Products.CPSRelation.node import StatementResource
 from Products.CPSRelation.statement import Statement
+from Products.CPSRelation.namespaces import get_namespace_resolver
+from Products.CPSRelation.lrucache import LRUCache
 
 # graph
 from Products.CPSRelation.redland.interfaces import IRedlandGraph
+from Products.CPSRelation.iobtree.iobtreerelation import iter_batches
+from Products.CPSRelation.pathfinder import MAX_VISITED
+from Products.CPSRelation.pathfinder import find_path
 from Products.CPSRelation.graphregistry import GraphRegistry
 from Products.CPSRelation.graphdrawer import GraphDrawer
 
 # query
 from Products.CPSRelation.query import QueryResult
+from Products.CPSRelation.query import StreamingQueryResult
 
 from Products.CPSRelation.commithooks import get_relation_manager
 
+# numbers of storages and models built since the process started, by graph
+# path
+_rebuild_counters = {}
+
+# number of statements the ZMI contents view can page through: pages are
+# read by skipping the statements before them in a Redland stream
+MAX_CONTENTS_OFFSET = 10000
+
 #
 # Graph
 #
@@ -151,6 +165,15 @@ class RedlandGraph(UniqueObject, PortalFolder):
         {'id': 'mysql_database', 'type': 'string', 'mode': 'w',
          'label': "mysql database name (for mysql backend)"
          },
+        # number of statements written together by _add and _remove
+        {'id': 'write_batch_size', 'type': 'int', 'mode': 'w',
+         'label': "Number of statements written in one storage transaction"
+         },
+        # maximum number of resources kept by each nodes conversion cache,
+        # 0 disables the caches
+        {'id': 'node_cache_size', 'type': 'int', 'mode': 'w',
+         'label': "Size of the nodes conversion caches"
+         },
         )
     supported_backends = [
         'memory',
@@ -165,6 +188,8 @@ class RedlandGraph(UniqueObject, PortalFolder):
     bdb_path = ''
     mysql_options = ''
     mysql_database = ''
+    write_batch_size = 1000
+    node_cache_size = 1000
 
     #
     # API
@@ -212,73 +237,196 @@ class RedlandGraph(UniqueObject, PortalFolder):
         return self.synchronous
 
 
-    security.declarePrivate('_getGraph')
-    def _getGraph(self):
-        """Get the RDF graph
+    security.declarePrivate('_getStorageKey')
+    def _getStorageKey(self):
+        """Get the values of the properties the storage depends on
         """
         if self.backend == 'memory':
-            storage = getattr(self, '_v_storage', None)
-            if storage is None:
-                # WARNING level because content can be lost with memory storage
-                self.logger.warn("_getGraph: rebuilding memory storage")
-                options = "new='yes',hash-type='memory',dir='.'"
-                storage = RDF.Storage(storage_name="hashes",
-                                      name=self.id,
-                                      options_string=options)
-                self._v_storage = storage
+            key = (self.backend,)
+        elif self.backend == 'bdb':
+            key = (self.backend, self.bdb_path)
+        else:
+            key = (self.backend, self.mysql_options,
+                   self.mysql_database or self.id)
+        return key
+
+
+    security.declarePrivate('_makeStorage')
+    def _makeStorage(self, new=False):
+        """Build the RDF storage
+
+        If new is True, the storage content is erased.
+        """
+        if self.backend == 'memory':
+            # WARNING level because content can be lost with memory storage
+            self.logger.warn("_getGraph: rebuilding memory storage")
+            options = "new='yes',hash-type='memory',dir='.'"
+            storage = RDF.Storage(storage_name="hashes",
+                                  name=self.id,
+                                  options_string=options)
         elif self.backend == 'bdb':
-            storage = getattr(self, '_v_storage', None)
-            if storage is None:
-                self.logger.debug("_getGraph: rebuilding bdb storage")
-                # XXX AT: check behaviour with multiple access to BDB
-                dir_path = os.path.join(CLIENT_HOME, self.bdb_path)
-                storage = RDF.HashStorage(dir_path, options="hash-type='bdb'")
-                self._v_storage = storage
+            self.logger.debug("_getGraph: rebuilding bdb storage")
+            # XXX AT: check behaviour with multiple access to BDB
+            dir_path = os.path.join(CLIENT_HOME, self.bdb_path)
+            options = "hash-type='bdb'"
+            if new:
+                options = "new='yes'," + options
+            storage = RDF.HashStorage(dir_path, options=options)
         elif self.backend == 'mysql':
-            storage = getattr(self, '_v_storage', None)
+            self.logger.debug("_getGraph: rebuilding mysql storage")
             database_id = self.mysql_database or self.id
-            if storage is None:
-                self.logger.debug("_getGraph: rebuilding mysql storage")
-                options = self.mysql_options + ",database='%s'"%database_id
-                try:
+            options = self.mysql_options + ",database='%s'"%database_id
+            if new:
+                options = "new='yes'," + options
+            try:
+                storage = RDF.Storage(storage_name="mysql",
+                                      name=database_id,
+                                      options_string=options)
+            except Exception, err:
+                # XXX catching RDF.RedlandError is unefficient, because
+                # RedlandError raised in that case does not come from the
+                # Python binding but from C code, even if it has the same
+                # name.
+                if err.__class__.__name__ != 'RedlandError' or new:
+                    raise
+                else:
+                    # Try to create table: adding the new option creates
+                    # tables, but erases data if tables already exist,
+                    # that's why it's done after a first try without it.
+                    self.logger.debug("_getGraph: creating mysql tables")
+                    options = "new='yes'," + options
                     storage = RDF.Storage(storage_name="mysql",
                                           name=database_id,
                                           options_string=options)
-                except Exception, err:
-                    # XXX catching RDF.RedlandError is unefficient, because
-                    # RedlandError raised in that case does not come from the
-                    # Python binding but from C code, even if it has the same
-                    # name.
-                    if err.__class__.__name__ != 'RedlandError':
-                        raise
-                    else:
-                        # Try to create table: adding the new option creates
-                        # tables, but erases data if tables already exist,
-                        # that's why it's done after a first try without it.
-                        self.logger.debug("_getGraph: creating mysql tables")
-                        options = "new='yes'," + options
-                        storage = RDF.Storage(storage_name="mysql",
-                                              name=database_id,
-                                              options_string=options)
-                self._v_storage = storage
         else:
             raise ValueError("Backend %s not supported "
                              "for graph %s" %(self.backend, self.id))
+        self._countRebuild('storages')
+        return storage
+
 
-        graph = RDF.Model(storage)
-        return graph
+    security.declarePrivate('_setStorage')
+    def _setStorage(self, storage):
+        """Cache given storage, dropping the cached model
+        """
+        self._v_storage = storage
+        self._v_storage_key = self._getStorageKey()
+        self._v_model = None
+
+
+    security.declarePrivate('_getGraph')
+    def _getGraph(self):
+        """Get the RDF graph
+
+        The storage and the model are cached in volatile attributes, so they
+        are dropped when ZODB invalidates or deactivates the graph. They are
+        rebuilt after clear, and when the properties the storage depends on
+        have changed, possibly in another ZEO client.
+        """
+        key = self._getStorageKey()
+        if getattr(self, '_v_storage_key', None) != key:
+            self._v_storage = None
+        if getattr(self, '_v_storage', None) is None:
+            self._setStorage(self._makeStorage())
+        model = getattr(self, '_v_model', None)
+        if model is None:
+            model = RDF.Model(self._v_storage)
+            self._countRebuild('models')
+            self._v_model = model
+        return model
+
+
+    security.declarePrivate('_countRebuild')
+    def _countRebuild(self, name):
+        """Increment given rebuild counter of the graph
+        """
+        path = '/'.join(self.getPhysicalPath())
+        counters = _rebuild_counters.setdefault(path, {'storages': 0,
+                                                       'models': 0})
+        counters[name] += 1
+
+
+    security.declareProtected(ManagePortal, 'getRebuildCounters')
+    def getRebuildCounters(self):
+        """Get the numbers of storages and models built for the graph since
+        the process started
+
+        Return a dictionary with 'storages' and 'models' keys.
+        """
+        path = '/'.join(self.getPhysicalPath())
+        counters = _rebuild_counters.get(path, {'storages': 0,
+                                                'models': 0})
+        return counters.copy()
 
 
     security.declarePrivate('getNamespaceBindings')
     def getNamespaceBindings(self):
         """Get defined namespace bindings dictionnary
         """
-        bindings_dict = {}
-        for binding in self.namespace_bindings:
-            if ' ' in binding:
-                key, value = binding.split(' ', 1)
-                bindings_dict[key] = value
-        return bindings_dict
+        return get_namespace_resolver(self).getBindings()
+
+
+    security.declarePrivate('_getNodeCaches')
+    def _getNodeCaches(self):
+        """Get the (Redland resources cache, CPS resources cache) tuple
+
+        Caches are LRUCache objects kept in a volatile attribute. The
+        Redland cache is keyed by (prefix, localname) tuples for prefixed
+        resources and by URI for other resources, the CPS cache is keyed by
+        URI. They are rebuilt when the namespace bindings or the
+        node_cache_size property change.
+        """
+        resolver = get_namespace_resolver(self)
+        caches = getattr(self, '_v_node_caches', None)
+        if (caches is None or caches[0] is not resolver
+            or caches[1].size != self.node_cache_size):
+            caches = (resolver, LRUCache(self.node_cache_size),
+                      LRUCache(self.node_cache_size))
+            self._v_node_caches = caches
+        return caches[1:]
+
+
+    security.declareProtected(ManagePortal, 'getNodeCacheStats')
+    def getNodeCacheStats(self):
+        """Get statistics about the nodes conversion caches
+
+        Return a list of dictionaries with 'id', 'size', 'length', 'hits'
+        and 'misses' keys, for the Redland and CPS resources caches of the
+        current process.
+        """
+        res = []
+        for id, cache in zip(('redland', 'cps'), self._getNodeCaches()):
+            res.append({'id': id,
+                        'size': cache.size,
+                        'length': len(cache),
+                        'hits': cache.hits,
+                        'misses': cache.misses,
+                        })
+        return res
+
+
+    security.declarePrivate('_makeRedlandResource')
+    def _makeRedlandResource(self, resource):
+        """Build an RDF.Node object from an IResource
+        """
+        rnode = None
+        if IPrefixedResource.providedBy(resource):
+            resolver = get_namespace_resolver(self)
+            namespace = resolver.getNamespace(resource.prefix)
+            if namespace is not None:
+                localname = resource.localname
+                if isinstance(localname, unicode):
+                    localname = localname.encode('utf-8', 'ignore')
+                if isinstance(namespace, unicode):
+                    namespace = namespace.encode('utf-8', 'ignore')
+                rnode = RDF.NS(namespace)[localname]
+        if rnode is None:
+            # no namespace used
+            uri = resource.uri
+            if isinstance(uri, unicode):
+                uri = uri.encode('utf-8', 'ignore')
+            rnode = RDF.Node(uri_string=uri)
+        return rnode
 
 
     security.declarePrivate('_getRedlandNode')
@@ -291,24 +439,15 @@ class RedlandGraph(UniqueObject, PortalFolder):
         if node is None:
             rnode = None
         elif IResource.providedBy(node):
-            temp_node = None
+            cache = self._getNodeCaches()[0]
             if IPrefixedResource.providedBy(node):
-                ns_bindings = self.getNamespaceBindings()
-                namespace = ns_bindings.get(node.prefix)
-                if namespace is not None:
-                    localname = node.localname
-                    if isinstance(localname, unicode):
-                        localname = localname.encode('utf-8', 'ignore')
-                    if isinstance(namespace, unicode):
-                        namespace = namespace.encode('utf-8', 'ignore')
-                    temp_node = RDF.NS(namespace)[localname]
-            if temp_node is None:
-                # no namespace used
-                uri = node.uri
-                if isinstance(uri, unicode):
-                    uri = uri.encode('utf-8', 'ignore')
-                temp_node = RDF.Node(uri_string=uri)
-            rnode = temp_node
+                key = (node.prefix, node.localname)
+            else:
+                key = node.uri
+            rnode = cache.get(key)
+            if rnode is None:
+                rnode = self._makeRedlandResource(node)
+                cache.set(key, rnode)
         elif IBlank.providedBy(node):
             id = node.id
             if isinstance(id, unicode):
@@ -329,6 +468,28 @@ class RedlandGraph(UniqueObject, PortalFolder):
         return rnode
 
 
+    security.declarePrivate('_makeCPSResource')
+    def _makeCPSResource(self, uri_string):
+        """Build an IResource from an URI
+        """
+        # Parse the uri using namespace bindings to get the best resource
+        # implementation
+        prefix, localname = get_namespace_resolver(self).split(uri_string)
+        node = None
+        if prefix and localname:
+            try:
+                # XXX may not be the good keywords
+                node = ResourceRegistry.makeResource(
+                    prefix, localname=localname)
+            except KeyError:
+                # no factory registered for this prefix, default to
+                # PrefixedResource
+                node = PrefixedResource(prefix, localname)
+        if node is None:
+            node = Resource(uri_string)
+        return node
+
+
     security.declarePrivate('_getCPSNode')
     def _getCPSNode(self, rnode):
         """Get an INode from a RDF.Node
@@ -336,29 +497,12 @@ class RedlandGraph(UniqueObject, PortalFolder):
         if rnode is None:
             node = None
         elif rnode.is_resource():
-            # Parse the uri using namespace bindings to get the best resource
-            # implementation
             uri_string = str(rnode.uri)
-            namespace_bindings = self.getNamespaceBindings()
-            prefix = None
-            localname = None
-            for key, value in namespace_bindings.items():
-                if uri_string.startswith(value):
-                    prefix = key
-                    localname = uri_string[len(value):]
-                    break
-            node = None
-            if prefix and localname:
-                try:
-                    # XXX may not be the good keywords
-                    node = ResourceRegistry.makeResource(
-                        prefix, localname=localname)
-                except KeyError:
-                    # no factory registered for this prefix, default to
-                    # PrefixedResource
-                    node = PrefixedResource(prefix, localname)
+            cache = self._getNodeCaches()[1]
+            node = cache.get(uri_string)
             if node is None:
-                node = Resource(uri_string)
+                node = self._makeCPSResource(uri_string)
+                cache.set(uri_string, node)
         elif rnode.is_blank():
             node = Blank(rnode.blank_identifier)
         elif rnode.is_literal():
@@ -398,14 +542,88 @@ class RedlandGraph(UniqueObject, PortalFolder):
         return statement
 
 
+    security.declarePrivate('_startTransaction')
+    def _startTransaction(self, rdf_graph):
+        """Start a transaction on the RDF model
+
+        Return False if the Redland version or the storage does not support
+        transactions.
+        """
+        start = getattr(Redland, 'librdf_model_transaction_start', None)
+        if start is None:
+            return False
+        return not start(rdf_graph._model)
+
+
+    security.declarePrivate('_writeBatches')
+    def _writeBatches(self, statements, write, bulk_write=None):
+        """Write statements by batches of write_batch_size statements
+
+        write(rdf_graph, rstatements) is called for each batch, in a model
+        transaction if the storage supports them. Otherwise, bulk_write is
+        used instead if given.
+        """
+        rdf_graph = self._getGraph()
+        size = max(self.write_batch_size, 1)
+        for batch in iter_batches(statements, size):
+            rstatements = [self._getRedlandStatement(x) for x in batch]
+            if self.backend == 'memory':
+                # no storage round trip to save
+                write(rdf_graph, rstatements)
+            elif self._startTransaction(rdf_graph):
+                try:
+                    write(rdf_graph, rstatements)
+                except:
+                    Redland.librdf_model_transaction_rollback(
+                        rdf_graph._model)
+                    raise
+                if Redland.librdf_model_transaction_commit(rdf_graph._model):
+                    raise RDF.RedlandError("Could not commit statements in "
+                                           "graph %s" % (self.getId(),))
+            elif bulk_write is not None:
+                bulk_write(rdf_graph, rstatements)
+            else:
+                write(rdf_graph, rstatements)
+
+
+    security.declarePrivate('_appendStatements')
+    def _appendStatements(self, rdf_graph, rstatements):
+        """Add RDF.Statement objects to the RDF model one at a time
+        """
+        for rstatement in rstatements:
+            rdf_graph.append(rstatement)
+
+
+    security.declarePrivate('_addStatementsStream')
+    def _addStatementsStream(self, rdf_graph, rstatements):
+        """Add RDF.Statement objects to the RDF model as a single stream
+
+        Used for storages without transactions. Whether this is faster than
+        appending statements one at a time depends on the storage, see
+        tests/bench_redland.py.
+        """
+        model = RDF.Model(RDF.MemoryStorage())
+        self._appendStatements(model, rstatements)
+        rdf_graph.add_statements(model.as_stream())
+
+
+    security.declarePrivate('_removeStatements')
+    def _removeStatements(self, rdf_graph, rstatements):
+        """Remove RDF.Statement objects from the RDF model
+        """
+        for rstatement in rstatements:
+            rdf_graph.remove_statement(rstatement)
+
+
     security.declarePrivate('_add')
     def _add(self, statements):
         """Add given list of IStatement objects to the graph
+
+        statements can be any iterable, they are written by batches, see
+        _writeBatches.
         """
-        rdf_graph = self._getGraph()
-        for statement in statements:
-            rstatement = self._getRedlandStatement(statement)
-            rdf_graph.append(rstatement)
+        self._writeBatches(statements, self._appendStatements,
+                           self._addStatementsStream)
 
 
     security.declareProtected(View, 'add')
@@ -421,11 +639,11 @@ class RedlandGraph(UniqueObject, PortalFolder):
     security.declarePrivate('_remove')
     def _remove(self, statements):
         """Remove given list of IStatement objects from the graph
+
+        statements can be any iterable, they are removed by batches, see
+        _writeBatches.
         """
-        rdf_graph = self._getGraph()
-        for statement in statements:
-            rstatement = self._getRedlandStatement(statement)
-            rdf_graph.remove_statement(rstatement)
+        self._writeBatches(statements, self._removeStatements)
 
 
     security.declareProtected(View, 'remove')
@@ -445,16 +663,96 @@ class RedlandGraph(UniqueObject, PortalFolder):
         If statement is None, return all statements.
         statement can use None nodes as wild cards.
         """
+        return list(self.iterStatements(statement))
+
+
+    security.declareProtected(View, 'iterStatements')
+    def iterStatements(self, statement=None):
+        """Iterate over IStatement objects matching the pattern
+
+        If statement is None, iterate over all statements.
+        statement can use None nodes as wild cards.
+        Statements are converted one at a time while walking the Redland
+        stream.
+        """
         rdf_graph = self._getGraph()
         if statement is None:
             statement = Statement(None, None, None)
         rstatement = self._getRedlandStatement(statement)
         riterator = rdf_graph.find_statements(rstatement)
-        res = []
         while not riterator.end():
+            yield self._getCPSStatement(riterator.current())
+            riterator.next()
+
+
+    security.declareProtected(View, 'getStatementsPage')
+    def getStatementsPage(self, statement=None, limit=20, cursor=None):
+        """Get a page of IStatement objects matching the pattern
+
+        If statement is None, all statements are paginated.
+        statement can use None nodes as wild cards. The cursor is the
+        position of the page in the Redland stream: statements before it are
+        skipped without being converted, but still read from the storage, so
+        the cost of a page grows with its offset: Redland streams cannot be
+        positioned. limit has to be positive.
+
+        Return a tuple (statements, next_cursor), next_cursor being None on
+        the last page.
+        """
+        if limit <= 0:
+            raise ValueError("Invalid page limit %r" % (limit,))
+        if cursor:
+            try:
+                offset = int(cursor)
+            except ValueError:
+                raise ValueError("Invalid cursor %r" % (cursor,))
+        else:
+            offset = 0
+        rdf_graph = self._getGraph()
+        if statement is None:
+            statement = Statement(None, None, None)
+        rstatement = self._getRedlandStatement(statement)
+        riterator = rdf_graph.find_statements(rstatement)
+        skipped = 0
+        while skipped < offset and not riterator.end():
+            riterator.next()
+            skipped += 1
+        res = []
+        while len(res) < limit and not riterator.end():
             res.append(self._getCPSStatement(riterator.current()))
             riterator.next()
-        return res
+        next_cursor = None
+        if not riterator.end():
+            next_cursor = str(offset + len(res))
+        return res, next_cursor
+
+
+    security.declareProtected(ManagePortal, 'getContentsPage')
+    def getContentsPage(self, cursor=None, limit=20):
+        """Get a page of statements for the ZMI contents view
+
+        Paging stops after MAX_CONTENTS_OFFSET statements, as each page
+        reads the statements before it, see getStatementsPage.
+
+        Return a tuple (statements, previous_cursor, next_cursor), cursors
+        being None on the first and last pages.
+        """
+        offset = 0
+        if cursor:
+            try:
+                offset = int(cursor)
+            except ValueError:
+                raise ValueError("Invalid cursor %r" % (cursor,))
+            offset = min(offset, MAX_CONTENTS_OFFSET)
+            cursor = str(offset)
+        statements, next_cursor = self.getStatementsPage(limit=limit,
+                                                         cursor=cursor)
+        if next_cursor is not None and int(next_cursor) > MAX_CONTENTS_OFFSET:
+            next_cursor = None
+        previous_cursor = None
+        if offset > 0:
+            previous_cursor = str(max(offset - limit, 0))
+        return statements, previous_cursor, next_cursor
 
 
     security.declareProtected(View, 'getSubjects')
@@ -493,6 +791,172 @@ class RedlandGraph(UniqueObject, PortalFolder):
         return objects
 
 
+    security.declarePrivate('_getRelatedForMany')
+    def _getRelatedForMany(self, predicate, nodes, inverse=False):
+        """Get a mapping from given nodes to the list of related nodes
+        through predicate
+
+        Statements of the predicate are read from a single Redland stream,
+        whatever the number of nodes is, keeping the ones related to given
+        nodes.
+        """
+        res = {}
+        wanted = {}
+        for node in nodes:
+            if node in res:
+                continue
+            res[node] = []
+            key = str(self._getRedlandNode(node))
+            wanted.setdefault(key, []).append(node)
+        if not wanted:
+            return res
+        rdf_graph = self._getGraph()
+        rpredicate = self._getRedlandNode(predicate)
+        rstatement = RDF.Statement(None, rpredicate, None)
+        riterator = rdf_graph.find_statements(rstatement)
+        while not riterator.end():
+            current = riterator.current()
+            if inverse:
+                rnode, rrelated = current.object, current.subject
+            else:
+                rnode, rrelated = current.subject, current.object
+            keys = wanted.get(str(rnode))
+            if keys is not None:
+                related = self._getCPSNode(rrelated)
+                for node in keys:
+                    res[node].append(related)
+            riterator.next()
+        return res
+
+
+    security.declareProtected(View, 'getSubjectsForMany')
+    def getSubjectsForMany(self, predicate, objects):
+        """Get a mapping from given objects to the items matching the
+        IStatement(None, predicate, object)
+        """
+        return self._getRelatedForMany(predicate, objects, inverse=True)
+
+
+    security.declareProtected(View, 'getObjectsForMany')
+    def getObjectsForMany(self, subjects, predicate):
+        """Get a mapping from given subjects to the items matching the
+        IStatement(subject, predicate, None)
+        """
+        return self._getRelatedForMany(predicate, subjects)
+
+
+    security.declarePrivate('_countStream')
+    def _countStream(self, riterator, limit=None):
+        """Count items of a Redland stream without converting them
+
+        If limit is given, stop counting when it is reached.
+        """
+        res = 0
+        while not riterator.end():
+            if limit is not None and res >= limit:
+                break
+            res += 1
+            riterator.next()
+        return res
+
+
+    security.declareProtected(View, 'countStatements')
+    def countStatements(self, statement=None):
+        """Count statements matching the pattern
+
+        If statement is None, count all statements.
+        statement can use None nodes as wild cards.
+        """
+        if not statement:
+            return len(self)
+        rdf_graph = self._getGraph()
+        rstatement = self._getRedlandStatement(statement)
+        return self._countStream(rdf_graph.find_statements(rstatement))
+
+
+    security.declareProtected(View, 'countSubjects')
+    def countSubjects(self, predicate, object):
+        """Count items matching the IStatement(None, predicate, object)
+        """
+        return self.countStatements(Statement(None, predicate, object))
+
+
+    security.declareProtected(View, 'countObjects')
+    def countObjects(self, subject, predicate):
+        """Count items matching the IStatement(subject, predicate, None)
+        """
+        return self.countStatements(Statement(subject, predicate, None))
+
+
+    security.declareProtected(View, 'findPath')
+    def findPath(self, source, target, predicates=None, max_depth=None,
+                 max_visited=MAX_VISITED):
+        """Find a shortest chain of statements leading from source to target
+
+        predicates is a list of resources to follow, all predicates are
+        followed if None. The search is a bidirectional breadth-first search
+        reading get_targets/get_sources streams, or find_statements streams
+        when predicates is None.
+
+        Return the list of statements, or None if no path of at most
+        max_depth statements was found while visiting at most max_visited
+        nodes.
+        """
+        rdf_graph = self._getGraph()
+        rnodes = {}
+        rsource = self._getRedlandNode(source)
+        rtarget = self._getRedlandNode(target)
+        rnodes[str(rsource)] = rsource
+        rnodes[str(rtarget)] = rtarget
+        if predicates is None:
+            rpredicates = None
+        else:
+            if IResource.providedBy(predicates):
+                predicates = [predicates]
+            rpredicates = [self._getRedlandNode(x) for x in predicates]
+
+        def expand(key, inverse):
+            rnode = rnodes[key]
+            if not inverse and rnode.is_literal():
+                # literals are never subjects
+                return
+            if rpredicates is None:
+                if inverse:
+                    rstatement = RDF.Statement(None, None, rnode)
+                else:
+                    rstatement = RDF.Statement(rnode, None, None)
+                riterator = rdf_graph.find_statements(rstatement)
+                while not riterator.end():
+                    current = riterator.current()
+                    if inverse:
+                        rrelated = current.subject
+                    else:
+                        rrelated = current.object
+                    rkey = str(rrelated)
+                    rnodes.setdefault(rkey, rrelated)
+                    yield rkey, current.predicate
+                    riterator.next()
+            else:
+                for rpredicate in rpredicates:
+                    if inverse:
+                        rrelateds = rdf_graph.get_sources(rpredicate, rnode)
+                    else:
+                        rrelateds = rdf_graph.get_targets(rnode, rpredicate)
+                    for rrelated in rrelateds:
+                        rkey = str(rrelated)
+                        rnodes.setdefault(rkey, rrelated)
+                        yield rkey, rpredicate
+
+        path = find_path(str(rsource), str(rtarget), expand, max_depth,
+                         max_visited)
+        if path is None:
+            return None
+        return [Statement(self._getCPSNode(rnodes[subject_key]),
+                          self._getCPSNode(rpredicate),
+                          self._getCPSNode(rnodes[object_key]))
+                for subject_key, rpredicate, object_key in path]
+
+
     security.declareProtected(View, 'hasStatement')
     def hasStatement(self, statement):
         """Return True if given IStatement is in the graph
@@ -511,8 +975,9 @@ class RedlandGraph(UniqueObject, PortalFolder):
             rstatement = self._getRedlandStatement(statement)
             res = rstatement in rdf_graph
         else:
-            if self.getStatements(statement):
+            for item in self.iterStatements(statement):
                 res = True
+                break
         return res
 
 
@@ -534,27 +999,7 @@ class RedlandGraph(UniqueObject, PortalFolder):
     def clear(self):
         """Clear the graph, removing all statements in it
         """
-        if self.backend == 'memory':
-            self.logger.warn("_getGraph: recreating memory storage")
-            options = "new='yes',hash-type='memory',dir='.'"
-            storage = RDF.Storage(storage_name="hashes",
-                                  name=self.id,
-                                  options_string=options)
-        elif self.backend == 'bdb':
-            self.logger.debug("_getGraph: recreating bdb storage")
-            dir_path = os.path.join(CLIENT_HOME, self.bdb_path)
-            storage = RDF.HashStorage(dir_path,
-                                      options="new='yes',hash-type='bdb'")
-        elif self.backend == 'mysql':
-            self.logger.debug("_getGraph: recreating mysql storage")
-            options = self.mysql_options + "new='yes',database='%s'"%self.id
-            storage = RDF.Storage(storage_name="mysql",
-                                  name=self.id,
-                                  options_string=options)
-        else:
-            raise ValueError("Backend %s not supported "
-                             "for graph %s" %(self.backend, self.id))
-        self._v_storage = storage
+        self._setStorage(self._makeStorage(new=True))
 
 
     security.declareProtected(View, '__len__')
@@ -569,11 +1014,57 @@ class RedlandGraph(UniqueObject, PortalFolder):
         return True
 
 
+    security.declarePrivate('_setQueryPage')
+    def _setQueryPage(self, query, limit=None, offset=None):
+        """Push limit and offset into an RDF.Query
+
+        Return True if the Redland version and the query language support
+        it. When they do not, the query is left without limit and offset.
+        """
+        if limit is None and not offset:
+            return True
+        set_limit = getattr(Redland, 'librdf_query_set_limit', None)
+        set_offset = getattr(Redland, 'librdf_query_set_offset', None)
+        if set_limit is None or set_offset is None:
+            return False
+        if limit is None:
+            # no limit
+            limit = -1
+        if set_limit(query._query, limit):
+            return False
+        if set_offset(query._query, offset or 0):
+            # do not apply the limit before the offset done by the caller
+            set_limit(query._query, -1)
+            return False
+        return True
+
+
+    security.declarePrivate('_getVariableNames')
+    def _getVariableNames(self, rresults):
+        """Get the variable names of RDF.QueryResults, even if there is no
+        result
+        """
+        res = []
+        count = Redland.librdf_query_results_get_bindings_count(
+            rresults._results)
+        for i in range(count):
+            res.append(Redland.librdf_query_results_get_binding_name(
+                rresults._results, i))
+        return res
+
+
     security.declareProtected(View, 'query')
-    def query(self, query_string, language, base_uri=None):
+    def query(self, query_string, language, base_uri=None, limit=None,
+              offset=None):
         """Query the graph, return an IQueryResult
 
         language is the query language (sparql, rdql...)
+        If given, limit and offset restrict the results to a page: they are
+        pushed into the query when Redland supports it.
+
+        Binding results are converted while the query result is iterated,
+        so that big results are streamed; its results and count attributes
+        read all the results.
         """
         rdf_graph = self._getGraph()
         if base_uri is not None:
@@ -582,21 +1073,16 @@ class RedlandGraph(UniqueObject, PortalFolder):
             query_string = query_string.encode('utf-8', 'ignore')
         query = RDF.Query(query_string, base_uri=base_uri,
                           query_language=language)
+        if self._setQueryPage(query, limit, offset):
+            limit = None
+            offset = 0
         rresults = rdf_graph.execute(query)
-        # make the conversion
         if rresults is None:
             results = QueryResult([], [], 0)
         else:
-            rbindings = list(rresults)
-            # XXX hack: no API in RDF to get the variable names...
-            variable_names = rbindings and rbindings[0].keys() or []
-            bindings = []
-            for rbinding in rbindings:
-                mapping = [(variable, self._getCPSNode(rnode))
-                           for variable, rnode in rbinding.items()]
-                bindings.append(dict(mapping))
-            count = len(bindings)
-            results = QueryResult(variable_names, bindings, count)
+            variable_names = self._getVariableNames(rresults)
+            results = StreamingQueryResult(variable_names, iter(rresults),
+                                           self._getCPSNode, offset, limit)
         return results
 
 
@@ -779,10 +1265,10 @@ class RedlandGraphDrawer(GraphDrawer):
                     item = item[1:]
                 if item.endswith(']'):
                     item = item[:-1]
-                for key, binding in self.graph.namespace_bindings.items():
-                    if item.startswith(binding):
-                        item = item[len(binding):]
-                        item = key + '_' + item
+                prefix, localname = get_namespace_resolver(
+                    self.graph).split(item)
+                if prefix is not None:
+                    item = prefix + '_' + localname
             else:
                 if isinstance(item, unicode):
                     item.encode('utf-8', 'ignore')
@@ -47,6 +47,12 @@ from Products.CPSRelation.tests import data as test_data
 CPS_NAMESPACE_URI = "http://cps-project.org/2005/data/"
 
 
+def doc(docid):
+    """Get the resource of a document id
+    """
+    return PrefixedResource('docid', str(docid))
+
+
 class FakeProxy(Folder):
 
     zope.interface.implements(ICPSProxy)
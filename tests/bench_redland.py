@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# Copyright (c) 2006 Nuxeo SAS <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""Benchmark statements writes on Redland graphs
+
+Statements are added and removed with several write_batch_size values, a
+size of 1 standing for writes without batches. It needs the Redland Python
+binding and a Zope instance, run it with zopectl::
+
+  $ bin/zopectl run Products/CPSRelation/tests/bench_redland.py \\
+        --backend=mysql --options="host='localhost',user='test'" 10000
+
+bdb graphs are written in the bench_redland directory of the instance var
+directory, mysql graphs in the bench_redland database.
+"""
+
+import sys
+import time
+from optparse import OptionParser
+
+from Products.CPSRelation.node import PrefixedResource
+from Products.CPSRelation.statement import Statement
+from Products.CPSRelation.redland.redlandgraph import RedlandGraph
+
+DATABASE = 'bench_redland'
+
+
+def make_statements(count):
+    """Get count statements linking distinct documents
+    """
+    predicate = PrefixedResource('cps', 'hasPart')
+    return [Statement(PrefixedResource('docid', str(i)), predicate,
+                      PrefixedResource('docid', str(i + 1)))
+            for i in range(count)]
+
+
+def make_graph(backend, options):
+    """Get an empty graph using given backend
+    """
+    graph = RedlandGraph(DATABASE, backend=backend,
+                         namespace_bindings=(
+                             'cps http://cps-project.org/node/',
+                             'docid http://cps-project.org/docid/',
+                             ),
+                         bdb_path=DATABASE, mysql_options=options,
+                         mysql_database=DATABASE)
+    graph.clear()
+    return graph
+
+
+def bench(graph, statements, batch_size):
+    """Time the addition and removal of statements with given batch size
+
+    Return an (add seconds, remove seconds) tuple.
+    """
+    graph.clear()
+    graph.write_batch_size = batch_size
+    start = time.time()
+    graph._add(statements)
+    added = time.time()
+    graph._remove(statements)
+    removed = time.time()
+    if len(graph):
+        raise AssertionError("%s statements left in the graph" % len(graph))
+    return added - start, removed - added
+
+
+def main(args):
+    parser = OptionParser(usage="%prog [options] statements")
+    parser.add_option('--backend', default='bdb',
+                      help="Redland backend: memory, bdb or mysql")
+    parser.add_option('--options', default='',
+                      help="mysql connection parameters")
+    parser.add_option('--batch-sizes', default='1,100,1000,10000',
+                      help="comma separated write_batch_size values")
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error("the number of statements is required")
+    statements = make_statements(int(args[0]))
+    graph = make_graph(options.backend, options.options)
+    print "%s statements, %s backend" % (len(statements), options.backend)
+    print "%10s %12s %12s" % ('batch size', 'add st/s', 'remove st/s')
+    for batch_size in options.batch_sizes.split(','):
+        add, remove = bench(graph, statements, int(batch_size))
+        print "%10s %12.0f %12.0f" % (batch_size,
+                                      len(statements) / max(add, 1e-6),
+                                      len(statements) / max(remove, 1e-6))
+    graph.clear()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
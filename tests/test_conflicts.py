@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# Copyright (c) 2006 Nuxeo SAS <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""Test conflicts between concurrent transactions on IOBTree graphs
+
+Clients are connections to a FileStorage with their own transaction
+managers, standing for ZEO clients. run_clients can also be used to measure
+the retry rate of other workloads.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import transaction
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.POSException import ConflictError
+
+from Products.CPSRelation.node import PrefixedResource
+from Products.CPSRelation.statement import Statement
+from Products.CPSRelation.iobtree.iobtreegraph import IOBTreeGraph
+from Products.CPSRelation.tests.CPSRelationTestCase import doc
+
+
+def run_clients(db, clients, work, rounds=1, max_retries=10):
+    """Run work(root, client, round) in concurrent clients
+
+    For each round, all clients work from the same database state before
+    any of them commits, then they commit one after the other. Conflicting
+    transactions are aborted and their work is done again.
+
+    Return a (commits, retries) tuple.
+    """
+    managers = [transaction.TransactionManager() for i in range(clients)]
+    connections = [db.open(transaction_manager=manager)
+                   for manager in managers]
+    commits = 0
+    retries = 0
+    try:
+        for round in range(rounds):
+            for client in range(clients):
+                managers[client].begin()
+                work(connections[client].root(), client, round)
+            for client in range(clients):
+                tries = 0
+                while True:
+                    try:
+                        managers[client].commit()
+                    except ConflictError:
+                        managers[client].abort()
+                        tries += 1
+                        if tries > max_retries:
+                            raise
+                        managers[client].begin()
+                        work(connections[client].root(), client, round)
+                    else:
+                        break
+                commits += 1
+                retries += tries
+    finally:
+        for manager in managers:
+            manager.abort()
+        for connection in connections:
+            connection.close()
+    return commits, retries
+
+
+class TestConflicts(unittest.TestCase):
+
+    clients = 5
+    rounds = 3
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        storage = FileStorage(os.path.join(self.tmpdir, 'Data.fs'))
+        self.db = DB(storage)
+        self.has_part = PrefixedResource('cps', 'hasPart')
+        self.hub = doc(1)
+        manager = transaction.TransactionManager()
+        connection = self.db.open(transaction_manager=manager)
+        graph = IOBTreeGraph('graph', predicate_index=True)
+        graph.addRelation('hasPart',
+                          prefix='cps',
+                          subject_prefix='docid',
+                          object_prefix='docid')
+        connection.root()['graph'] = graph
+        manager.commit()
+        connection.close()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+
+    def getGraph(self):
+        connection = self.db.open()
+        graph = connection.root()['graph']
+        # load the state before the connection is closed
+        graph._p_activate()
+        return graph, connection
+
+    def addHubLink(self, root, client, round):
+        docid = 1000 + client * self.rounds + round
+        root['graph']._add([Statement(doc(docid), self.has_part,
+                                      self.hub)])
+
+    def checkHubLinks(self, count):
+        graph, connection = self.getGraph()
+        try:
+            relation = graph.hasPart
+            self.assertEqual(len(relation), count)
+            self.assertEqual(relation.updateLength(), count)
+            self.assertEqual(len(relation.getSubjectIds(1)), count)
+            self.assertEqual(graph.countResources(), count + 1)
+        finally:
+            transaction.abort()
+            connection.close()
+
+    def test_hub_links(self):
+        # the hub is already linked
+        run_clients(self.db, 1, lambda root, client, round:
+                    root['graph']._add([Statement(doc(2), self.has_part,
+                                                  self.hub)]))
+        commits, retries = run_clients(self.db, self.clients,
+                                       self.addHubLink, self.rounds)
+        self.assertEqual(commits, self.clients * self.rounds)
+        # links to the same hub do not conflict
+        self.assertEqual(retries, 0)
+        self.checkHubLinks(self.clients * self.rounds + 1)
+
+    def test_new_hub_links(self):
+        # the set of subjects of the hub is created concurrently: clients
+        # have to retry, but no link is lost
+        commits, retries = run_clients(self.db, self.clients,
+                                       self.addHubLink, self.rounds)
+        self.assertEqual(commits, self.clients * self.rounds)
+        self.assertEqual(retries, self.clients - 1)
+        self.checkHubLinks(self.clients * self.rounds)
+
+    def test_same_link(self):
+        def work(root, client, round):
+            root['graph']._add([Statement(doc(2), self.has_part,
+                                          self.hub)])
+        commits, retries = run_clients(self.db, self.clients, work)
+        self.assertEqual(commits, self.clients)
+        self.checkHubLinks(1)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestConflicts))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -26,6 +26,7 @@ from Testing import ZopeTestCase
 from Products.CPSUtil.testing.genericsetup import ExportImportTestCase
 import Products.CPSRelation
 from Products.CPSRelation.tests.test_redland import USE_REDLAND
+from Products.CPSRelation.iobtree.iobtreerelation import TREE_FLAVOURS
 
 ZopeTestCase.installProduct('CPSRelation')
 
@@ -80,6 +81,9 @@ class ExportImportTest(ExportImportTestCase):
         self.assertEquals(graph.meta_type, 'IOBTree Graph')
         property_items = [
             ('synchronous', True),
+            ('predicate_index', False),
+            ('intern_identifiers', False),
+            ('export_edges', False),
             ]
         self.assertEquals(graph.propertyItems(), property_items)
         self.assertEquals(graph.listRelationIds(), ['hasPart'])
@@ -89,6 +93,7 @@ class ExportImportTest(ExportImportTestCase):
             ('prefix', 'cps'),
             ('subject_prefix', 'docid'),
             ('object_prefix', 'docid'),
+            ('key_type', 'I'),
             ]
         self.assertEquals(hasPart.propertyItems(), property_items)
 
@@ -132,6 +137,104 @@ class ExportImportTest(ExportImportTestCase):
         self._checkExportProfile(os.path.join(TEST_PROFILES_PATH, 'basic'),
                                  toc_list)
 
+    def test_is_sorted_edges(self):
+        from Products.CPSRelation.exportimport import is_sorted_edges
+        self.assertEquals(is_sorted_edges(''), True)
+        self.assertEquals(is_sorted_edges("1\t2\n1\t3\n\n2\t1\n"), True)
+        self.assertEquals(is_sorted_edges("2\t3\n1\t5\n"), False)
+        # interned identifiers and invalid lines
+        self.assertEquals(is_sorted_edges("a\t1\n"), False)
+        self.assertEquals(is_sorted_edges("1 2\n"), False)
+
+    def test_iter_edges_lines(self):
+        from Products.CPSRelation.exportimport import iter_edges_lines
+        lines = iter_edges_lines("1\t2\r\n\nfoo\t3\n")
+        self.assertEquals(lines.next(), ('1', '2'))
+        self.assertEquals(list(lines), [('foo', '3')])
+        self.assertRaises(ValueError, list, iter_edges_lines("1 2\n"))
+
+    if 'L' in TREE_FLAVOURS:
+        # the edges profile holds a relation between 64 bits ids
+
+        def test_edges_import(self):
+            self.registerProfile('edges', "CPS Relation", "Edges profile",
+                                 'tests/profiles/edges', 'CPSRelation')
+            self.importProfile('CPSRelation:edges')
+            graph = self.folder.portal_relations.iobtree_graph
+            self.assertEquals(graph.export_edges, True)
+            hasPart = graph._getRelation('hasPart')
+            self.assertEquals(hasPart.key_type, 'L')
+            self.assertEquals(list(hasPart.iterEdges()),
+                              [(1, 2), (1, 3), (2, 3), (3, 2 ** 40)])
+            self.assertEquals(len(hasPart), 4)
+            self.assertEquals(list(graph.listResourceIds()), [1, 2, 3, 2 ** 40])
+            # importing again with purge keeps the 64 bits trees and does not
+            # duplicate edges
+            self.importProfile('CPSRelation:edges')
+            self.assertEquals(hasPart.key_type, 'L')
+            self.assertEquals(hasPart.hasEdge(3, 2 ** 40), True)
+            self.assertEquals(len(hasPart), 4)
+
+        def test_edges_sync(self):
+            self.registerProfile('edges', "CPS Relation", "Edges profile",
+                                 'tests/profiles/edges', 'CPSRelation')
+            self.importProfile('CPSRelation:edges')
+            graph = self.folder.portal_relations.iobtree_graph
+            hasPart = graph._getRelation('hasPart')
+            hasPart.addIds([(4, 5)])
+            hasPart.removeIds([(1, 2)])
+            # purging import syncs edges with the profile
+            self.importProfile('CPSRelation:edges')
+            self.assertEquals(list(hasPart.iterEdges()),
+                              [(1, 2), (1, 3), (2, 3), (3, 2 ** 40)])
+            self.assertEquals(len(hasPart), 4)
+
+        def test_edges_sync_chunks(self):
+            from xml.dom.minidom import parseString
+            from Products.GenericSetup.tests.common import DummyImportContext
+            from Products.CPSRelation.exportimport import RelationXMLAdapter
+            self.registerProfile('edges', "CPS Relation", "Edges profile",
+                                 'tests/profiles/edges', 'CPSRelation')
+            self.importProfile('CPSRelation:edges')
+            hasPart = self.folder.portal_relations.iobtree_graph.hasPart
+            context = DummyImportContext(self.folder, purge=True)
+            context._files['edges/hasPart-1.txt'] = "2\t3\n1\t5\n"
+            context._files['edges/hasPart-2.txt'] = "1\t2\n2\t3\n"
+            adapter = RelationXMLAdapter(hasPart, context)
+            # chunk files are sorted and merged
+            node = parseString('<relation name="hasPart">'
+                               '<edges file="edges/hasPart-1.txt"/>'
+                               '<edges file="edges/hasPart-2.txt"/>'
+                               '</relation>').documentElement
+            adapter._initEdges(node)
+            self.assertEquals(list(hasPart.iterEdges()),
+                              [(1, 2), (1, 5), (2, 3)])
+            # relations without edges nodes are not synced
+            node = parseString('<relation name="hasPart"/>').documentElement
+            adapter._initEdges(node)
+            self.assertEquals(len(hasPart), 3)
+            # syncing depends on the imported files, not on the target graph
+            hasPart.aq_parent.manage_changeProperties(export_edges=False)
+            node = parseString('<relation name="hasPart">'
+                               '<edges file="edges/hasPart-2.txt"/>'
+                               '</relation>').documentElement
+            adapter._initEdges(node)
+            self.assertEquals(list(hasPart.iterEdges()), [(1, 2), (2, 3)])
+
+        def test_edges_export(self):
+            self.registerProfile('edges', "CPS Relation", "Edges profile",
+                                 'tests/profiles/edges', 'CPSRelation')
+            self.importProfile('CPSRelation:edges')
+            toc_list = [
+                'export_steps.xml',
+                'import_steps.xml',
+                'relations.xml',
+                'relations/iobtree_graph.xml',
+                'relations/iobtree_graph/hasPart-1.txt',
+               ]
+            self._checkExportProfile(os.path.join(TEST_PROFILES_PATH, 'edges'),
+                                     toc_list)
+
 
     if USE_REDLAND:
         # additionnal test for redland graphs
@@ -158,6 +261,8 @@ class ExportImportTest(ExportImportTestCase):
                 # FIXME change that string into a readable one
                 ('mysql_options', '"host=\'localhost\',port=3306,user=\'test\',password=\'pass\'"'),
                 ('mysql_database', 'db_name'),
+                ('write_batch_size', 1000),
+                ('node_cache_size', 1000),
                 ]
             self.assertEquals(graph.meta_type, 'Redland Graph')
             self.assertEquals(graph.propertyItems(), property_items)
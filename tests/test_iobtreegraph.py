@@ -25,16 +25,35 @@
 
 import unittest
 
+import transaction
+
+from BTrees.IIBTree import IIBTree
+from BTrees.IIBTree import IITreeSet
+from BTrees.IOBTree import IOBTree
+try:
+    from BTrees.LLBTree import LLBTree
+    from BTrees.LLBTree import LLTreeSet
+    from BTrees.LOBTree import LOBTree
+except ImportError:
+    # 64 bits BTrees are only available with ZODB >= 3.8
+    LLBTree = None
+    LLTreeSet = None
+    LOBTree = None
 from zope.interface.verify import verifyClass
 
 from Products.CPSRelation.interfaces import IGraph
 from Products.CPSRelation.interfaces import IVersionHistoryResource
+from Products.CPSRelation.node import Literal
 from Products.CPSRelation.node import PrefixedResource
 from Products.CPSRelation.node import VersionHistoryResource
 from Products.CPSRelation.statement import Statement
 from Products.CPSRelation.iobtree.iobtreegraph import IOBTreeGraph
+from Products.CPSRelation.iobtree.iobtreegraph import combine_ids
+from Products.CPSRelation.iobtree.iobtreerelation import TREE_FLAVOURS
+from Products.CPSRelation.iobtree.iobtreerelation import UNKNOWN_ID
 
 from Products.CPSRelation.tests.CPSRelationTestCase import CPSRelationTestCase
+from Products.CPSRelation.tests.CPSRelationTestCase import doc
 
 class IOBTreeGraphTestCase(CPSRelationTestCase):
     """CPSRelation test case using IOBtree relations"""
@@ -47,8 +66,16 @@ class IOBTreeGraphTestCase(CPSRelationTestCase):
                                subject_prefix='docid',
                                object_prefix='docid')
         self.hasPart = self.graph.hasPart
+        self.has_part = PrefixedResource('cps', 'hasPart')
         self.addTestRelations()
 
+    def addEdges(self, predicate, tuples):
+        """Add statements between documents for (docid, docid) tuples
+        """
+        self.graph.add([Statement(doc(subject), predicate,
+                                  doc(object))
+                        for subject, object in tuples])
+
     def addTestRelations(self):
         statements = [
             Statement(IVersionHistoryResource(self.proxy1),
@@ -121,6 +148,7 @@ class TestIOBTreeGraph(IOBTreeGraphTestCase):
             ('prefix', 'prefix'),
             ('subject_prefix', 'subject_prefix'),
             ('object_prefix', 'object_prefix'),
+            ('key_type', 'I'),
             ]
         self.assertEqual(dummy.propertyItems(), property_items)
 
@@ -131,6 +159,72 @@ class TestIOBTreeGraph(IOBTreeGraphTestCase):
         self.assertEqual(self.graph.listRelationIds(), [])
 
 
+    def test_upgradeStorage(self):
+        self.hasPart.relations[1] = [2]
+        self.hasPart.inverse_relations[2] = [1]
+        self.assertEqual(self.graph.upgradeStorage(), 2)
+        self.assertEqual(self.graph.upgradeStorage(), 0)
+
+
+    def test_check_repair(self):
+        reports = self.graph.check()
+        ids = reports.keys()
+        ids.sort()
+        expected = list(self.graph.listRelationIds())
+        expected.sort()
+        self.assertEqual(ids, expected)
+        self.assertEqual(reports['hasPart']['consistent'], True)
+        # stale inverse tuple
+        self.hasPart._add(999999, 12345, inverse=True)
+        reports = self.graph.check()
+        self.assertEqual(reports['hasPart']['consistent'], False)
+        self.assertEqual(reports['hasPart']['missing_direct'],
+                         [(12345, 999999)])
+        report = self.graph.repair()
+        self.assertEqual(report['done'], True)
+        self.assertEqual(report['relations']['hasPart']['removed'], 1)
+        self.assertEqual(report['relations']['hasPart']['done'], True)
+        self.assertEqual(self.graph.check()['hasPart']['consistent'], True)
+        self.assert_(999999 not in list(self.graph.listResourceIds()))
+
+    def test_repair_resume(self):
+        # relations whose work is a multiple of max_keys
+        for id in ('aRelation', 'bRelation'):
+            relation = self.graph.addRelation(id)
+            relation.addIds([(i, i + 1) for i in range(1000)])
+            relation.inverse_relations.clear()
+        calls = 0
+        while True:
+            report = self.graph.repair(max_keys=1000)
+            calls += 1
+            if report['done']:
+                break
+            self.assert_(calls < 10, "repair does not resume")
+            self.assert_(report['keys'] <= 1000)
+        self.assertEqual(self.graph._repair_checkpoint, None)
+        reports = self.graph.check()
+        for id in ('aRelation', 'bRelation', 'hasPart'):
+            self.assertEqual(reports[id]['consistent'], True)
+        self.assertEqual(self.graph.repair()['done'], True)
+
+    def test_relation_repair(self):
+        # repairing a relation directly rebuilds the graph indexes
+        self.hasPart._add(999999, 12345, inverse=True)
+        self.graph.rebuildResourceIndex()
+        self.assert_(999999 in list(self.graph.listResourceIds()))
+        report = self.hasPart.repair()
+        self.assertEqual(report['removed'], 1)
+        self.assert_(999999 not in list(self.graph.listResourceIds()))
+
+    def test__syncIds(self):
+        res = self.graph._syncIds(self.hasPart, [(1, 2), (12345, 666)])
+        self.assertEqual(res, {'added': 1, 'removed': 0, 'unchanged': 1})
+        self.assertEqual(list(self.graph.listResourceIds()),
+                         [1, 2, 666, 12345])
+        res = self.graph._syncIds(self.hasPart, [(1, 2)])
+        self.assertEqual(res, {'added': 0, 'removed': 1, 'unchanged': 1})
+        self.assertEqual(list(self.graph.listResourceIds()), [1, 2])
+
     def test__getIOBTreeRelation(self):
         predicate = PrefixedResource('cps', 'hasPart')
         self.assertEqual(self.graph._getIOBTreeRelation(predicate),
@@ -181,6 +275,47 @@ class TestIOBTreeGraph(IOBTreeGraphTestCase):
         self.assertEqual(self.graph.hasStatement(statement), True)
 
 
+    def test__add_iterator(self):
+        predicate = PrefixedResource('cps', 'hasPart')
+        statements = (Statement(PrefixedResource('docid', str(x)),
+                                predicate,
+                                PrefixedResource('docid', str(x + 1)))
+                      for x in xrange(10))
+        self.graph._add(statements, savepoint=4)
+        self.assertEqual(len(self.graph), 11)
+        # unknown predicates are ignored
+        self.graph._add(iter([Statement(PrefixedResource('docid', '1'),
+                                        PrefixedResource('cps', 'dummy'),
+                                        PrefixedResource('docid', '2'))]))
+        self.assertEqual(len(self.graph), 11)
+        self.graph._remove(iter(self.test_relations))
+        self.assertEqual(len(self.graph), 10)
+
+
+    def test__add_savepoint(self):
+        # the savepoint counter is shared by the relations
+        savepoints = []
+        def savepoint(optimistic=False):
+            savepoints.append(optimistic)
+        self.graph.addRelation('isPartOf', prefix='cps',
+                               subject_prefix='docid',
+                               object_prefix='docid')
+        statements = []
+        for id in ('hasPart', 'isPartOf'):
+            predicate = PrefixedResource('cps', id)
+            statements.extend([Statement(doc(x), predicate, doc(x + 100))
+                               for x in xrange(4)])
+        original = transaction.savepoint
+        transaction.savepoint = savepoint
+        try:
+            self.graph._add(statements, savepoint=3)
+        finally:
+            transaction.savepoint = original
+        # 4 subjects and 4 objects updated in each relation
+        self.assertEqual(len(savepoints), 16 // 3)
+        self.assertEqual(len(self.graph), 9)
+
+
     def test_remove(self):
         statement = self.test_relations[0]
         self.assertEqual(self.graph.hasStatement(statement), True)
@@ -193,6 +328,89 @@ class TestIOBTreeGraph(IOBTreeGraphTestCase):
                          keep_order=False)
 
 
+    def test_iterStatements(self):
+        iterator = self.graph.iterStatements()
+        self.assertEqual(list(iterator), self.test_relations)
+        statement = Statement(None, PrefixedResource('cps', 'hasPart'), None)
+        self.assertEqual(list(self.graph.iterStatements(statement)),
+                         self.test_relations)
+        statement = Statement(None, PrefixedResource('cps', 'dummy'), None)
+        self.assertEqual(list(self.graph.iterStatements(statement)), [])
+
+
+    def test_getStatementsPage(self):
+        statements = []
+        cursor = None
+        while True:
+            page, cursor = self.graph.getStatementsPage(limit=3,
+                                                        cursor=cursor)
+            self.assert_(len(page) <= 3)
+            statements.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual(statements, self.test_relations)
+        statement = Statement(None, PrefixedResource('cps', 'dummy'), None)
+        self.assertEqual(self.graph.getStatementsPage(statement), ([], None))
+        self.assertRaises(ValueError, self.graph.getStatementsPage, limit=-1)
+
+
+    def test_getObjectsForMany(self):
+        subject = IVersionHistoryResource(self.proxy1)
+        object = IVersionHistoryResource(self.proxy2)
+        predicate = PrefixedResource('cps', 'hasPart')
+        res = self.graph.getObjectsForMany([subject, object], predicate)
+        self.assertEqual(res, {
+            subject: self.graph.getObjects(subject, predicate),
+            object: self.graph.getObjects(object, predicate),
+            })
+        res = self.graph.getObjectsForMany([subject],
+                                           PrefixedResource('cps', 'dummy'))
+        self.assertEqual(res, {subject: []})
+
+
+    def test_getSubjectsForMany(self):
+        subject = IVersionHistoryResource(self.proxy1)
+        object = IVersionHistoryResource(self.proxy2)
+        predicate = PrefixedResource('cps', 'hasPart')
+        res = self.graph.getSubjectsForMany(predicate, [subject, object])
+        self.assertEqual(res, {
+            subject: self.graph.getSubjects(predicate, subject),
+            object: self.graph.getSubjects(predicate, object),
+            })
+        self.assertEqual(self.graph.getSubjectsForMany(predicate, []), {})
+
+
+    def test_countStatements(self):
+        count = len(self.test_relations)
+        self.assertEqual(self.graph.countStatements(), count)
+        statement = Statement(None, PrefixedResource('cps', 'hasPart'), None)
+        self.assertEqual(self.graph.countStatements(statement), count)
+        statement = Statement(None, PrefixedResource('cps', 'dummy'), None)
+        self.assertEqual(self.graph.countStatements(statement), 0)
+        for statement in self.test_relations:
+            self.assertEqual(self.graph.countStatements(statement), 1)
+
+
+    def test_countSubjects(self):
+        subject = IVersionHistoryResource(self.proxy1)
+        predicate = PrefixedResource('cps', 'hasPart')
+        object = IVersionHistoryResource(self.proxy2)
+        self.assertEqual(self.graph.countSubjects(predicate, object), 1)
+        self.assertEqual(self.graph.countSubjects(predicate, subject),
+                         len(self.graph.getSubjects(predicate, subject)))
+        self.assertEqual(self.graph.countSubjects(
+            PrefixedResource('cps', 'dummy'), object), 0)
+
+
+    def test_countObjects(self):
+        subject = IVersionHistoryResource(self.proxy1)
+        predicate = PrefixedResource('cps', 'hasPart')
+        self.assertEqual(self.graph.countObjects(subject, predicate),
+                         len(self.graph.getObjects(subject, predicate)))
+        self.assertEqual(self.graph.countObjects(
+            subject, PrefixedResource('cps', 'dummy')), 0)
+
+
     def test_getSubjects(self):
         subject = IVersionHistoryResource(self.proxy1)
         predicate = PrefixedResource('cps', 'hasPart')
@@ -226,6 +444,51 @@ class TestIOBTreeGraph(IOBTreeGraphTestCase):
                          objects, keep_order=False)
 
 
+    def test_getSubjectIds(self):
+        predicate = PrefixedResource('cps', 'hasPart')
+        self.assertEqual(list(self.graph.getSubjectIds(predicate, 666)),
+                         [12345])
+        self.assertEqual(list(self.graph.getSubjectIds(predicate, 12345)), [])
+        dummy = PrefixedResource('cps', 'dummy')
+        self.assertEqual(list(self.graph.getSubjectIds(dummy, 666)), [])
+
+
+    def test_getObjectIds(self):
+        predicate = PrefixedResource('cps', 'hasPart')
+        self.assertEqual(list(self.graph.getObjectIds(12345, predicate)),
+                         [666])
+        self.assertEqual(list(self.graph.getObjectIds(666, predicate)), [])
+        dummy = PrefixedResource('cps', 'dummy')
+        self.assertEqual(list(self.graph.getObjectIds(12345, dummy)), [])
+
+
+    def test_getObjectIds_copy(self):
+        predicate = PrefixedResource('cps', 'hasPart')
+        ids = self.graph.getObjectIds(12345, predicate)
+        ids.insert(777)
+        self.assertEqual(self.graph.hasEdge(12345, predicate, 777), False)
+        ids = self.graph.querySubjectIds(all_of=[(predicate, None)])
+        ids.insert(777)
+        self.assertEqual(list(self.graph.hasPart.getAllSubjectIds()),
+                         [12345])
+
+
+    def test_hasEdge(self):
+        predicate = PrefixedResource('cps', 'hasPart')
+        self.assertEqual(self.graph.hasEdge(12345, predicate, 666), True)
+        self.assertEqual(self.graph.hasEdge(666, predicate, 12345), False)
+        dummy = PrefixedResource('cps', 'dummy')
+        self.assertEqual(self.graph.hasEdge(12345, dummy, 666), False)
+
+
+    def test_iterEdges(self):
+        predicate = PrefixedResource('cps', 'hasPart')
+        self.assertEqual(list(self.graph.iterEdges(predicate)),
+                         [(12345, 666)])
+        dummy = PrefixedResource('cps', 'dummy')
+        self.assertEqual(list(self.graph.iterEdges(dummy)), [])
+
+
     def test_hasStatement(self):
         statement = self.test_relations[0]
         self.assertEqual(statement in self.graph.getStatements(),
@@ -257,6 +520,103 @@ class TestIOBTreeGraph(IOBTreeGraphTestCase):
 
 
 
+    def test_hasResource_invalid(self):
+        self.assertEqual(self.graph.hasResource(None), False)
+        self.assertEqual(self.graph.hasResource(Literal('12345')), False)
+        self.assertEqual(self.graph.hasResource(
+            PrefixedResource('docid', str(2 ** 40))),
+                         False)
+
+
+    def test_relation_writes_indexes(self):
+        # writes done on the relation keep the graph indexes up to date
+        hasPart = self.graph._getRelation('hasPart')
+        self.assertEqual(hasPart.addIds([(12345, 777), (777, 888)]), 2)
+        self.assertEqual(self.graph.hasResource(
+            PrefixedResource('docid', '888')),
+                         True)
+        self.assertEqual(self.graph.countResources(), 4)
+        hasPart.removeIds([(777, 888)])
+        self.assertEqual(self.graph.hasResource(
+            PrefixedResource('docid', '888')),
+                         False)
+        self.assertEqual(self.graph.countResources(), 3)
+        hasPart.add([(PrefixedResource('docid', '1'),
+                      PrefixedResource('docid', '2'))])
+        self.assertEqual(self.graph.countResources(), 5)
+        hasPart.syncIds([(1, 2), (12345, 666)])
+        self.assertEqual(list(self.graph.listResourceIds()),
+                         [1, 2, 666, 12345])
+        hasPart.clear()
+        self.assertEqual(self.graph.countResources(), 0)
+        self.assertEqual(self.graph.hasResource(
+            PrefixedResource('docid', '12345')),
+                         False)
+
+
+    def test_hasResource_predicate(self):
+        self.assertEqual(self.graph.hasResource(
+            PrefixedResource('cps', 'hasPart')),
+                         True)
+        self.graph.addRelation('hasComment')
+        self.assertEqual(self.graph.hasResource(
+            PrefixedResource('cps', 'hasComment')),
+                         False)
+        self.assertEqual(self.graph.hasResource(
+            PrefixedResource('docid', 'foo')),
+                         False)
+
+
+    def test_hasResource_old_graph(self):
+        # graph created by an older version
+        self.graph._resources = None
+        self.test_hasResource()
+        self.assertEqual(list(self.graph.listResourceIds()), [666, 12345])
+        self.assertEqual(self.graph._resources is None, False)
+
+
+    def test_resource_index(self):
+        self.assertEqual(list(self.graph._resources.items()),
+                         [(666, 1), (12345, 1)])
+        predicate = PrefixedResource('cps', 'hasPart')
+        statements = [
+            Statement(PrefixedResource('docid', '12345'), predicate,
+                      PrefixedResource('docid', '777')),
+            Statement(PrefixedResource('docid', '777'), predicate,
+                      PrefixedResource('docid', '12345')),
+            ]
+        self.graph.add(statements)
+        self.assertEqual(list(self.graph._resources.items()),
+                         [(666, 1), (777, 2), (12345, 2)])
+        self.graph.remove(statements[:1] + self.test_relations)
+        self.assertEqual(list(self.graph._resources.items()),
+                         [(777, 1), (12345, 1)])
+        # removing again does not change anything
+        self.graph.remove(statements[:1])
+        self.assertEqual(list(self.graph._resources.items()),
+                         [(777, 1), (12345, 1)])
+        self.assertEqual(self.graph.countResources(), 2)
+        self.graph.deleteRelation('hasPart')
+        self.assertEqual(list(self.graph._resources.items()), [])
+        self.assertEqual(self.graph.countResources(), 0)
+
+
+    def test_listResourceIds(self):
+        self.assertEqual(list(self.graph.listResourceIds()), [666, 12345])
+        self.graph.clear()
+        self.assertEqual(list(self.graph.listResourceIds()), [])
+
+
+    def test_countResources(self):
+        self.assertEqual(self.graph.countResources(), 2)
+        self.graph.add([Statement(PrefixedResource('docid', '12345'),
+                                  PrefixedResource('cps', 'hasPart'),
+                                  PrefixedResource('docid', '12345'))])
+        self.assertEqual(self.graph.countResources(), 2)
+        self.graph.rebuildResourceIndex()
+        self.assertEqual(self.graph.countResources(), 2)
+
+
     def test_clear(self):
         self.assertEqual(len(self.graph) > 0, True)
         self.graph.clear()
@@ -286,7 +646,403 @@ class TestIOBTreeGraph(IOBTreeGraphTestCase):
                           self.graph.write)
 
 
+class TestIOBTreeGraphPredicateIndex(TestIOBTreeGraph):
+    """Run IOBTree graph tests with the predicate index"""
+
+    def setUp(self):
+        TestIOBTreeGraph.setUp(self)
+        self.graph.manage_changeProperties(predicate_index=True)
+        self.graph.addRelation('hasReference',
+                               prefix='cps',
+                               subject_prefix='docid',
+                               object_prefix='docid')
+        self.hasReference = self.graph.hasReference
+
+    def getIndexItems(self, index):
+        return [(key, list(value)) for key, value in index.items()]
+
+    def test_test_case_graph(self):
+        self.assertEqual(self.graph._getRelations(),
+                         [self.hasPart, self.hasReference])
+
+    def test__getRelations(self):
+        self.assertEqual(self.graph._getRelations(),
+                         [self.hasPart, self.hasReference])
+
+    def test_listRelationIds(self):
+        self.assertEqual(self.graph.listRelationIds(),
+                         ['hasPart', 'hasReference'])
+
+    def test_deleteAllRelations(self):
+        self.graph.deleteAllRelations()
+        self.assertEqual(self.graph.listRelationIds(), [])
+        self.assertEqual(self.getIndexItems(self.graph._subject_predicates),
+                         [])
+
+    def test_addRelation(self):
+        self.graph.addRelation('dummy')
+        self.assertEqual(self.graph.listRelationIds(),
+                         ['hasPart', 'hasReference', 'dummy'])
+
+    def test_deleteRelation(self):
+        self.graph.deleteRelation('hasPart')
+        self.assertEqual(self.graph.listRelationIds(), ['hasReference'])
+        self.assertEqual(self.getIndexItems(self.graph._subject_predicates),
+                         [])
+        self.assertEqual(self.getIndexItems(self.graph._object_predicates),
+                         [])
+
+    def test_predicate_index(self):
+        self.assertEqual(self.getIndexItems(self.graph._subject_predicates),
+                         [(12345, ['hasPart'])])
+        self.assertEqual(self.getIndexItems(self.graph._object_predicates),
+                         [(666, ['hasPart'])])
+        statement = Statement(PrefixedResource('docid', '12345'),
+                              PrefixedResource('cps', 'hasReference'),
+                              PrefixedResource('docid', '777'))
+        self.graph.add([statement])
+        self.assertEqual(self.getIndexItems(self.graph._subject_predicates),
+                         [(12345, ['hasPart', 'hasReference'])])
+        self.assertEqual(self.getIndexItems(self.graph._object_predicates),
+                         [(666, ['hasPart']), (777, ['hasReference'])])
+        self.graph.remove(self.test_relations)
+        self.assertEqual(self.getIndexItems(self.graph._subject_predicates),
+                         [(12345, ['hasReference'])])
+        self.assertEqual(self.getIndexItems(self.graph._object_predicates),
+                         [(777, ['hasReference'])])
+        # disable the index
+        self.graph.manage_changeProperties(predicate_index=False)
+        self.assertEqual(self.graph._subject_predicates, None)
+        self.assertEqual(self.graph._object_predicates, None)
+
+    def test_getPredicates_index(self):
+        subject = IVersionHistoryResource(self.proxy1)
+        object = IVersionHistoryResource(self.proxy2)
+        statement = Statement(subject,
+                              PrefixedResource('cps', 'hasReference'),
+                              object)
+        self.graph.add([statement])
+        self.assertEqual(self.graph.getPredicates(subject, object),
+                         [PrefixedResource('cps', 'hasPart'),
+                          PrefixedResource('cps', 'hasReference')])
+        self.assertEqual(self.graph.getPredicates(object, subject), [])
+        self.assertEqual(self.graph.getPredicates(
+            subject, PrefixedResource('docid', 'foo')), [])
+
+    def test_clear(self):
+        TestIOBTreeGraph.test_clear(self)
+        self.assertEqual(self.getIndexItems(self.graph._subject_predicates),
+                         [])
+
+
+class TestIOBTreeGraphQuery(IOBTreeGraphTestCase):
+    """Test set algebra queries"""
+
+    def setUp(self):
+        IOBTreeGraphTestCase.setUp(self)
+        self.graph.addRelation('hasTag',
+                               prefix='cps',
+                               subject_prefix='docid',
+                               object_prefix='docid')
+        self.has_tag = PrefixedResource('cps', 'hasTag')
+        self.addEdges(self.has_part, [(1, 10), (2, 10), (3, 10), (4, 11)])
+        self.addEdges(self.has_tag, [(1, 20), (2, 20), (2, 21), (3, 21)])
+
+    def test_combine_ids(self):
+        self.assertEqual(list(combine_ids([IITreeSet([1, 2, 3]),
+                                           IITreeSet([2, 3, 4])])),
+                         [2, 3])
+        self.assertEqual(list(combine_ids(any_of=[IITreeSet([1]),
+                                                  IITreeSet([3])])),
+                         [1, 3])
+        self.assertEqual(list(combine_ids([IITreeSet([1, 2, 3])],
+                                          none_of=[IITreeSet([1]),
+                                                   IITreeSet([3])])),
+                         [2])
+        self.assertEqual(list(combine_ids([IITreeSet([1, 2]), IITreeSet()],
+                                          [IITreeSet([1])])),
+                         [])
+        self.assertRaises(ValueError, combine_ids, none_of=[IITreeSet([1])])
+
+    def test_querySubjectIds(self):
+        ids = self.graph.querySubjectIds(
+            all_of=[(self.has_part, doc(10)),
+                    (self.has_tag, doc(20))],
+            none_of=[(self.has_tag, doc(21))])
+        self.assertEqual(list(ids), [1])
+        ids = self.graph.querySubjectIds(
+            any_of=[(self.has_part, doc(11)),
+                    (self.has_tag, doc(21))])
+        self.assertEqual(list(ids), [2, 3, 4])
+        ids = self.graph.querySubjectIds(
+            all_of=[(self.has_part, None)],
+            none_of=[(self.has_tag, None)])
+        self.assertEqual(list(ids), [4, 12345])
+        ids = self.graph.querySubjectIds(
+            all_of=[(PrefixedResource('cps', 'dummy'), doc(10))])
+        self.assertEqual(list(ids), [])
+
+    def test_queryObjectIds(self):
+        ids = self.graph.queryObjectIds(
+            all_of=[(doc(2), self.has_tag)],
+            none_of=[(doc(1), self.has_tag)])
+        self.assertEqual(list(ids), [21])
+        ids = self.graph.queryObjectIds(any_of=[(None, self.has_part)])
+        self.assertEqual(list(ids), [10, 11, 666])
+
+    def test_querySubjects(self):
+        nodes = self.graph.querySubjects(
+            all_of=[(self.has_part, doc(10))])
+        self.assertEqual([x.localname for x in nodes], ['1', '2', '3'])
+        nodes = self.graph.querySubjects(
+            all_of=[(self.has_part, doc(10))], start=1, limit=1)
+        self.assertEqual([x.localname for x in nodes], ['2'])
+
+    def test_queryObjects(self):
+        nodes = self.graph.queryObjects(
+            any_of=[(doc(2), self.has_tag), (doc(4), self.has_part)])
+        self.assertEqual([x.localname for x in nodes], ['11', '20', '21'])
+
+
+class TestIOBTreeGraphTraversal(IOBTreeGraphTestCase):
+    """Test traversals"""
+
+    def setUp(self):
+        IOBTreeGraphTestCase.setUp(self)
+        self.addEdges(self.has_part, [(1, 2), (2, 3), (3, 1), (2, 4), (4, 5)])
+
+    def test_traverse(self):
+        ids = self.graph.traverse(doc(1), self.has_part)
+        self.assertEqual(list(ids), [2, 3, 4, 5])
+        ids = self.graph.traverse(doc(4), [self.has_part])
+        self.assertEqual(list(ids), [5])
+        ids = self.graph.traverse(doc(5), self.has_part)
+        self.assertEqual(list(ids), [])
+        ids = self.graph.traverse(doc(5), self.has_part, 'backward')
+        self.assertEqual(list(ids), [1, 2, 3, 4])
+        ids = self.graph.traverse(doc(5), self.has_part, 'both',
+                                  max_depth=1)
+        self.assertEqual(list(ids), [4])
+        ids = self.graph.traverse(doc(1), PrefixedResource('cps', 'foo'))
+        self.assertEqual(list(ids), [])
+        self.assertRaises(ValueError, self.graph.traverse, doc(1),
+                          self.has_part, 'sideways')
+
+    def test_traverse_limits(self):
+        ids = self.graph.traverse(doc(1), self.has_part, max_depth=2)
+        self.assertEqual(list(ids), [2, 3, 4])
+        ids = self.graph.traverse(doc(1), self.has_part, limit=2)
+        self.assertEqual(list(ids), [2, 3])
+
+    def test_traverse_depths(self):
+        depths = self.graph.traverse(doc(1), self.has_part,
+                                     result='depths')
+        self.assertEqual(list(depths.items()),
+                         [(2, 1), (3, 2), (4, 2), (5, 3)])
+
+    def test_traverse_paths(self):
+        paths = self.graph.traverse(doc(1), self.has_part,
+                                    result='paths')
+        self.assertEqual(paths, {
+            2: (1, 2),
+            3: (1, 2, 3),
+            4: (1, 2, 4),
+            5: (1, 2, 4, 5),
+            })
+        self.assertRaises(ValueError, self.graph.traverse, doc(1),
+                          self.has_part, result='nodes')
+
+    def test_closure(self):
+        nodes = self.graph.closure(doc(4), self.has_part)
+        self.assertEqual([x.localname for x in nodes], ['5'])
+        nodes = self.graph.closure(doc(4), self.has_part, 'backward')
+        self.assertEqual([x.localname for x in nodes], ['1', '2', '3'])
+        nodes = self.graph.closure(doc(4), PrefixedResource('cps', 'foo'))
+        self.assertEqual(nodes, [])
+
+    def test_findPath(self):
+        path = self.graph.findPath(doc(3), doc(5))
+        self.assertEqual([(x.subject.localname, x.object.localname)
+                          for x in path],
+                         [('3', '1'), ('1', '2'), ('2', '4'), ('4', '5')])
+        for statement in path:
+            self.assertEqual(self.graph.hasStatement(statement), True)
+        path = self.graph.findPath(doc(1), doc(2), [self.has_part])
+        self.assertEqual([(x.subject.localname, x.object.localname)
+                          for x in path],
+                         [('1', '2')])
+        self.assertEqual(self.graph.findPath(doc(1), doc(1)), [])
+        self.assertEqual(self.graph.findPath(doc(5), doc(1)), None)
+        self.assertEqual(self.graph.findPath(doc(3), doc(5),
+                                             max_depth=3),
+                         None)
+        self.assertEqual(self.graph.findPath(doc(1), doc(2),
+                                             PrefixedResource('cps', 'foo')),
+                         None)
+
+
+class TestIOBTreeGraphKeyType(IOBTreeGraphTestCase):
+    """Test graphs with relations between 64 bits ids"""
+
+    def setUp(self):
+        IOBTreeGraphTestCase.setUp(self)
+        self.graph.manage_changeProperties(predicate_index=True)
+        self.big = 2 ** 40
+        self.graph.addRelation('hasBig',
+                               prefix='cps',
+                               subject_prefix='docid',
+                               object_prefix='docid',
+                               key_type='L')
+        self.has_big = PrefixedResource('cps', 'hasBig')
+        self.statement = Statement(doc(self.big), self.has_big,
+                                   doc(self.big + 1))
+        self.graph.add([self.statement,
+                        Statement(doc(12345), self.has_big,
+                                  doc(self.big))])
+
+    def test_indexes(self):
+        self.assert_(isinstance(self.graph._resources, LLBTree))
+        self.assert_(isinstance(self.graph._subject_predicates, LOBTree))
+        self.assertEqual(self.graph.hasResource(doc(self.big + 1)),
+                         True)
+        self.assertEqual(self.graph.hasResource(doc(666)), True)
+        self.assertEqual(self.graph.getPredicates(doc(self.big), None),
+                         [self.has_big])
+
+    def test_statements(self):
+        self.assertEqual(self.graph.hasStatement(self.statement), True)
+        objects = self.graph.getObjects(doc(self.big), self.has_big)
+        self.assertEqual([x.localname for x in objects],
+                         [str(self.big + 1)])
+
+    def test_queries(self):
+        ids = self.graph.querySubjectIds(all_of=[(self.has_big, None),
+                                                 (self.has_part, None)])
+        self.assertEqual(list(ids), [12345])
+        depths = self.graph.traverse(doc(12345), [self.has_big,
+                                                  self.has_part],
+                                     result='depths')
+        self.assertEqual(list(depths.items()),
+                         [(666, 1), (self.big, 1), (self.big + 1, 2)])
+
+    def test_convertKeyType(self):
+        hasBig = self.graph.hasBig
+        self.assertRaises((TypeError, ValueError, OverflowError),
+                          hasBig.convertKeyType, 'I')
+        self.assert_(isinstance(self.graph._resources, LLBTree))
+        self.graph.remove([self.statement])
+        hasBig.convertKeyType('L')
+        self.assert_(isinstance(self.graph._resources, LLBTree))
+        self.graph.remove([Statement(doc(12345), self.has_big,
+                                     doc(self.big))])
+        hasBig.convertKeyType('I')
+        self.assert_(isinstance(self.graph._resources, IIBTree))
+        self.assert_(isinstance(self.graph._subject_predicates, IOBTree))
+
+    def test_getSubjectIds_flavour(self):
+        dummy = PrefixedResource('cps', 'dummy')
+        self.assert_(isinstance(self.graph.getSubjectIds(dummy, self.big),
+                                LLTreeSet))
+        ids = self.graph.getSubjectIds(self.has_part, 666)
+        self.assert_(isinstance(ids, LLTreeSet))
+        self.assertEqual(list(ids), [12345])
+
+    def test_key_type_cache(self):
+        self.assertEqual(self.graph._key_type, 'L')
+        self.graph.remove([self.statement,
+                           Statement(doc(12345), self.has_big,
+                                     doc(self.big))])
+        self.graph.hasBig.convertKeyType('I')
+        self.assertEqual(self.graph._key_type, 'I')
+        self.graph.hasBig.convertKeyType('L')
+        self.assertEqual(self.graph._key_type, 'L')
+        self.graph.deleteRelation('hasBig')
+        self.assertEqual(self.graph._key_type, 'I')
+        self.assert_(isinstance(self.graph._resources, IIBTree))
+        # graphs created by older versions
+        del self.graph._key_type
+        self.assertEqual(self.graph._getFlavour().key_type, 'I')
+        self.graph.upgradeStorage()
+        self.assertEqual(self.graph._key_type, 'I')
+        self.assertEqual(list(self.graph.listResourceIds()), [666, 12345])
+
+
+class TestIOBTreeGraphIntern(IOBTreeGraphTestCase):
+    """Test graphs interning identifiers"""
+
+    def setUp(self):
+        IOBTreeGraphTestCase.setUp(self)
+        self.graph.manage_changeProperties(intern_identifiers=True)
+
+    def test_creation(self):
+        graph = IOBTreeGraph('dummy')
+        self.assertEqual(graph.intern_identifiers, False)
+        self.assertEqual(graph._intern_ids, None)
+        graph = IOBTreeGraph('dummy', intern_identifiers=True)
+        self.assertEqual(graph.intern_identifiers, True)
+        self.assertEqual(graph.countInternedIdentifiers(), 0)
+
+    def test__getIntegerIdentifier(self):
+        self.assertEqual(self.graph._getIntegerIdentifier(doc(12)), 12)
+        self.assertEqual(self.graph._getIntegerIdentifier(doc('abc')),
+                         UNKNOWN_ID)
+        self.assertEqual(self.graph.countInternedIdentifiers(), 0)
+        self.assertEqual(self.graph._getIntegerIdentifier(doc('abc'),
+                                                          create=True),
+                         -1)
+        self.assertEqual(self.graph._getIntegerIdentifier(doc('def'),
+                                                          create=True),
+                         -2)
+        self.assertEqual(self.graph._getIntegerIdentifier(doc('-5'),
+                                                          create=True),
+                         -3)
+        self.assertEqual(self.graph._getIntegerIdentifier(doc('abc')),
+                         -1)
+        self.assertEqual(self.graph._getInternedIdentifier(-2), 'def')
+        self.assertEqual(self.graph.countInternedIdentifiers(), 3)
+        self.assertRaises(ValueError, self.graph._getIntegerIdentifier,
+                          Literal('abc'))
+
+    def test_statements(self):
+        statement = Statement(doc('abc'), self.has_part, doc(1))
+        other = Statement(doc(1), self.has_part, doc('def'))
+        self.graph.add([statement, other])
+        self.assertEqual(self.graph.hasStatement(statement), True)
+        self.assertEqual(self.graph.hasResource(doc('abc')), True)
+        self.assertEqual(self.graph.hasResource(doc('ghi')), False)
+        objects = self.graph.getObjects(doc(1), self.has_part)
+        self.assertEqual([x.localname for x in objects], ['def'])
+        subjects = self.graph.getSubjects(self.has_part, doc(1))
+        self.assertEqual([x.localname for x in subjects], ['abc'])
+        self.assertEqual(self.graph.getObjects(doc('ghi'),
+                                               self.has_part),
+                         [])
+        path = self.graph.findPath(doc('abc'), doc('def'))
+        self.assertEqual([(x.subject.localname, x.object.localname)
+                          for x in path],
+                         [('abc', '1'), ('1', 'def')])
+        self.graph.remove([statement])
+        self.assertEqual(self.graph.hasStatement(statement), False)
+        self.assertEqual(self.graph.hasResource(doc('abc')), False)
+
+    def test_disabled(self):
+        statement = Statement(doc('abc'), self.has_part, doc(1))
+        self.graph.add([statement])
+        self.graph.manage_changeProperties(intern_identifiers=False)
+        # interned identifiers can still be read
+        self.assertEqual(self.graph.hasStatement(statement), True)
+        self.assertRaises(ValueError, self.graph.add,
+                          [Statement(doc('def'), self.has_part,
+                                     doc(1))])
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestIOBTreeGraph))
+    suite.addTest(unittest.makeSuite(TestIOBTreeGraphPredicateIndex))
+    suite.addTest(unittest.makeSuite(TestIOBTreeGraphQuery))
+    suite.addTest(unittest.makeSuite(TestIOBTreeGraphTraversal))
+    if 'L' in TREE_FLAVOURS:
+        suite.addTest(unittest.makeSuite(TestIOBTreeGraphKeyType))
+    suite.addTest(unittest.makeSuite(TestIOBTreeGraphIntern))
     return suite
@@ -25,8 +25,20 @@
 
 import unittest
 
+import transaction
+
 from zope.interface.verify import verifyClass
 
+from BTrees.IIBTree import IITreeSet
+from BTrees.IOBTree import IOBTree
+try:
+    from BTrees.LLBTree import LLTreeSet
+    from BTrees.LOBTree import LOBTree
+except ImportError:
+    # 64 bits BTrees are only available with ZODB >= 3.8
+    LLTreeSet = None
+    LOBTree = None
+
 # register nodes
 from Products.CPSRelation import node
 
@@ -39,6 +51,15 @@ from Products.CPSRelation.statement import Statement
 
 from Products.CPSRelation.iobtree.interfaces import IIOBTreeRelation
 from Products.CPSRelation.iobtree.iobtreerelation import IOBTreeRelation
+from Products.CPSRelation.iobtree.iobtreerelation import iter_batches
+from Products.CPSRelation.iobtree.iobtreerelation import TREE_FLAVOURS
+from Products.CPSRelation.iobtree.iobtreerelation import BULK_BATCH_SIZE
+from Products.CPSRelation.iobtree.iobtreerelation import SavepointCounter
+from Products.CPSRelation.iobtree.iobtreerelation import group_tuples
+from Products.CPSRelation.iobtree.iobtreerelation import diff_sorted
+from Products.CPSRelation.iobtree.iobtreerelation import merge_sorted
+from Products.CPSRelation.iobtree.iobtreerelation import make_cursor
+from Products.CPSRelation.iobtree.iobtreerelation import parse_cursor
 
 from Products.CPSRelation.tests.CPSRelationTestCase import CPSRelationTestCase
 
@@ -58,6 +79,9 @@ class TestIOBtreeRelation(CPSRelationTestCase):
         self.hasPart.add([(IVersionHistoryResource(self.proxy1),
                            IVersionHistoryResource(self.proxy2))])
 
+    def getItems(self, tree):
+        return [(key, list(value)) for key, value in tree.items()]
+
 
     def test_interface(self):
         verifyClass(IIOBTreeRelation, IOBTreeRelation)
@@ -73,6 +97,7 @@ class TestIOBtreeRelation(CPSRelationTestCase):
             ('prefix', 'prefix'),
             ('subject_prefix', 'subject_prefix'),
             ('object_prefix', 'object_prefix'),
+            ('key_type', 'I'),
             ]
         self.assertEqual(dummy.propertyItems(), property_items)
 
@@ -84,6 +109,7 @@ class TestIOBtreeRelation(CPSRelationTestCase):
             ('prefix', 'cps'),
             ('subject_prefix', 'docid'),
             ('object_prefix', 'docid'),
+            ('key_type', 'I'),
             ]
         self.assertEqual(self.hasPart.propertyItems(), property_items)
 
@@ -123,57 +149,267 @@ class TestIOBtreeRelation(CPSRelationTestCase):
 
 
     def test__add(self):
-        self.assertEqual(list(self.hasPart.relations.items()), [])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()), [])
+        self.assertEqual(self.getItems(self.hasPart.relations), [])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations), [])
         self.hasPart._add(1, 2)
-        self.assertEqual(list(self.hasPart.relations.items()),
+        self.assertEqual(self.getItems(self.hasPart.relations),
                          [(1, [2])])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()), [])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations), [])
         self.hasPart._add(2, 1, inverse=True)
-        self.assertEqual(list(self.hasPart.relations.items()),
+        self.assertEqual(self.getItems(self.hasPart.relations),
                          [(1, [2])])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()),
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
                          [(2, [1])])
 
 
     def test__remove(self):
-        self.assertEqual(list(self.hasPart.relations.items()), [])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()), [])
+        self.assertEqual(self.getItems(self.hasPart.relations), [])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations), [])
         self.hasPart._add(1, 2)
         self.hasPart._add(2, 1, inverse=True)
-        self.assertEqual(list(self.hasPart.relations.items()),
+        self.assertEqual(self.getItems(self.hasPart.relations),
                          [(1, [2])])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()),
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
                          [(2, [1])])
         self.hasPart._remove(1, 2)
-        self.assertEqual(list(self.hasPart.relations.items()), [])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()),
+        self.assertEqual(self.getItems(self.hasPart.relations), [])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
                          [(2, [1])])
         self.hasPart._remove(2, 1, inverse=True)
-        self.assertEqual(list(self.hasPart.relations.items()), [])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()), [])
+        self.assertEqual(self.getItems(self.hasPart.relations), [])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations), [])
+
+
+    def test__add_duplicate(self):
+        self.assertEqual(self.hasPart._add(1, 2), True)
+        self.assertEqual(self.hasPart._add(1, 3), True)
+        self.assertEqual(self.hasPart._add(1, 2), False)
+        self.assertEqual(self.getItems(self.hasPart.relations),
+                         [(1, [2, 3])])
+        self.assert_(isinstance(self.hasPart.relations[1], IITreeSet))
+
+
+    def test__remove_missing(self):
+        self.assertEqual(self.hasPart._remove(1, 2), False)
+        self.hasPart._add(1, 2)
+        self.assertEqual(self.hasPart._remove(1, 3), False)
+        self.assertEqual(self.hasPart._remove(1, 2), True)
+        self.assertEqual(self.hasPart._remove(1, 2), False)
+        self.assertEqual(self.getItems(self.hasPart.relations), [])
+
+
+    def test__addIds(self):
+        self.assertEqual(self.hasPart._addIds([(1, 2), (1, 3), (1, 2)]), 2)
+        self.assertEqual(self.hasPart._addIds([(1, 2)]), 0)
+        self.assertEqual(self.getItems(self.hasPart.relations),
+                         [(1, [2, 3])])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
+                         [(2, [1]), (3, [1])])
+        self.assert_(isinstance(self.hasPart.relations[1], IITreeSet))
+
+
+    def test__removeIds(self):
+        self.assertEqual(self.hasPart._removeIds([(1, 2)]), 0)
+        self.hasPart._addIds([(1, 2)])
+        self.assertEqual(self.hasPart._removeIds([(1, 3)]), 0)
+        self.assertEqual(self.hasPart._removeIds([(1, 2)]), 1)
+        self.assertEqual(self.hasPart._removeIds([(1, 2)]), 0)
+        self.assertEqual(self.getItems(self.hasPart.relations), [])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations), [])
+
+
+    def test_upgradeStorage(self):
+        # lists were stored by older versions
+        self.hasPart.relations[1] = [2, 3]
+        self.hasPart.inverse_relations[2] = [1]
+        self.hasPart.inverse_relations[3] = IITreeSet([1])
+        self.assertEqual(self.hasPart.upgradeStorage(), 2)
+        self.assertEqual(self.getItems(self.hasPart.relations),
+                         [(1, [2, 3])])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
+                         [(2, [1]), (3, [1])])
+        for tree in (self.hasPart.relations, self.hasPart.inverse_relations):
+            for value in tree.values():
+                self.assert_(isinstance(value, IITreeSet))
+        self.assertEqual(self.hasPart.upgradeStorage(), 0)
+
+
+    def test_key_type_unsupported(self):
+        self.assertRaises(ValueError, IOBTreeRelation, 'dummy',
+                          key_type='X')
+        self.assertEqual(self.hasPart.key_types, tuple(sorted(TREE_FLAVOURS)))
+
+    if 'L' in TREE_FLAVOURS:
+        # 64 bits BTrees are needed by the tests of 'L' relations
+
+        def test_key_type(self):
+            relation = IOBTreeRelation('big', key_type='L')
+            self.assertEqual(relation.key_type, 'L')
+            self.assert_(isinstance(relation.relations, LOBTree))
+            big = 2 ** 40
+            self.assertEqual(relation.addIds([(big, big + 1), (big, 1)]), 2)
+            self.assertEqual(list(relation.getObjectIds(big)), [1, big + 1])
+            self.assert_(isinstance(relation.getObjectIds(big), LLTreeSet))
+            self.assertEqual(list(relation.getSubjectIds(big + 1)), [big])
+
+
+        def test_key_type_purge(self):
+            relation = IOBTreeRelation('big', key_type='L')
+            big = 2 ** 40
+            relation.addIds([(big, 1)])
+            # purging imports empty properties before setting them again
+            relation._updateProperty('key_type', '')
+            self.assertEqual(relation.key_type, 'L')
+            self.assert_(isinstance(relation.relations, LOBTree))
+            relation._updateProperty('key_type', 'L')
+            self.assertEqual(relation.key_type, 'L')
+            self.assertEqual(relation.hasEdge(big, 1), True)
+
+        def test_convertKeyType(self):
+            self.hasPart.addIds([(1, 2), (1, 3), (2, 3)])
+            self.assertEqual(self.hasPart.convertKeyType('L'), 4)
+            self.assertEqual(self.hasPart.key_type, 'L')
+            self.assert_(isinstance(self.hasPart.relations, LOBTree))
+            self.assert_(isinstance(self.hasPart.inverse_relations, LOBTree))
+            self.assertEqual(self.getItems(self.hasPart.relations),
+                             [(1, [2, 3]), (2, [3])])
+            self.assertEqual(len(self.hasPart), 3)
+            self.hasPart.addIds([(2 ** 40, 1)])
+            # big ids do not fit in 32 bits trees, the relation is kept
+            self.assertRaises((TypeError, ValueError, OverflowError),
+                              self.hasPart.convertKeyType, 'I')
+            self.assertEqual(self.hasPart.key_type, 'L')
+            self.assertEqual(self.hasPart.hasEdge(2 ** 40, 1), True)
+            self.hasPart.removeIds([(2 ** 40, 1)])
+            self.hasPart.manage_changeProperties(key_type='I')
+            self.assertEqual(self.hasPart.key_type, 'I')
+            self.assert_(isinstance(self.hasPart.relations, IOBTree))
+            self.assertEqual(self.getItems(self.hasPart.inverse_relations),
+                             [(2, [1]), (3, [1, 2])])
+
+
+    def test_iter_batches(self):
+        self.assertEqual(list(iter_batches(iter(range(5)), 2)),
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(iter_batches([], 2)), [])
+
+
+    def test_group_tuples(self):
+        tuples = [(2, 1), (1, 3), (2, 0), (1, 2)]
+        self.assertEqual(group_tuples(tuples),
+                         [(1, [2, 3]), (2, [0, 1])])
+        self.assertEqual(group_tuples(tuples, inverse=True),
+                         [(0, [2]), (1, [2]), (2, [1]), (3, [1])])
+
+
+    def test_addIds(self):
+        tuples = ((1, x) for x in xrange(3, 0, -1))
+        self.assertEqual(self.hasPart.addIds(tuples), 3)
+        self.assertEqual(self.hasPart.addIds([(1, 2), (2, 1), (2, 1)]), 1)
+        self.assertEqual(self.getItems(self.hasPart.relations),
+                         [(1, [1, 2, 3]), (2, [1])])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
+                         [(1, [1, 2]), (2, [1]), (3, [1])])
+        self.assertEqual(len(self.hasPart), 4)
+
+
+    def test_addIds_savepoint(self):
+        tuples = [(x, x + 1) for x in xrange(10)]
+        self.assertEqual(self.hasPart.addIds(tuples, savepoint=3), 10)
+        self.assertEqual(len(self.hasPart), 10)
+        self.assertEqual(len(self.hasPart.inverse_relations), 10)
+
+
+    def test_addIds_savepoint_batches(self):
+        # the savepoint counter is not reset between batches
+        savepoints = []
+        def savepoint(optimistic=False):
+            savepoints.append(optimistic)
+        count = BULK_BATCH_SIZE + 10
+        tuples = [(x, x + 1) for x in xrange(count)]
+        original = transaction.savepoint
+        transaction.savepoint = savepoint
+        try:
+            self.assertEqual(self.hasPart.addIds(tuples, savepoint=7), count)
+            self.assertEqual(len(savepoints), 2 * count // 7)
+            del savepoints[:]
+            counter = SavepointCounter(7)
+            self.assertEqual(self.hasPart.removeIds(tuples, counter), count)
+            self.assertEqual(counter.done, 2 * count)
+            self.assertEqual(len(savepoints), 2 * count // 7)
+        finally:
+            transaction.savepoint = original
+        self.assertEqual(len(self.hasPart), 0)
 
 
+    def test_removeIds(self):
+        self.hasPart.addIds([(1, 2), (1, 3), (2, 1)])
+        self.assertEqual(self.hasPart.removeIds([(1, 2), (1, 4), (5, 1)]), 1)
+        self.assertEqual(self.getItems(self.hasPart.relations),
+                         [(1, [3]), (2, [1])])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
+                         [(1, [2]), (3, [1])])
+        self.assertEqual(self.hasPart.removeIds(iter([(1, 3), (2, 1)])), 2)
+        self.assertEqual(self.getItems(self.hasPart.relations), [])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations), [])
+        self.assertEqual(len(self.hasPart), 0)
+
+
+    def test_diff_sorted(self):
+        self.assertEqual(diff_sorted([], []), ([], [], 0))
+        self.assertEqual(diff_sorted([1, 3, 5], [2, 3, 3, 6]),
+                         ([2, 6], [1, 5], 1))
+        self.assertEqual(diff_sorted([1, 2], []), ([], [1, 2], 0))
+        self.assertEqual(diff_sorted([], iter([1, 2])), ([1, 2], [], 0))
+        self.assertRaises(ValueError, diff_sorted, [], [2, 1])
+
+    def test_merge_sorted(self):
+        self.assertEqual(list(merge_sorted([])), [])
+        self.assertEqual(list(merge_sorted([[1, 4], [], iter([2, 3, 4])])),
+                         [1, 2, 3, 4, 4])
+        self.assertEqual(list(merge_sorted([[(1, 2), (2, 1)], [(1, 3)]])),
+                         [(1, 2), (1, 3), (2, 1)])
+
+    def test_diffIds(self):
+        self.hasPart.addIds([(1, 2), (1, 3), (2, 3)])
+        self.assertEqual(self.hasPart.diffIds([(1, 3), (2, 3), (4, 1)]),
+                         ([(4, 1)], [(1, 2)], 2))
+
+    def test_syncIds(self):
+        self.hasPart.addIds([(1, 2), (1, 3), (2, 3)])
+        res = self.hasPart.syncIds([(1, 3), (2, 3), (4, 1)])
+        self.assertEqual(res, {'added': 1, 'removed': 1, 'unchanged': 2})
+        self.assertEqual(list(self.hasPart.iterEdges()),
+                         [(1, 3), (2, 3), (4, 1)])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
+                         [(1, [4]), (3, [1, 2])])
+        self.assertEqual(len(self.hasPart), 3)
+        res = self.hasPart.syncIds([(1, 3), (2, 3), (4, 1)])
+        self.assertEqual(res, {'added': 0, 'removed': 0, 'unchanged': 3})
+        res = self.hasPart.syncIds([])
+        self.assertEqual(res, {'added': 0, 'removed': 3, 'unchanged': 0})
+        self.assertEqual(len(self.hasPart), 0)
+
     def test_add(self):
-        self.assertEqual(list(self.hasPart.relations.items()), [])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()), [])
+        self.assertEqual(self.getItems(self.hasPart.relations), [])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations), [])
         self.addTestRelations()
-        self.assertEqual(list(self.hasPart.relations.items()),
+        self.assertEqual(self.getItems(self.hasPart.relations),
                          [(12345, [666])])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()),
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
                          [(666, [12345])])
 
 
     def test_remove(self):
         self.addTestRelations()
-        self.assertEqual(list(self.hasPart.relations.items()),
+        self.assertEqual(self.getItems(self.hasPart.relations),
                          [(12345, [666])])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()),
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
                          [(666, [12345])])
         self.hasPart.remove([(IVersionHistoryResource(self.proxy1),
                               IVersionHistoryResource(self.proxy2))])
-        self.assertEqual(list(self.hasPart.relations.items()), [])
-        self.assertEqual(list(self.hasPart.inverse_relations.items()), [])
+        self.assertEqual(self.getItems(self.hasPart.relations), [])
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations), [])
 
 
     def test_getObjects(self):
@@ -192,6 +428,35 @@ class TestIOBtreeRelation(CPSRelationTestCase):
         self.assertEqual(sources, [])
 
 
+    def test_getObjectIds(self):
+        self.addTestRelations()
+        self.assertEqual(list(self.hasPart.getObjectIds(12345)), [666])
+        self.assertEqual(list(self.hasPart.getObjectIds(666)), [])
+        # storage from older versions
+        self.hasPart.relations[1] = [3, 2]
+        self.assertEqual(list(self.hasPart.getObjectIds(1)), [2, 3])
+
+
+    def test_getSubjectIds(self):
+        self.addTestRelations()
+        self.assertEqual(list(self.hasPart.getSubjectIds(666)), [12345])
+        self.assertEqual(list(self.hasPart.getSubjectIds(12345)), [])
+
+
+    def test_hasEdge(self):
+        self.assertEqual(self.hasPart.hasEdge(12345, 666), False)
+        self.addTestRelations()
+        self.assertEqual(self.hasPart.hasEdge(12345, 666), True)
+        self.assertEqual(self.hasPart.hasEdge(666, 12345), False)
+
+
+    def test_iterEdges(self):
+        self.assertEqual(list(self.hasPart.iterEdges()), [])
+        self.hasPart.addIds([(2, 1), (1, 3), (1, 2)])
+        self.assertEqual(list(self.hasPart.iterEdges()),
+                         [(1, 2), (1, 3), (2, 1)])
+
+
     def test_getStatements(self):
         subject = IVersionHistoryResource(self.proxy1)
         predicate = PrefixedResource('cps', 'hasPart')
@@ -230,6 +495,88 @@ class TestIOBtreeRelation(CPSRelationTestCase):
                          [statement])
 
 
+    def test_iterStatements(self):
+        subject = IVersionHistoryResource(self.proxy1)
+        predicate = PrefixedResource('cps', 'hasPart')
+        object = IVersionHistoryResource(self.proxy2)
+        iterator = self.hasPart.iterStatements()
+        self.assertEqual(list(iterator), [])
+        self.addTestRelations()
+        self.hasPart.add([(subject, subject)])
+        iterator = self.hasPart.iterStatements()
+        self.assertEqual(iterator.next(), Statement(subject, predicate, object))
+        self.assertEqual(iterator.next(),
+                         Statement(subject, predicate, subject))
+        self.assertRaises(StopIteration, iterator.next)
+        self.assertEqual(list(self.hasPart.iterStatements(object=object)),
+                         [Statement(subject, predicate, object)])
+
+
+    def test_countTuples(self):
+        subject = IVersionHistoryResource(self.proxy1)
+        object = IVersionHistoryResource(self.proxy2)
+        self.assertEqual(self.hasPart.countTuples(), 0)
+        self.assertEqual(self.hasPart.countTuples(subject=subject), 0)
+        self.addTestRelations()
+        self.hasPart.add([(subject, subject)])
+        self.assertEqual(self.hasPart.countTuples(), 2)
+        self.assertEqual(self.hasPart.countTuples(subject=subject), 2)
+        self.assertEqual(self.hasPart.countTuples(object=object), 1)
+        self.assertEqual(self.hasPart.countTuples(subject=object), 0)
+        self.assertEqual(self.hasPart.countTuples(subject, object), 1)
+        self.assertEqual(self.hasPart.countTuples(object, subject), 0)
+        self.assertEqual(self.hasPart.countObjectIds(999999), 0)
+        self.assertEqual(self.hasPart.countSubjectIds(999999), 0)
+
+
+    def test_cursors(self):
+        self.assertEqual(parse_cursor(None), None)
+        self.assertEqual(parse_cursor(make_cursor(12, 3)), (12, 3))
+        self.assertRaises(ValueError, parse_cursor, '12')
+        self.assertRaises(ValueError, parse_cursor, 'a:b')
+
+
+    def test_iterEdges_after(self):
+        self.hasPart.addIds([(1, 2), (1, 3), (2, 1), (3, 1)])
+        self.assertEqual(list(self.hasPart.iterEdges(after=(1, 2))),
+                         [(1, 3), (2, 1), (3, 1)])
+        self.assertEqual(list(self.hasPart.iterEdges(after=(1, 3))),
+                         [(2, 1), (3, 1)])
+        self.assertEqual(list(self.hasPart.iterEdges(after=(3, 1))), [])
+
+
+    def test_getStatementsPage(self):
+        subject = IVersionHistoryResource(self.proxy1)
+        predicate = PrefixedResource('cps', 'hasPart')
+        object = IVersionHistoryResource(self.proxy2)
+        self.assertEqual(self.hasPart.getStatementsPage(), ([], None))
+        self.addTestRelations()
+        self.hasPart.add([(subject, subject)])
+
+        page, cursor = self.hasPart.getStatementsPage(limit=1)
+        self.assertEqual(page, [Statement(subject, predicate, object)])
+        self.assertNotEqual(cursor, None)
+        page, cursor = self.hasPart.getStatementsPage(limit=1, cursor=cursor)
+        self.assertEqual(page, [Statement(subject, predicate, subject)])
+        self.assertEqual(cursor, None)
+
+        # patterns
+        page, cursor = self.hasPart.getStatementsPage(object=object)
+        self.assertEqual(page, [Statement(subject, predicate, object)])
+        self.assertEqual(cursor, None)
+        page, cursor = self.hasPart.getStatementsPage(subject=subject,
+                                                      limit=1)
+        page, cursor = self.hasPart.getStatementsPage(subject=subject,
+                                                      limit=1,
+                                                      cursor=cursor)
+        self.assertEqual(page, [Statement(subject, predicate, subject)])
+        self.assertEqual(cursor, None)
+        self.assertRaises(ValueError, self.hasPart.getStatementsPage,
+                          cursor='foo')
+        self.assertRaises(ValueError, self.hasPart.getStatementsPage,
+                          limit=0)
+
+
     def test_hasTuple(self):
         subject = IVersionHistoryResource(self.proxy1)
         object = IVersionHistoryResource(self.proxy2)
@@ -259,6 +606,15 @@ class TestIOBtreeRelation(CPSRelationTestCase):
         self.assertEqual(self.hasPart.hasTuple(subject=object,
                                                object=None),
                          False)
+        # objects are compared with nodes built by the relation
+        self.assertEqual(self.hasPart.hasTuple(
+            subject=subject, object=PrefixedResource('foo', '666')),
+                         False)
+        self.assertEqual(self.hasPart.hasTuple(
+            subject=subject, object=PrefixedResource('foo', 'bar')),
+                         False)
+        self.assertRaises(ValueError, self.hasPart.hasTuple,
+                          PrefixedResource('foo', 'bar'), object)
 
 
     def test_clear(self):
@@ -281,6 +637,88 @@ class TestIOBtreeRelation(CPSRelationTestCase):
         self.assertEqual(len(self.hasPart), 3)
 
 
+    def test___len___duplicates(self):
+        self.addTestRelations()
+        self.addTestRelations()
+        self.assertEqual(len(self.hasPart), 1)
+        self.hasPart.remove([(IVersionHistoryResource(self.proxy2),
+                              IVersionHistoryResource(self.proxy1))])
+        self.assertEqual(len(self.hasPart), 1)
+
+
+    def test_updateLength(self):
+        self.addTestRelations()
+        # relation created by an older version
+        del self.hasPart._length
+        self.assertEqual(self.hasPart._length, None)
+        self.assertEqual(len(self.hasPart), 1)
+        self.assertEqual(self.hasPart.updateLength(), 1)
+        self.assertEqual(len(self.hasPart), 1)
+        self.hasPart._add(1, 2)
+        self.assertEqual(len(self.hasPart), 2)
+        # desynchronized counter
+        self.hasPart._length.set(42)
+        self.assertEqual(self.hasPart.updateLength(), 2)
+        self.assertEqual(len(self.hasPart), 2)
+
+
+    def corrupt(self):
+        self.hasPart.addIds([(1, 2), (1, 3), (2, 3)])
+        # lost inverse tuple
+        self.hasPart.inverse_relations[3].remove(1)
+        # stale inverse tuple
+        self.hasPart._add(4, 1, inverse=True)
+
+    def test_check(self):
+        self.hasPart.addIds([(1, 2), (1, 3), (2, 3)])
+        report = self.hasPart.check()
+        self.assertEqual(report['consistent'], True)
+        self.assertEqual(report['statements'], 3)
+        self.assertEqual(report['missing_inverse'], [])
+        self.assertEqual(report['missing_direct'], [])
+        self.corrupt()
+        self.hasPart._length.set(42)
+        report = self.hasPart.check()
+        self.assertEqual(report['consistent'], False)
+        self.assertEqual(report['missing_inverse'], [(1, 3)])
+        self.assertEqual(report['missing_inverse_count'], 1)
+        self.assertEqual(report['missing_direct'], [(1, 4)])
+        self.assertEqual(report['missing_direct_count'], 1)
+        self.assertEqual(report['statements'], 3)
+        self.assertEqual(report['length'], 42)
+        report = self.hasPart.check(max_reported=0)
+        self.assertEqual(report['missing_inverse'], [])
+        self.assertEqual(report['missing_inverse_count'], 1)
+
+    def test_repair(self):
+        self.corrupt()
+        self.hasPart._length.set(42)
+        report = self.hasPart.repair()
+        self.assertEqual(report, {'added': 1,
+                                  'removed': 1,
+                                  'keys': 5,
+                                  'done': True,
+                                  })
+        self.assertEqual(self.getItems(self.hasPart.inverse_relations),
+                         [(2, [1]), (3, [1, 2])])
+        self.assertEqual(len(self.hasPart), 3)
+        self.assertEqual(self.hasPart.check()['consistent'], True)
+        self.assertEqual(self.hasPart._repair_checkpoint, None)
+
+    def test_repair_resume(self):
+        self.hasPart.addIds([(i, i + 1) for i in range(2500)])
+        self.hasPart.inverse_relations.clear()
+        report = self.hasPart.repair(max_keys=1000)
+        self.assertEqual(report['added'], 1000)
+        self.assertEqual(report['done'], False)
+        self.assertEqual(self.hasPart._repair_checkpoint, ('add', 999))
+        report = self.hasPart.repair()
+        self.assertEqual(report['added'], 1500)
+        self.assertEqual(report['done'], True)
+        self.assertEqual(self.hasPart._repair_checkpoint, None)
+        self.assertEqual(self.hasPart.check()['consistent'], True)
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestIOBtreeRelation))
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# Copyright (c) 2006 Nuxeo SAS <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""Test LRU cache
+"""
+
+import unittest
+
+from Products.CPSRelation.lrucache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(3)
+        for key in 'abc':
+            self.cache.set(key, key.upper())
+
+    def test_get(self):
+        self.assertEqual(self.cache.get('a'), 'A')
+        self.assertEqual(self.cache.get('d'), None)
+        self.assertEqual(self.cache.get('d', 'D'), 'D')
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 2)
+        # a is now the most recently used key
+        self.assertEqual(self.cache.keys(), ['b', 'c', 'a'])
+
+    def test_set(self):
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.keys(), ['a', 'b', 'c'])
+        self.cache.get('a')
+        self.cache.set('d', 'D')
+        # b was the least recently used key
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.keys(), ['c', 'a', 'd'])
+        self.assertEqual(self.cache.has_key('b'), False)
+        self.cache.set('c', 'C2')
+        self.assertEqual(self.cache.keys(), ['a', 'd', 'c'])
+        self.assertEqual(self.cache.get('c'), 'C2')
+
+    def test_clear(self):
+        self.cache.get('a')
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.keys(), [])
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(self.cache.get('a'), None)
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set('a', 'A')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.misses, 1)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestLRUCache))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
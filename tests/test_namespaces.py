@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# Copyright (c) 2006 Nuxeo SAS <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""Test namespace bindings resolution
+"""
+
+import unittest
+
+from Products.CPSRelation.namespaces import NamespaceResolver
+from Products.CPSRelation.namespaces import get_namespace_resolver
+
+
+class Dummy:
+    namespace_bindings = ()
+
+
+class TestNamespaceResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.resolver = NamespaceResolver((
+            "cps http://cps-project.org/",
+            "node http://cps-project.org/node/",
+            "dc http://purl.org/dc/elements/1.1/",
+            "invalid",
+            ))
+
+    def test_getBindings(self):
+        self.assertEqual(self.resolver.getBindings(), {
+            'cps': 'http://cps-project.org/',
+            'node': 'http://cps-project.org/node/',
+            'dc': 'http://purl.org/dc/elements/1.1/',
+            })
+        # a copy is returned
+        self.resolver.getBindings()['dc'] = 'http://example.org/'
+        self.assertEqual(self.resolver.getNamespace('dc'),
+                         'http://purl.org/dc/elements/1.1/')
+
+    def test_getNamespace(self):
+        self.assertEqual(self.resolver.getNamespace('node'),
+                         'http://cps-project.org/node/')
+        self.assertEqual(self.resolver.getNamespace('dummy'), None)
+        self.assertEqual(self.resolver.getNamespace('dummy', 'foo'), 'foo')
+
+    def test_split(self):
+        # longest namespace wins
+        self.assertEqual(self.resolver.split('http://cps-project.org/node/1'),
+                         ('node', '1'))
+        self.assertEqual(self.resolver.split('http://cps-project.org/nod'),
+                         ('cps', 'nod'))
+        self.assertEqual(self.resolver.split('http://cps-project.org/'),
+                         ('cps', ''))
+        self.assertEqual(
+            self.resolver.split('http://purl.org/dc/elements/1.1/title'),
+            ('dc', 'title'))
+        self.assertEqual(self.resolver.split('http://example.org/a'),
+                         (None, None))
+        self.assertEqual(self.resolver.split(''), (None, None))
+
+    def test_split_shared_namespace(self):
+        resolver = NamespaceResolver((
+            "b http://example.org/",
+            "a http://example.org/",
+            ))
+        self.assertEqual(resolver.split('http://example.org/x'), ('a', 'x'))
+
+    def test_get_namespace_resolver(self):
+        ob = Dummy()
+        resolver = get_namespace_resolver(ob)
+        self.assertEqual(resolver.getBindings(), {})
+        self.assert_(get_namespace_resolver(ob) is resolver)
+        ob.namespace_bindings = ("dc http://purl.org/dc/elements/1.1/",)
+        resolver = get_namespace_resolver(ob)
+        self.assertEqual(resolver.getBindings(),
+                         {'dc': 'http://purl.org/dc/elements/1.1/'})
+        self.assert_(get_namespace_resolver(ob) is resolver)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestNamespaceResolver))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
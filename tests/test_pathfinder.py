@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# Copyright (c) 2006 Nuxeo SAS <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""Test path finding
+"""
+
+import unittest
+
+from Products.CPSRelation.pathfinder import find_path
+
+
+class TestPathFinder(unittest.TestCase):
+
+    def setUp(self):
+        edges = [
+            ('a', 'b'), ('b', 'c'), ('c', 'a'), ('c', 'd'),
+            ('a', 'e'), ('e', 'f'), ('f', 'd'), ('d', 'g'),
+            ]
+        self.targets = {}
+        self.sources = {}
+        for source, target in edges:
+            self.targets.setdefault(source, []).append(target)
+            self.sources.setdefault(target, []).append(source)
+        self.expanded = []
+
+    def expand(self, key, inverse):
+        self.expanded.append(key)
+        if inverse:
+            related = self.sources.get(key, [])
+        else:
+            related = self.targets.get(key, [])
+        return [(x, 'edge') for x in related]
+
+    def getKeys(self, path):
+        return [(source, target) for source, edge, target in path]
+
+    def test_find_path(self):
+        path = find_path('a', 'g', self.expand)
+        self.assertEqual(len(path), 4)
+        self.assertEqual(path[0][0], 'a')
+        self.assertEqual(path[-1][2], 'g')
+        for i in range(len(path) - 1):
+            self.assertEqual(path[i][2], path[i+1][0])
+        self.assertEqual(self.getKeys(find_path('a', 'b', self.expand)),
+                         [('a', 'b')])
+        self.assertEqual(self.getKeys(find_path('c', 'b', self.expand)),
+                         [('c', 'a'), ('a', 'b')])
+
+    def test_find_path_none(self):
+        self.assertEqual(find_path('a', 'a', self.expand), [])
+        self.assertEqual(find_path('g', 'a', self.expand), None)
+        self.assertEqual(find_path('a', 'unknown', self.expand), None)
+
+    def test_find_path_limits(self):
+        self.assertEqual(find_path('a', 'g', self.expand, max_depth=3), None)
+        self.assertEqual(len(find_path('a', 'g', self.expand, max_depth=4)),
+                         4)
+        self.assertEqual(find_path('a', 'g', self.expand, max_visited=3),
+                         None)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestPathFinder))
+    return suite
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# Copyright (c) 2006 Nuxeo SAS <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""Test query results
+"""
+
+import unittest
+
+from zope.interface.verify import verifyClass
+
+from Products.CPSRelation.interfaces import IQueryResult
+from Products.CPSRelation.query import QueryResult
+from Products.CPSRelation.query import StreamingQueryResult
+
+
+class TestQueryResult(unittest.TestCase):
+
+    def setUp(self):
+        self.converted = []
+        self.rows = [{'x': i} for i in range(5)]
+
+    def convert(self, value):
+        self.converted.append(value)
+        return str(value)
+
+    def test_interface(self):
+        verifyClass(IQueryResult, QueryResult)
+        verifyClass(IQueryResult, StreamingQueryResult)
+
+    def test_QueryResult(self):
+        result = QueryResult(['x'], [{'x': '1'}], 1)
+        self.assertEqual(list(result), [{'x': '1'}])
+
+    def test_streaming(self):
+        result = StreamingQueryResult(['x'], iter(self.rows), self.convert)
+        self.assertEqual(result.variable_names, ['x'])
+        iterator = iter(result)
+        self.assertEqual(self.converted, [])
+        self.assertEqual(iterator.next(), {'x': '0'})
+        # values are converted while they are iterated
+        self.assertEqual(self.converted, [0])
+        self.assertEqual(len(list(iterator)), 4)
+        # rows are only read once
+        self.assertRaises(ValueError, iter, result)
+
+    def test_results(self):
+        result = StreamingQueryResult(['x'], iter(self.rows), self.convert)
+        self.assertEqual(result.count, 5)
+        self.assertEqual(result.results, [{'x': str(i)} for i in range(5)])
+        self.assertEqual(list(result), result.results)
+        self.assertEqual(self.converted, range(5))
+
+    def test_offset_limit(self):
+        result = StreamingQueryResult(['x'], iter(self.rows), self.convert,
+                                      offset=1, limit=2)
+        self.assertEqual(result.results, [{'x': '1'}, {'x': '2'}])
+        # skipped rows are not converted
+        self.assertEqual(self.converted, [1, 2])
+        result = StreamingQueryResult(['x'], iter(self.rows), self.convert,
+                                      offset=3)
+        self.assertEqual(result.count, 2)
+
+    def test_empty(self):
+        result = StreamingQueryResult(['x', 'y'], iter([]), self.convert)
+        self.assertEqual(result.count, 0)
+        self.assertEqual(result.variable_names, ['x', 'y'])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestQueryResult))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -41,6 +41,7 @@ else:
     # XXX if necessary, RDF has a debug mode:
     #RDF.debug(1)
     from Products.CPSRelation.redland.interfaces import IRedlandGraph
+    from Products.CPSRelation.redland import redlandgraph
     from Products.CPSRelation.redland.redlandgraph import RedlandGraph
 
 import os
@@ -113,6 +114,27 @@ class TestRedlandGraph(RedlandGraphTestCase):
         self.assert_(isinstance(self.graph._getGraph(), RDF.Model))
 
 
+    def test__getGraph_cache(self):
+        model = self.graph._getGraph()
+        counters = self.graph.getRebuildCounters()
+        # the model is kept between calls
+        self.assert_(self.graph._getGraph() is model)
+        self.assertEqual(self.graph.getRebuildCounters(), counters)
+        # storage and model are rebuilt after clear
+        self.graph.clear()
+        self.assert_(self.graph._getGraph() is not model)
+        new_counters = self.graph.getRebuildCounters()
+        self.assertEqual(new_counters['storages'], counters['storages'] + 1)
+        self.assertEqual(new_counters['models'], counters['models'] + 1)
+        # and after storage properties changes
+        model = self.graph._getGraph()
+        self.graph._v_storage_key = ('bdb', 'old_path')
+        self.assert_(self.graph._getGraph() is not model)
+        # or when the volatile attributes are dropped
+        model = self.graph._getGraph()
+        del self.graph._v_model
+        self.assert_(self.graph._getGraph() is not model)
+
     def test_getNamespaceBindings(self):
         bindings_dict = {
             "dc": "http://purl.org/dc/elements/1.1/",
@@ -239,6 +261,41 @@ class TestRedlandGraph(RedlandGraphTestCase):
         self.assertEqual(isinstance(vh, RpathResource), False)
 
 
+    def test__getCPSNode_longest_namespace(self):
+        bindings = self.namespace_bindings + (
+            "base http://cps-project.org/",)
+        self.graph.manage_changeProperties(namespace_bindings=bindings)
+        rnode = RDF.Node(uri_string='http://cps-project.org/node/foo')
+        node = self.graph._getCPSNode(rnode)
+        self.assertEqual(node.prefix, 'cps')
+        self.assertEqual(node.localname, 'foo')
+        rnode = RDF.Node(uri_string='http://cps-project.org/other')
+        node = self.graph._getCPSNode(rnode)
+        self.assertEqual(node.prefix, 'base')
+        self.assertEqual(node.localname, 'other')
+
+    def test_node_caches(self):
+        resource = PrefixedResource('cps', 'foo')
+        rnode = self.graph._getRedlandNode(resource)
+        self.assert_(self.graph._getRedlandNode(resource) is rnode)
+        node = self.graph._getCPSNode(rnode)
+        self.assert_(self.graph._getCPSNode(rnode) is node)
+        stats = self.graph.getNodeCacheStats()
+        self.assertEqual([x['id'] for x in stats], ['redland', 'cps'])
+        for cache_stats in stats:
+            self.assertEqual(cache_stats['size'], 1000)
+            self.assert_(cache_stats['hits'] >= 1)
+        # caches are rebuilt when their size or the bindings change
+        self.graph.manage_changeProperties(node_cache_size=0)
+        self.assert_(self.graph._getRedlandNode(resource) is not rnode)
+        self.assertEqual(self.graph.getNodeCacheStats()[0]['length'], 0)
+        self.graph.manage_changeProperties(node_cache_size=10)
+        rnode = self.graph._getRedlandNode(resource)
+        bindings = ("cps http://example.org/",)
+        self.graph.manage_changeProperties(namespace_bindings=bindings)
+        rnode = self.graph._getRedlandNode(resource)
+        self.assertEqual(str(rnode.uri), 'http://example.org/foo')
+
     def test__getRedlandStatement(self):
         statement = Statement(None, None, None)
         rstatement = RDF.Statement(None, None, None)
@@ -289,11 +346,229 @@ class TestRedlandGraph(RedlandGraphTestCase):
         self.assertEqual(self.graph.hasStatement(statement), False)
 
 
+    def test_add_batches(self):
+        self.graph.manage_changeProperties(write_batch_size=2)
+        statements = [Statement(PrefixedResource('cps', 'doc%s' % i),
+                                PrefixedResource('cps', 'hasPart'),
+                                PrefixedResource('cps', 'part'))
+                      for i in range(5)]
+        length = len(self.graph)
+        self.graph._add(iter(statements))
+        self.assertEqual(len(self.graph), length + 5)
+        self.graph._remove(iter(statements))
+        self.assertEqual(len(self.graph), length)
+
+    def test_add_transactions(self):
+        # fake a storage supporting transactions, keeping the memory model
+        self.graph._getGraph()
+        self.graph.backend = 'mysql'
+        self.graph._v_storage_key = self.graph._getStorageKey()
+        self.graph.manage_changeProperties(write_batch_size=2)
+        calls = []
+        results = {'start': 0, 'commit': 0}
+        def start(model):
+            calls.append('start')
+            return results['start']
+        def commit(model):
+            calls.append('commit')
+            return results['commit']
+        def rollback(model):
+            calls.append('rollback')
+            return 0
+        def fail(rdf_graph, rstatements):
+            raise ValueError("write failed")
+        def bulk_write(rdf_graph, rstatements):
+            calls.append('bulk')
+        faked = {
+            'librdf_model_transaction_start': start,
+            'librdf_model_transaction_commit': commit,
+            'librdf_model_transaction_rollback': rollback,
+            }
+        Redland = redlandgraph.Redland
+        old = {}
+        for name, func in faked.items():
+            old[name] = getattr(Redland, name, None)
+            setattr(Redland, name, func)
+        try:
+            statements = [Statement(PrefixedResource('cps', 'doc%s' % i),
+                                    PrefixedResource('cps', 'hasPart'),
+                                    PrefixedResource('cps', 'part'))
+                          for i in range(5)]
+            length = len(self.graph)
+            self.graph._add(iter(statements))
+            self.assertEqual(calls, ['start', 'commit'] * 3)
+            self.assertEqual(len(self.graph), length + 5)
+            # the transaction is rolled back when a write fails
+            del calls[:]
+            self.assertRaises(ValueError, self.graph._writeBatches,
+                              statements, fail)
+            self.assertEqual(calls, ['start', 'rollback'])
+            # commit failures are errors
+            del calls[:]
+            results['commit'] = 1
+            self.assertRaises(RDF.RedlandError, self.graph._remove,
+                              statements[:1])
+            self.assertEqual(calls, ['start', 'commit'])
+            # storages without transactions use bulk writes
+            del calls[:]
+            results['start'] = 1
+            self.graph._writeBatches(statements, fail, bulk_write)
+            self.assertEqual(calls, ['start', 'bulk'] * 3)
+        finally:
+            for name, func in old.items():
+                if func is None:
+                    delattr(Redland, name)
+                else:
+                    setattr(Redland, name, func)
+            self.graph.backend = 'memory'
+            self.graph._v_storage_key = self.graph._getStorageKey()
+
+
+    def test__addStatementsStream(self):
+        statement = Statement(PrefixedResource('cps', 'doc'),
+                              PrefixedResource('cps', 'hasPart'),
+                              PrefixedResource('cps', 'part'))
+        rdf_graph = self.graph._getGraph()
+        self.graph._addStatementsStream(
+            rdf_graph, [self.graph._getRedlandStatement(statement)])
+        self.assertEqual(self.graph.hasStatement(statement), True)
+
     def test_getStatements(self):
         self.assertEqual(self.graph.getStatements(), self.base_relations,
                          keep_order=False)
 
 
+    def test_iterStatements(self):
+        iterator = self.graph.iterStatements()
+        self.assertEqual(list(iterator), self.base_relations,
+                         keep_order=False)
+        statement = Statement(None, PrefixedResource('cps', 'techno'), None)
+        iterator = self.graph.iterStatements(statement)
+        self.assertEqual(iterator.next(), self.base_relations[1])
+        self.assertRaises(StopIteration, iterator.next)
+
+
+    def test_getStatementsPage(self):
+        page, cursor = self.graph.getStatementsPage(limit=2)
+        self.assertEqual(len(page), 2)
+        self.assertEqual(cursor, '2')
+        statements = list(page)
+        while cursor is not None:
+            page, cursor = self.graph.getStatementsPage(limit=2,
+                                                        cursor=cursor)
+            statements.extend(page)
+        self.assertEqual(statements, self.base_relations, keep_order=False)
+        statement = Statement(None, PrefixedResource('cps', 'techno'), None)
+        self.assertEqual(self.graph.getStatementsPage(statement),
+                         ([self.base_relations[1]], None))
+        self.assertRaises(ValueError, self.graph.getStatementsPage,
+                          limit=0)
+        self.assertRaises(ValueError, self.graph.getStatementsPage,
+                          cursor='foo')
+
+
+    def test_getContentsPage(self):
+        old_offset = redlandgraph.MAX_CONTENTS_OFFSET
+        redlandgraph.MAX_CONTENTS_OFFSET = 1
+        try:
+            page, previous, cursor = self.graph.getContentsPage(limit=1)
+            self.assertEqual(len(page), 1)
+            self.assertEqual(previous, None)
+            self.assertEqual(cursor, '1')
+            page, previous, cursor = self.graph.getContentsPage(cursor,
+                                                                limit=1)
+            self.assertEqual(len(page), 1)
+            self.assertEqual(previous, '0')
+            # paging stops at the maximum offset
+            self.assertEqual(cursor, None)
+            self.assertEqual(self.graph.getContentsPage('5', limit=1),
+                             (page, '0', None))
+            self.assertRaises(ValueError, self.graph.getContentsPage,
+                              limit=0)
+        finally:
+            redlandgraph.MAX_CONTENTS_OFFSET = old_offset
+
+
+    def test_getObjectsForMany(self):
+        subject = PrefixedResource('cps', 'cps')
+        predicate = PrefixedResource('cps', 'title')
+        res = self.graph.getObjectsForMany([subject, Resource('foo')],
+                                           predicate)
+        self.assertEqual(res, {
+            subject: [Literal('CPS Project')],
+            Resource('foo'): [],
+            })
+
+
+    def test_getSubjectsForMany(self):
+        subject = PrefixedResource('cps', 'cps')
+        predicate = PrefixedResource('cps', 'title')
+        literal = Literal('CPS Project')
+        res = self.graph.getSubjectsForMany(predicate, [literal])
+        self.assertEqual(res, {literal: [subject]})
+
+
+    def test_getRelatedForMany_nodes(self):
+        # literals and repeated nodes are looked up in the same stream
+        subject = PrefixedResource('cps', 'cps')
+        predicate = PrefixedResource('cps', 'title')
+        literal = Literal('CPS Project')
+        res = self.graph.getObjectsForMany([subject, Resource('foo'),
+                                            literal, subject], predicate)
+        self.assertEqual(res, {
+            subject: [literal],
+            Resource('foo'): [],
+            literal: [],
+            })
+        res = self.graph.getSubjectsForMany(predicate, [literal])
+        self.assertEqual(res, {literal: [subject]})
+
+
+    def test_findPath(self):
+        source = PrefixedResource('cps', 'cps')
+        self.assertEqual(self.graph.findPath(source, Literal('Zope/CPS')),
+                         self.base_relations[1:])
+        self.assertEqual(self.graph.findPath(source, Literal('Zope/CPS'),
+                                             [PrefixedResource('cps',
+                                                               'techno'),
+                                              PrefixedResource('cps',
+                                                               'title')]),
+                         self.base_relations[1:])
+        self.assertEqual(self.graph.findPath(source, Literal('Zope/CPS'),
+                                             max_depth=1),
+                         None)
+        self.assertEqual(self.graph.findPath(source, Literal('Zope/CPS'),
+                                             [PrefixedResource('cps',
+                                                               'title')]),
+                         None)
+        self.assertEqual(self.graph.findPath(source, source), [])
+
+
+    def test_countStatements(self):
+        self.assertEqual(self.graph.countStatements(),
+                         len(self.base_relations))
+        statement = Statement(None, PrefixedResource('cps', 'techno'), None)
+        self.assertEqual(self.graph.countStatements(statement), 1)
+        statement = Statement(None, Resource('foo'), None)
+        self.assertEqual(self.graph.countStatements(statement), 0)
+
+
+    def test_countSubjects(self):
+        predicate = PrefixedResource('cps', 'title')
+        literal = Literal('CPS Project')
+        self.assertEqual(self.graph.countSubjects(predicate, literal), 1)
+        self.assertEqual(self.graph.countSubjects(Resource('foo'), literal),
+                         0)
+
+
+    def test_countObjects(self):
+        subject = PrefixedResource('cps', 'cps')
+        predicate = PrefixedResource('cps', 'title')
+        self.assertEqual(self.graph.countObjects(subject, predicate), 1)
+        self.assertEqual(self.graph.countObjects(subject, Resource('foo')),
+                         0)
+
+
     def test_getSubjects(self):
         subject = PrefixedResource('cps', 'cps')
         predicate = PrefixedResource('cps', 'title')
@@ -452,6 +727,66 @@ WHERE {
         self.assertEqual(result.results, expected, keep_order=False)
 
 
+    def test_query_empty(self):
+        query = """
+PREFIX cps: <%s>
+SELECT ?subj, ?obj
+WHERE {
+  ?subj cps:dummy ?obj .
+}
+"""%(self.graph.getNamespaceBindings().get('cps'),)
+        result = self.graph.query(query, language='sparql')
+        # variable names are known even without results
+        self.assertEqual(result.variable_names, ['subj', 'obj'])
+        self.assertEqual(result.count, 0)
+        self.assertEqual(list(result), [])
+
+
+    def test_query_limit_offset(self):
+        query = """
+SELECT ?subj, ?pred, ?obj
+WHERE {
+  ?subj ?pred ?obj .
+}
+"""
+        all_results = self.graph.query(query, language='sparql').results
+        self.assertEqual(len(all_results), 3)
+        result = self.graph.query(query, language='sparql', limit=2)
+        self.assertEqual(result.count, 2)
+        result = self.graph.query(query, language='sparql', offset=1)
+        self.assertEqual(list(result), all_results[1:])
+        result = self.graph.query(query, language='sparql', limit=1,
+                                  offset=2)
+        self.assertEqual(result.results, all_results[2:])
+
+    def test_setQueryPage_offset_failure(self):
+        # the limit is reset when the offset cannot be set
+        class FakeQuery:
+            _query = 'query'
+        calls = []
+        def set_limit(query, limit):
+            calls.append(('limit', limit))
+            return 0
+        def set_offset(query, offset):
+            calls.append(('offset', offset))
+            return 1
+        Redland = redlandgraph.Redland
+        names = ('librdf_query_set_limit', 'librdf_query_set_offset')
+        old_functions = [getattr(Redland, name, None) for name in names]
+        Redland.librdf_query_set_limit = set_limit
+        Redland.librdf_query_set_offset = set_offset
+        try:
+            self.assertEqual(self.graph._setQueryPage(FakeQuery(), 1, 2),
+                             False)
+        finally:
+            for name, function in zip(names, old_functions):
+                if function is None:
+                    delattr(Redland, name)
+                else:
+                    setattr(Redland, name, function)
+        self.assertEqual(calls, [('limit', 1), ('offset', 2),
+                                 ('limit', -1)])
+
     def test_query_order(self):
         namespace_bindings = (
             "cps http://cps-project.org/node/",
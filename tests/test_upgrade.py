@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# Copyright (c) 2006 Nuxeo SAS <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""Tests for CPSRelation upgrade steps
+"""
+
+import unittest
+
+from BTrees.IIBTree import IITreeSet
+
+from Products.CPSRelation.relationtool import RelationTool
+from Products.CPSRelation.upgrade import upgrade_iobtree_storage
+from Products.CPSRelation.tests.CPSRelationTestCase import CPSRelationTestCase
+
+
+class TestUpgrade(CPSRelationTestCase):
+
+    def setUp(self):
+        CPSRelationTestCase.setUp(self)
+        self.folder._setObject('portal_relations', RelationTool())
+        self.rtool = self.folder.portal_relations
+
+    def test_upgrade_iobtree_storage(self):
+        self.rtool.addGraph('iobtreegraph', 'IOBTree Graph')
+        graph = self.rtool.getGraph('iobtreegraph')
+        graph.addRelation('hasPart')
+        relation = graph._getRelation('hasPart')
+        # storage of an older version
+        relation.relations[1] = [2, 3]
+        relation.inverse_relations[2] = [1]
+        relation.inverse_relations[3] = [1]
+        del relation._length
+        graph._resources = None
+        upgrade_iobtree_storage(self.folder)
+        self.assert_(isinstance(relation.relations[1], IITreeSet))
+        self.assert_(isinstance(relation.inverse_relations[2], IITreeSet))
+        self.assertEqual(len(relation), 2)
+        self.assertEqual(list(graph.listResourceIds()), [1, 2, 3])
+
+    def test_upgrade_without_tool(self):
+        self.folder._delObject('portal_relations')
+        upgrade_iobtree_storage(self.folder)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestUpgrade))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,49 @@
+# Copyright (c) 2006 Nuxeo SAS <http://nuxeo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 as published
+# by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA
+# 02111-1307, USA.
+#
+#-------------------------------------------------------------------------------
+# $Id$
+#-------------------------------------------------------------------------------
+"""Upgrade steps of CPSRelation
+"""
+
+import logging
+
+from Products.CMFCore.utils import getToolByName
+
+logger = logging.getLogger("CPSRelation.upgrade")
+
+
+def upgrade_iobtree_storage(portal):
+    """Upgrade the storage of the relations of all IOBTree graphs
+
+    Adjacency lists stored by older versions are converted to integer sets,
+    and statements counters and graph indexes are built, see
+    IOBTreeGraph.upgradeStorage.
+    """
+    rtool = getToolByName(portal, 'portal_relations', None)
+    if rtool is None:
+        return "No relation tool, nothing to upgrade"
+    count = 0
+    for graph_id in rtool.listGraphIds():
+        graph = rtool.getGraph(graph_id)
+        if graph.meta_type != 'IOBTree Graph':
+            continue
+        converted = graph.upgradeStorage()
+        logger.info("Upgraded storage of graph %s: %s entries converted"
+                    % (graph_id, converted))
+        count += converted
+    return "Upgraded IOBTree graphs storage: %s entries converted" % count